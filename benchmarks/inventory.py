@@ -0,0 +1,92 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compare parsing a large synthetic objects.inv with and without the fast path
+for inventory lines.
+
+Run as ``python benchmarks/inventory.py [NUM_ENTRIES]``.
+"""
+
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+import zlib
+
+from pathlib import Path
+from unittest import mock
+
+from doc2dash.parsers import intersphinx_inventory
+
+
+def write_inventory(path: Path, num: int) -> None:
+    """
+    Write an inventory with *num* entries that looks like one of a big API
+    project: mostly dotted names and every 50th a glossary term with spaces.
+    """
+    lines = []
+    for i in range(num):
+        if i % 50:
+            name = f"project.module{i % 97}.Class{i % 1013}.method_{i}"
+            lines.append(f"{name} py:method 1 api/module{i % 97}.html#$ -")
+        else:
+            lines.append(
+                f"some glossary term {i} std:term -1 "
+                f"glossary.html#term-some-glossary-term-{i} -"
+            )
+
+    (path / "objects.inv").write_bytes(
+        b"# Sphinx inventory version 2\n"
+        b"# Project: Benchmark\n"
+        b"# Version: 1.0\n"
+        b"# The remainder of this file is compressed using zlib.\n"
+        + zlib.compress("\n".join(lines).encode())
+    )
+
+
+def regex_only(line: str) -> tuple[str, ...] | None:
+    m = intersphinx_inventory._match_inv_line(line)
+
+    return m.groups() if m else None
+
+
+def bench(source: Path, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        intersphinx_inventory.load_inventory(source)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main() -> None:
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+
+    with (
+        tempfile.TemporaryDirectory() as tmp,
+        mock.patch.object(
+            intersphinx_inventory,
+            "CachedFileExists",
+            lambda *_: lambda _: True,
+        ),
+    ):
+        source = Path(tmp)
+        write_inventory(source, num)
+
+        fast = bench(source, 5)
+        with mock.patch.object(
+            intersphinx_inventory, "_parse_line", regex_only
+        ):
+            slow = bench(source, 5)
+
+    print(f"{num:,} entries, best of 5:")
+    print(f"  regex only: {slow:.3f}s")
+    print(f"  fast path:  {fast:.3f}s ({slow / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Compare the peak memory of collecting the entries of a large synthetic
+inventory for patching as a dict of lists of tuples and as `PendingEntries`.
+
+Run as ``python benchmarks/patch_entries.py [NUM_ENTRIES]``.
+"""
+
+from __future__ import annotations
+
+import sys
+import tracemalloc
+
+from collections import defaultdict
+from typing import Callable, Iterator
+
+from doc2dash.parsers.patcher import PendingEntries
+from doc2dash.parsers.types import EntryType
+
+
+def entries(num: int) -> Iterator[tuple[str, str, EntryType, str]]:
+    """
+    Yield *num* entries that look like the ones of a big API project.
+
+    Like the parsers do, every entry gets fresh strings.
+    """
+    for i in range(num):
+        name = f"project.module{i % 97}.Class{i % 1013}.method_{i}"
+        yield f"api/module{i % 97}.html", name, EntryType.METHOD, name
+
+
+def collect_dict(num: int) -> object:
+    files = defaultdict(list)
+    for fname, name, type, anchor in entries(num):
+        files[fname].append((name, type, anchor))
+
+    return files
+
+
+def collect_pending(num: int) -> object:
+    files = PendingEntries()
+    for fname, name, type, anchor in entries(num):
+        files.append(fname, name, type, anchor)
+
+    return files
+
+
+def peak(collect: Callable[[int], object], num: int) -> int:
+    tracemalloc.start()
+    try:
+        collected = collect(num)  # noqa: F841
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> None:
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+
+    before = peak(collect_dict, num)
+    after = peak(collect_pending, num)
+
+    print(f"{num:,} entries, peak memory:")
+    print(f"  dict of tuples:  {before / 2**20:,.1f} MiB")
+    print(
+        f"  PendingEntries:  {after / 2**20:,.1f} MiB "
+        f"({before / after:.1f}x less)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,13 @@
 
 from __future__ import annotations
 
+import contextlib
 import errno
 import importlib
+import json
 import logging
 import logging.config
 import os
-import shutil
 import subprocess
 
 from importlib import metadata
@@ -18,9 +19,13 @@ from typing import Any
 
 import click
 
-from . import docsets, parsers
-from .convert import convert_docs
-from .output import create_log_config, error_console
+from . import docsets, parsers, stats
+from .archive import write_tarix, write_tgz
+from .convert import convert_docs, update_docs
+from .copying import CopyMode, Excludes
+from .output import console, create_log_config, error_console
+from .parsers.intersphinx import HTML_PARSERS, PATCH_ENGINES
+from .parsers.intersphinx_inventory import DEFAULT_CACHE_SIZE, InventoryCache
 from .parsers.types import Parser
 
 
@@ -55,6 +60,24 @@ class ImportableType(click.ParamType):
 IMPORTABLE = ImportableType()
 
 
+class PageSizeType(click.IntRange):
+    """
+    A SQLite page size: a power of two between 512 and 65536.
+    """
+
+    name = "page size"
+
+    def __init__(self) -> None:
+        super().__init__(min=512, max=65536)
+
+    def convert(self, value: Any, param: Any, ctx: Any) -> int:
+        rv: int = super().convert(value, param, ctx)
+        if rv & (rv - 1):
+            self.fail(f"{rv} is not a power of two.", param, ctx)
+
+        return rv
+
+
 @click.command()
 @click.argument(
     "source",
@@ -150,6 +173,136 @@ IMPORTABLE = ImportableType()
     help="Whether full-text search should be 'on' or 'off by default. "
     "Or whether it's 'forbidden' to switch it on by the user at all.",
 )
+@click.option(
+    "--jobs",
+    "-J",
+    type=click.IntRange(min=1),
+    metavar="N",
+    help="Patch files for tables of contents using N processes. "
+    "Defaults to the number of CPUs.",
+)
+@click.option(
+    "--html-parser",
+    type=click.Choice(HTML_PARSERS),
+    help="The BeautifulSoup HTML parser that is used for patching files. "
+    "'auto' uses 'lxml' if it's installed. Falls back to 'html.parser' if "
+    "the requested parser is not installed.  [default: html.parser]",
+)
+@click.option(
+    "--patch-engine",
+    type=click.Choice(PATCH_ENGINES),
+    help="How files are patched for tables of contents. 'soup' re-serializes "
+    "each file from a parsed document tree; 'splice' inserts the anchors into "
+    "the otherwise unchanged file; 'scan' does the same, but finds most "
+    "anchors in a single scan of the raw HTML.  [default: soup]",
+)
+@click.option(
+    "--prescan",
+    is_flag=True,
+    help="Scan SOURCE once up front instead of checking the existence of "
+    "each indexed file separately. Much faster on network file systems, but "
+    "always case-sensitive.",
+)
+@click.option(
+    "--inventory-cache",
+    type=click.Path(file_okay=False, path_type=Path),
+    metavar="DIR",
+    help="Cache parsed intersphinx inventories in DIR, keyed by their "
+    "contents.",
+)
+@click.option(
+    "--inventory-cache-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CACHE_SIZE // 2**20,
+    show_default=True,
+    metavar="MIB",
+    help="Evict the least recently used inventories once the cache grows "
+    "larger than this.",
+)
+@click.option(
+    "--fused-copy",
+    is_flag=True,
+    help="Write patched files straight from SOURCE into the docset instead "
+    "of copying them first and rewriting them afterwards.",
+)
+@click.option(
+    "--vacuum",
+    is_flag=True,
+    help="Compact the search index database after building it.",
+)
+@click.option(
+    "--page-size",
+    type=PageSizeType(),
+    metavar="BYTES",
+    help="The page size of the search index database when using --vacuum. "
+    "Must be a power of two.",
+)
+@click.option(
+    "--copy-mode",
+    type=CopyMode,
+    default=CopyMode.COPY,
+    help="How files are copied into the docset: 'copy' copies, 'hardlink' "
+    "hardlinks, and 'reflink' clones them using copy-on-write. 'auto' clones "
+    "if the file system supports it and copies otherwise. Patched files "
+    "always get their own copy.  [default: copy]",
+)
+@click.option(
+    "--copy-workers",
+    type=click.IntRange(min=1),
+    metavar="N",
+    help="Copy files into the docset using N threads. Defaults to the number "
+    "of CPUs plus 4, but at most 32.",
+)
+@click.option(
+    "--exclude",
+    "-x",
+    "exclude_patterns",
+    multiple=True,
+    metavar="GLOB",
+    help="Leave files matching GLOB out of the docset. Patterns without a '/' "
+    "match names anywhere in SOURCE, patterns with a '/' match paths relative "
+    "to it. Can be passed multiple times.",
+)
+@click.option(
+    "--exclude-defaults",
+    is_flag=True,
+    help="Leave out files that the parser knows Dash doesn't need -- e.g. "
+    "'_sources' and '.buildinfo' for Sphinx.",
+)
+@click.option(
+    "--update",
+    is_flag=True,
+    help="Update an existing docset in place: only copy and patch files "
+    "that changed since the last update, and only rewrite changed index "
+    "entries.",
+)
+@click.option(
+    "--archive",
+    is_flag=True,
+    help="Additionally pack the docset into NAME.tgz next to it, e.g. for "
+    "docset feeds. Compresses using as many threads as --jobs.",
+)
+@click.option(
+    "--tarix",
+    is_flag=True,
+    help="Store the documentation inside the docset as a tarix archive "
+    "that Dash reads without unpacking it.",
+)
+@click.option(
+    "--stats",
+    "show_stats",
+    is_flag=True,
+    help="Print how much time and CPU each stage of the conversion took -- "
+    "including the threads and processes that copy and patch files -- and how "
+    "much it got done. Stages run concurrently, so their times can add up to "
+    "more than the total.",
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(dir_okay=False, path_type=Path),
+    metavar="PATH",
+    help="Write the statistics of --stats as JSON to PATH.",
+)
 @click.version_option(version=metadata.version("doc2dash"))
 def main(
     source: Path,
@@ -168,6 +321,24 @@ def main(
     playground_url: str | None,
     parser_type: type[Parser] | None,
     full_text_search: docsets.FullTextSearch,
+    jobs: int | None,
+    html_parser: str | None,
+    patch_engine: str | None,
+    prescan: bool,
+    inventory_cache: Path | None,
+    inventory_cache_size: int,
+    fused_copy: bool,
+    vacuum: bool,
+    page_size: int | None,
+    copy_mode: CopyMode,
+    copy_workers: int | None,
+    exclude_patterns: tuple[str, ...],
+    exclude_defaults: bool,
+    update: bool,
+    archive: bool,
+    tarix: bool,
+    show_stats: bool,
+    stats_json: Path | None,
 ) -> None:
     """
     Convert docs from SOURCE to Dash's docset format.
@@ -178,6 +349,23 @@ def main(
         )
         raise SystemExit(1)
 
+    if force and update:
+        error_console.print(
+            "Passing both --force and --update makes no sense."
+        )
+        raise SystemExit(1)
+
+    if tarix and update:
+        error_console.print(
+            "Passing both --tarix and --update makes no sense."
+        )
+        raise SystemExit(1)
+
+    if page_size is not None and not vacuum:
+        raise click.BadParameter(
+            "only works together with --vacuum.", param_hint="'--page-size'"
+        )
+
     logging.config.dictConfig(create_log_config(verbose=verbose, quiet=quiet))
 
     if icon:
@@ -217,58 +405,170 @@ def main(
     if name is None:
         name = detected_name
 
-    dest = setup_destination(
-        destination,
-        name,
-        add_to_global=add_to_global,
-        force=force,
-    )
-    docset = docsets.prepare_docset(
-        source,
-        dest,
-        name,
-        index_page,
-        enable_js,
-        online_redirect_url,
-        playground_url,
-        icon,
-        icon_2x,
-        full_text_search,
-    )
-
-    parser = parser_type(docset.docs)
-
-    log.info(
-        "Converting [b]%s[/b] docs from '%s' to '%s'.",
-        parser.name,
-        source,
-        dest,
-    )
-
-    convert_docs(parser=parser, docset=docset, quiet=quiet)
+    if exclude_defaults:
+        exclude_patterns = (
+            *getattr(parser_type, "exclude_profile", ()),
+            *exclude_patterns,
+        )
+    excludes = Excludes(exclude_patterns)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if copy_workers is None:
+        copy_workers = min(32, (os.cpu_count() or 1) + 4)
+
+    with (
+        stats.recording()
+        if show_stats or stats_json
+        else contextlib.nullcontext()
+    ) as recorded:
+        dest = setup_destination(
+            destination,
+            name,
+            add_to_global=add_to_global,
+            force=force,
+            update=update,
+        )
+        # Updates happen in place, everything else is built next to *dest*.
+        with (
+            contextlib.nullcontext(dest)
+            if update
+            else docsets.build_atomically(dest)
+        ) as build_path:
+            docset = docsets.prepare_docset(
+                source,
+                build_path,
+                name,
+                index_page,
+                enable_js,
+                online_redirect_url,
+                playground_url,
+                icon,
+                icon_2x,
+                full_text_search,
+                copy_docs=not (fused_copy or update),
+                copy_mode=copy_mode,
+                copy_workers=copy_workers,
+                excludes=excludes,
+                update=update,
+            )
+
+            parser_options: dict[str, Any] = {}
+            if html_parser is not None:
+                parser_options["html_parser"] = html_parser
+            if patch_engine is not None:
+                parser_options["patch_engine"] = patch_engine
+            if prescan:
+                parser_options["prescan"] = True
+            if inventory_cache is not None:
+                parser_options["inventory_cache"] = InventoryCache(
+                    inventory_cache, inventory_cache_size * 2**20
+                )
+
+            parser = make_parser(parser_type, source, parser_options)
+
+            log.info(
+                "Converting [b]%s[/b] docs from '%s' to '%s'.",
+                parser.name,
+                source,
+                dest,
+            )
+
+            if update:
+                update_docs(
+                    parser=parser,
+                    docset=docset,
+                    source=source,
+                    quiet=quiet,
+                    jobs=jobs,
+                    copy_mode=copy_mode,
+                    copy_workers=copy_workers,
+                    excludes=excludes,
+                    vacuum=vacuum,
+                    page_size=page_size,
+                )
+            else:
+                convert_docs(
+                    parser=parser,
+                    docset=docset,
+                    quiet=quiet,
+                    jobs=jobs,
+                    source=source if fused_copy else None,
+                    vacuum=vacuum,
+                    page_size=page_size,
+                    excludes=excludes,
+                    # tarix docsets can't be updated.
+                    manifest_source=None if tarix else source,
+                )
+            if fused_copy and not update:
+                docsets.copy_docs(
+                    source, docset.docs, copy_mode, copy_workers, excludes
+                )
+
+            docset.db_conn.close()
+
+            if tarix:
+                log.info("Compressing documentation...")
+                with stats.stage("tarix"):
+                    write_tarix(build_path, workers=jobs)
+
+        if archive:
+            log.info("Packing docset...")
+            with stats.stage("archive"):
+                write_tgz(dest, dest.with_suffix(".tgz"), workers=jobs)
+
+    if recorded is not None:
+        if show_stats:
+            console.print(recorded.to_table())
+        if stats_json:
+            stats_json.write_text(json.dumps(recorded.as_dict(), indent=2))
 
     if add_to_dash or add_to_global:
         log.info("Adding to Dash...")
         subprocess.check_output(("open", "-a", "dash", dest))  # noqa: S603
 
 
+def make_parser(
+    parser_type: type[Parser], source: Path, options: dict[str, Any]
+) -> Parser:
+    """
+    Instantiate *parser_type* for *source*.
+
+    *options* are only passed if they're set, so custom parsers that don't
+    know about them keep working as long as they're not used.
+    """
+    if not options:
+        return parser_type(source)
+
+    try:
+        return parser_type(source, **options)
+    except TypeError:
+        log.error(
+            "Parser %r doesn't support the option(s): %s.",
+            parser_type,
+            ", ".join(f"--{o.replace('_', '-')}" for o in sorted(options)),
+        )
+        raise SystemExit(errno.EINVAL) from None
+
+
 def setup_destination(
     destination: Path,
     name: str,
     add_to_global: bool,
     force: bool,
+    update: bool = False,
 ) -> Path:
     """
     Determine source and destination using the options.
+
+    An existing destination is only allowed if *force* -- in which case it's
+    replaced once the new docset is built -- or *update* is True.
     """
     if add_to_global:
         destination = DEFAULT_DOCSET_PATH
 
     dest = (destination / name).with_suffix(".docset")
-    dst_exists = os.path.lexists(dest)
-    if dst_exists and force:
-        shutil.rmtree(dest)
-    elif dst_exists:
+    if os.path.lexists(dest) and not (force or update):
         log.error('Destination path "%s" already exists.', dest)
 
         raise SystemExit(errno.EEXIST)
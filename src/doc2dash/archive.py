@@ -0,0 +1,285 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Pack docsets into gzipped tar archives using all CPUs.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import sqlite3
+import struct
+import tarfile
+import zlib
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
+
+
+TARIX_ARCHIVE = "tarix.tgz"
+TARIX_INDEX = "tarixIndex.db"
+
+# Magic, deflate, no flags, no mtime, no extra flags, unknown OS.
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+# How far back deflate can refer.
+_WINDOW_SIZE = 2**15
+
+
+class ParallelGzipWriter:
+    """
+    A write-only binary file that gzips its contents into *fileobj* using a
+    pool of *workers* threads.
+
+    The data is cut into blocks of *block_size* bytes that are compressed in
+    parallel. Like ``pigz``, each block is primed with the last 32 KiB of the
+    data before it, so the result compresses about as well as a serial
+    stream. If *independent* is True, blocks are compressed independently --
+    like ``pigz --independent`` -- such that decompression can start at any
+    block.
+
+    Either way, the result is a single standard gzip stream.
+
+    Leaving it as a context manager closes it -- unless there was an error,
+    in which case only the pool is shut down.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        *,
+        workers: int = 1,
+        block_size: int = 2**20,
+        level: int = 6,
+        independent: bool = False,
+    ):
+        self._fileobj = fileobj
+        self._block_size = block_size
+        self._level = level
+        self._independent = independent
+        self._window = b""
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._max_pending = 2 * workers
+        self._pending: deque[Future[bytes]] = deque()
+        self._buf = bytearray()
+        self._crc = 0
+        self._size = 0
+        self._num_blocks = 0
+        self._block_offsets: list[int] = []
+        self._offset = len(_GZIP_HEADER)
+
+        fileobj.write(_GZIP_HEADER)
+
+    def __enter__(self) -> ParallelGzipWriter:
+        return self
+
+    def __exit__(self, exc_type: object, *_: object) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(cancel_futures=True)
+
+    def write(self, data: bytes) -> int:
+        self._buf += data
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        while len(self._buf) >= self._block_size:
+            self._submit(bytes(self._buf[: self._block_size]))
+            del self._buf[: self._block_size]
+
+        return len(data)
+
+    def tell(self) -> int:
+        """
+        Return the uncompressed position.
+        """
+        return self._size
+
+    def start_block(self) -> int:
+        """
+        Make the data that is written next start a new block.
+
+        Decompression can only start at it if the writer is *independent*.
+
+        Returns:
+            The number of the new block -- see `block_offset()`.
+        """
+        if self._buf:
+            self._submit(bytes(self._buf))
+            self._buf.clear()
+
+        return self._num_blocks
+
+    def block_offset(self, block: int) -> int:
+        """
+        Return the offset of *block* within the compressed file.
+
+        Only valid after `close()`.
+        """
+        return self._block_offsets[block]
+
+    def close(self) -> None:
+        """
+        Finish the gzip stream. *fileobj* is not closed.
+        """
+        try:
+            self.start_block()
+            while self._pending:
+                self._write_compressed()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+
+        self._fileobj.write(
+            zlib.compressobj(
+                self._level, zlib.DEFLATED, -zlib.MAX_WBITS
+            ).flush()
+        )
+        self._fileobj.write(
+            struct.pack("<II", self._crc, self._size & 0xFFFFFFFF)
+        )
+
+    def _submit(self, block: bytes) -> None:
+        if len(self._pending) >= self._max_pending:
+            self._write_compressed()
+
+        self._pending.append(
+            self._pool.submit(_deflate, block, self._level, self._window)
+        )
+        self._num_blocks += 1
+        if not self._independent:
+            self._window = (self._window + block)[-_WINDOW_SIZE:]
+
+    def _write_compressed(self) -> None:
+        data = self._pending.popleft().result()
+        self._fileobj.write(data)
+        self._block_offsets.append(self._offset)
+        self._offset += len(data)
+
+
+def _deflate(block: bytes, level: int, window: bytes) -> bytes:
+    """
+    Compress *block* into raw deflate data that ends on a byte boundary and
+    may refer back into *window* -- the data right before it.
+    """
+    if window:
+        c = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=window
+        )
+    else:
+        c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    return c.compress(block) + c.flush(zlib.Z_FULL_FLUSH)
+
+
+def write_tgz(root: Path, archive: Path, *, workers: int = 1) -> None:
+    """
+    Pack the tree at *root* into the gzipped tar *archive* using *workers*
+    threads for compression.
+
+    *archive* is replaced atomically.
+    """
+    tmp = archive.with_name(f".{archive.name}.tmp")
+    try:
+        with tmp.open("wb") as f:
+            _write_tar(f, root, root.name, workers)
+        os.replace(tmp, archive)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def write_tarix(docset: Path, *, workers: int = 1) -> None:
+    """
+    Replace the documentation files of *docset* by a tarix archive that Dash
+    can read without unpacking it.
+
+    Dash then needs ``tarix.tgz`` and ``tarixIndex.db`` next to the search
+    index: the latter maps every path in the former to
+    ``<tar block> <compressed offset> <number of tar blocks>``.
+    """
+    resources = docset / "Contents" / "Resources"
+    docs = resources / "Documents"
+
+    with (resources / TARIX_ARCHIVE).open("wb") as f:
+        index = _write_tar(
+            f,
+            docs,
+            f"{docset.name}/Contents/Resources/Documents",
+            workers,
+            index=True,
+        )
+
+    db_conn = sqlite3.connect(resources / TARIX_INDEX)
+    with db_conn:
+        db_conn.execute(
+            "CREATE TABLE tarindex(path TEXT PRIMARY KEY COLLATE NOCASE, "
+            "hash TEXT)"
+        )
+        db_conn.executemany("INSERT INTO tarindex VALUES (?, ?)", index)
+    db_conn.close()
+
+    shutil.rmtree(docs)
+
+
+def _write_tar(
+    f: BinaryIO, root: Path, arcroot: str, workers: int, *, index: bool = False
+) -> list[tuple[str, str]]:
+    """
+    Write a gzipped tar of *root* into *f*, storing it as *arcroot*.
+
+    If *index* is True, each member starts a new, independently compressed
+    block -- as tarix needs it.
+
+    Returns:
+        The tarix index entries for all members if *index* is True, an empty
+        list otherwise.
+    """
+    members = []
+    with (
+        ParallelGzipWriter(f, workers=workers, independent=index) as gz,
+        tarfile.TarFile(
+            mode="w",
+            fileobj=gz,  # type: ignore[arg-type]
+            format=tarfile.GNU_FORMAT,
+        ) as tar,
+    ):
+        for path in _walk_sorted(root):
+            rel = path.relative_to(root).as_posix()
+            arcname = arcroot if rel == "." else f"{arcroot}/{rel}"
+            if not index:
+                tar.add(path, arcname, recursive=False)
+                continue
+
+            block = gz.start_block()
+            start = gz.tell()
+
+            tar.add(path, arcname, recursive=False)
+
+            members.append((arcname, block, start, gz.tell()))
+
+    return [
+        (
+            arcname,
+            f"{start // tarfile.BLOCKSIZE} {gz.block_offset(block)} "
+            f"{(end - start) // tarfile.BLOCKSIZE}",
+        )
+        for arcname, block, start, end in members
+    ]
+
+
+def _walk_sorted(root: Path) -> list[Path]:
+    """
+    Return *root* and everything below it in a stable order that lists
+    directories before their contents.
+    """
+    paths = [root]
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        paths.extend(Path(dirpath) / d for d in dirnames)
+        paths.extend(Path(dirpath) / fn for fn in sorted(filenames))
+
+    return paths
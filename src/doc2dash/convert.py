@@ -5,43 +5,422 @@
 from __future__ import annotations
 
 import logging
+import queue
+import sqlite3
+import threading
+import urllib.parse
 
-from doc2dash.parsers.types import Parser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
 
+from doc2dash.parsers.types import Parser, ParserEntry
+
+from . import docsets, stats
+from .copying import CopyMode, Excludes, copy_files, make_copy_function
 from .docsets import DocSet
-from .parsers.patcher import patch_anchors
+from .manifest import (
+    MANIFEST_NAME,
+    AnchorDigests,
+    Manifest,
+    hash_files,
+    walk_files,
+)
+from .parsers.patcher import patch_anchors, split_anchor
 
 
 log = logging.getLogger(__name__)
 
+DEFAULT_BATCH_SIZE = 10_000
+# Batches that may wait for the index writer before parsing blocks.
+_MAX_PENDING_BATCHES = 8
+
+# Trade durability for speed while building the index: if we crash, the
+# docset is garbage anyway.
+_BULK_LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": "-65536",  # 64 MiB
+}
+
 
 def convert_docs(
     *,
     parser: Parser,
     docset: DocSet,
     quiet: bool,
+    jobs: int = 1,
+    source: Path | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    vacuum: bool = False,
+    page_size: int | None = None,
+    excludes: Excludes | None = None,
+    manifest_source: Path | None = None,
 ) -> None:
     """
     User *parser* to parse, index, and patch *docset*.
+
+    Patch files using *jobs* processes.
+
+    If *source* is passed, files to patch are read from there and written
+    straight into *docset*.
+
+    Index entries are inserted in batches of *batch_size* by a separate
+    thread while parsing goes on. Once all are in, that thread creates the
+    lookup index while the files are patched. In-memory and temporary
+    databases can't be opened by another connection, so their batches are
+    inserted using *docset*'s connection once the files are patched. Finally, if
+    *vacuum* is True, the database is compacted -- optionally using
+    *page_size*.
+
+    Entries that point into files matched by *excludes* are dropped.
+
+    If *manifest_source* is passed, a manifest of the files in it is written
+    into *docset*, such that `update_docs` only touches what changes later.
+    The files are hashed while parsing goes on.
     """
     log.info("Parsing documentation...")
-    with docset.db_conn:
-        toc = patch_anchors(parser, docset.docs, show_progressbar=not quiet)
-        next(toc)
-
-        for entry in parser.parse():
-            docset.db_conn.execute(
-                "INSERT INTO searchIndex VALUES (NULL, ?, ?, ?)",
-                entry.as_tuple(),
+    digests = AnchorDigests() if manifest_source is not None else None
+    db_path = _db_path(docset.db_conn)
+    batches: queue.Queue[list[tuple[str, str, str]] | None] = queue.Queue(
+        maxsize=_MAX_PENDING_BATCHES if db_path else 0
+    )
+    abort = threading.Event()
+    with (
+        ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="doc2dash-index"
+        ) as pool,
+        ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="doc2dash-hash"
+        ) as hash_pool,
+    ):
+        index = (
+            pool.submit(_write_index_to, db_path, batches, abort)
+            if db_path
+            else None
+        )
+        hashes = (
+            hash_pool.submit(hash_files, manifest_source, excludes, jobs)
+            if manifest_source is not None
+            else None
+        )
+        try:
+            toc = patch_anchors(
+                parser,
+                docset.docs,
+                show_progressbar=not quiet,
+                jobs=jobs,
+                source=source,
             )
-            toc.send(entry)
+            next(toc)
+
+            num_entries = num_excluded = 0
+            batch = []
+            with stats.stage("parse", "entries"):
+                for entry in parser.parse():
+                    if _is_excluded(entry, excludes):
+                        num_excluded += 1
+                        continue
 
-        count = docset.db_conn.execute(
-            "SELECT COUNT(1) FROM searchIndex"
-        ).fetchone()[0]
+                    num_entries += 1
+                    batch.append(entry.as_tuple())
+                    toc.send(entry)
+                    if digests is not None:
+                        _add_digest(digests, entry)
+
+                    if len(batch) >= batch_size:
+                        batches.put(batch)
+                        batch = []
+
+                batches.put(batch)
+            stats.add_items("parse", num_entries, "entries")
+        except BaseException:
+            abort.set()
+            raise
+        finally:
+            batches.put(None)
+
+        if num_excluded:
+            log.debug("Skipped %d entries in excluded files.", num_excluded)
+
+        # Patch for TOCs while the index is being finished.
+        toc.close()
+
+        count, removed = (
+            index.result()
+            if index is not None
+            else _write_index(docset.db_conn, batches, abort)
+        )
+        files = hashes.result() if hashes is not None else None
+
+    if removed:
+        log.debug("Removed %d duplicate index entries.", removed)
+
+    if vacuum:
+        with stats.stage("vacuum"):
+            docsets.vacuum_db(docset.db_conn, page_size)
 
     color = "green" if count > 0 else "red"
     log.info(f"Added [{color}]{count:,}[/{color}] index entries.")
 
-    # Now patch for TOCs.
+    if files is not None and digests is not None:
+        Manifest(
+            _manifest_settings(parser, excludes),
+            files,
+            {f: d for f, d in digests.as_dict().items() if f in files},
+        ).save(docset.docs.parent)
+
+
+def update_docs(
+    *,
+    parser: Parser,
+    docset: DocSet,
+    source: Path,
+    quiet: bool,
+    jobs: int = 1,
+    copy_mode: CopyMode = CopyMode.COPY,
+    copy_workers: int = 1,
+    excludes: Excludes | None = None,
+    vacuum: bool = False,
+    page_size: int | None = None,
+) -> None:
+    """
+    Use *parser* to bring the existing *docset* up to date with *source*.
+
+    Only files whose contents or anchors changed since the last update are
+    copied or patched -- according to the manifest within *docset* -- and
+    only changed index entries are rewritten. If there's no manifest, all
+    files are rebuilt.
+
+    The remaining arguments work like in `convert_docs` and
+    `docsets.prepare_docset`.
+    """
+    docs = docset.docs
+    resources = docs.parent
+    settings = _manifest_settings(parser, excludes)
+    manifest = Manifest.load(resources)
+    if manifest is None or manifest.settings != settings:
+        manifest = Manifest(settings, {}, {})
+    # If we crash halfway, the next update starts from scratch.
+    (resources / MANIFEST_NAME).unlink(missing_ok=True)
+
+    log.info("Parsing documentation...")
+    with stats.stage("parse", "entries"):
+        entries = [e for e in parser.parse() if not _is_excluded(e, excludes)]
+    stats.add_items("parse", len(entries), "entries")
+    anchor_digests = AnchorDigests()
+    for entry in entries:
+        _add_digest(anchor_digests, entry)
+
+    with stats.stage("hash", "files"):
+        files = hash_files(source, excludes, copy_workers)
+    stats.add_items("hash", len(files), "files")
+    digests = {
+        fname: digest
+        for fname, digest in anchor_digests.as_dict().items()
+        if fname in files
+    }
+    changed = {
+        fname for fname, h in files.items() if manifest.files.get(fname) != h
+    }
+    to_patch = {
+        fname
+        for fname, digest in digests.items()
+        if fname in changed or manifest.anchors.get(fname) != digest
+    }
+    # Files that lost all their anchors must be restored, too.
+    to_copy = (
+        (changed | (manifest.anchors.keys() - digests.keys())) & files.keys()
+    ) - to_patch
+
+    stale = [
+        path
+        for path in walk_files(docs)
+        if path.relative_to(docs).as_posix() not in files
+    ]
+    for path in stale:
+        path.unlink()
+
+    with stats.stage("copy", "files"):
+        copied = copy_files(
+            source,
+            docs,
+            sorted(to_copy),
+            copy_function=stats.in_stage(
+                "copy", make_copy_function(copy_mode), "files"
+            ),
+            workers=copy_workers,
+        )
+    stats.record_copy(copied)
+    log.debug("Copied %s.", copied)
+    log.info(
+        "Updating %d changed and removing %d stale files.",
+        len(to_copy | to_patch),
+        len(stale),
+    )
+
+    with _bulk_load(docset.db_conn), docset.db_conn:
+        toc = patch_anchors(
+            parser,
+            docs,
+            show_progressbar=not quiet,
+            jobs=jobs,
+            source=source,
+        )
+        next(toc)
+        for entry in entries:
+            file_anchor = split_anchor(entry)
+            if file_anchor is not None and file_anchor[0] in to_patch:
+                toc.send(entry)
+
+        with stats.stage("index", "entries"):
+            added, removed = docsets.sync_index(
+                docset.db_conn, (e.as_tuple() for e in entries)
+            )
+            docsets.finalize_db(docset.db_conn)
+        stats.add_items("index", added + removed, "entries")
+
+    if vacuum:
+        with stats.stage("vacuum"):
+            docsets.vacuum_db(docset.db_conn, page_size)
+
+    log.info(
+        f"Added [green]{added:,}[/green] and removed [red]{removed:,}[/red] "
+        "index entries."
+    )
+
     toc.close()
+
+    Manifest(settings, files, digests).save(resources)
+
+
+def _manifest_settings(
+    parser: Parser, excludes: Excludes | None
+) -> dict[str, object]:
+    """
+    Return everything besides the source files that influences the files of
+    a docset -- see `Manifest`.
+    """
+    return {
+        "parser": parser.name,
+        "excludes": list(excludes.patterns) if excludes else [],
+        "patch_engine": getattr(parser, "patch_engine", None),
+        "html_parser": getattr(parser, "html_parser", None),
+    }
+
+
+def _add_digest(digests: AnchorDigests, entry: ParserEntry) -> None:
+    file_anchor = split_anchor(entry)
+    if file_anchor is not None:
+        fname, anchor = file_anchor
+        digests.add(fname, entry.name, entry.type, anchor)
+
+
+def _is_excluded(entry: ParserEntry, excludes: Excludes | None) -> bool:
+    if not excludes:
+        return False
+
+    return excludes(urllib.parse.unquote(entry.path.split("#")[0]))
+
+
+def _db_path(db_conn: sqlite3.Connection) -> str:
+    """
+    Return the path of the main database of *db_conn*.
+
+    It's empty for in-memory and temporary databases.
+    """
+    path: str = db_conn.execute("PRAGMA database_list").fetchone()[2]
+
+    return path
+
+
+def _write_index_to(
+    path: str,
+    batches: queue.Queue[list[tuple[str, str, str]] | None],
+    abort: threading.Event,
+) -> tuple[int, int]:
+    """
+    Run `_write_index` with a new connection to the database at *path*.
+
+    Runs in its own thread, such that neither parsing nor patching has to
+    wait for SQLite.
+    """
+    db_conn = sqlite3.connect(path)
+    try:
+        return _write_index(db_conn, batches, abort)
+    finally:
+        db_conn.close()
+
+
+def _write_index(
+    db_conn: sqlite3.Connection,
+    batches: queue.Queue[list[tuple[str, str, str]] | None],
+    abort: threading.Event,
+) -> tuple[int, int]:
+    """
+    Insert the batches from *batches* into the search index of *db_conn*
+    until a `None` arrives, then finalize the index.
+
+    If *abort* is set once the batches are done, nothing is committed.
+
+    Returns:
+        The number of indexed entries and of removed duplicates.
+    """
+    count = 0
+    done = False
+    try:
+        with _bulk_load(db_conn):
+            for batch in iter(batches.get, None):
+                with stats.stage("index", "entries"):
+                    count += _insert(db_conn, batch)
+            done = True
+
+            if abort.is_set():
+                return 0, 0
+
+            with stats.stage("index", "entries"):
+                removed = docsets.finalize_db(db_conn)
+                db_conn.commit()
+            stats.add_items("index", count, "entries")
+    except BaseException:
+        # Don't leave the producer waiting for room in the queue.
+        while not done and batches.get() is not None:
+            pass
+        raise
+
+    return count - removed, removed
+
+
+def _insert(
+    db_conn: sqlite3.Connection, batch: list[tuple[str, str, str]]
+) -> int:
+    """
+    Insert *batch* into the search index and return how many entries that
+    were.
+    """
+    db_conn.executemany(
+        "INSERT INTO searchIndex VALUES (NULL, ?, ?, ?)", batch
+    )
+
+    return len(batch)
+
+
+@contextmanager
+def _bulk_load(db_conn: sqlite3.Connection) -> Iterator[None]:
+    """
+    Configure *db_conn* for bulk loading and restore the previous settings
+    afterwards.
+    """
+    old = {
+        pragma: db_conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        for pragma in _BULK_LOAD_PRAGMAS
+    }
+    for pragma, value in _BULK_LOAD_PRAGMAS.items():
+        db_conn.execute(f"PRAGMA {pragma} = {value}")
+
+    try:
+        yield
+    finally:
+        for pragma, value in old.items():
+            db_conn.execute(f"PRAGMA {pragma} = {value}")
@@ -0,0 +1,336 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Get documentation files into docsets without necessarily duplicating them.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import logging
+import os
+import shutil
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Iterable
+
+import attrs
+
+
+log = logging.getLogger(__name__)
+
+
+class CopyMode(Enum):
+    """
+    How files are copied from the source documentation into the docset.
+    """
+
+    COPY = "copy"
+    """
+    Physically copy each file.
+    """
+    HARDLINK = "hardlink"
+    """
+    Hardlink each file. Files that are patched get a real copy. Falls back to
+    copying with a warning if the docset is on a different file system.
+    """
+    REFLINK = "reflink"
+    """
+    Clone each file using copy-on-write (e.g. Btrfs, XFS, APFS). Falls back to
+    copying with a warning if the file system doesn't support it.
+    """
+    AUTO = "auto"
+    """
+    Clone if the file system supports it, copy otherwise.
+    """
+
+
+CopyFunction = Callable[[str, str], object]
+
+
+def make_copy_function(mode: CopyMode) -> CopyFunction:
+    """
+    Return a `shutil.copytree`-compatible copy function for *mode*.
+    """
+    if mode is CopyMode.COPY:
+        return shutil.copy2
+
+    if mode is CopyMode.HARDLINK:
+        return _make_copy_hardlink()
+
+    warn = mode is CopyMode.REFLINK
+    reflinks_supported = True
+
+    def copy_reflink(src: str, dst: str) -> str:
+        nonlocal reflinks_supported
+
+        if reflinks_supported:
+            try:
+                reflink(src, dst)
+            except OSError as e:
+                if e.errno not in _NOT_SUPPORTED:
+                    raise
+
+                reflinks_supported = False
+                if warn:
+                    log.warning(
+                        "Can't clone files (%s); falling back to copying.",
+                        os.strerror(e.errno),
+                    )
+                else:
+                    log.debug("Can't clone files; falling back to copying.")
+            else:
+                return dst
+
+        return shutil.copy2(src, dst)
+
+    return copy_reflink
+
+
+def _make_copy_hardlink() -> CopyFunction:
+    same_device = True
+
+    def copy_hardlink(src: str, dst: str) -> str:
+        nonlocal same_device
+
+        if same_device:
+            try:
+                os.link(src, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+
+                same_device = False
+                log.warning(
+                    "Can't hardlink across file systems; falling back to "
+                    "copying."
+                )
+            else:
+                return dst
+
+        return shutil.copy2(src, dst)
+
+    return copy_hardlink
+
+
+_NOT_SUPPORTED = {
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+}
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+
+def reflink(src: str, dst: str) -> None:
+    """
+    Clone *src* to *dst* using the file system's copy-on-write support and
+    copy the metadata like `shutil.copy2`.
+
+    Raises:
+        OSError: with errno `errno.ENOTSUP` if the platform or file system
+            doesn't support it.
+    """
+    if sys.platform == "linux":
+        import fcntl
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            except OSError:
+                fdst.close()
+                os.unlink(dst)
+                raise
+    elif sys.platform == "darwin":
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), src)
+    else:
+        raise OSError(errno.ENOTSUP, os.strerror(errno.ENOTSUP), src)
+
+    shutil.copystat(src, dst)
+
+
+@attrs.frozen
+class CopyStats:
+    """
+    What `copy_tree` did.
+    """
+
+    files: int
+    bytes: int
+    seconds: float
+
+    def __str__(self) -> str:
+        mib = self.bytes / 2**20
+        return (
+            f"{self.files:,} files ({mib:,.1f} MiB) in {self.seconds:.2f}s "
+            f"({mib / max(self.seconds, 1e-9):,.1f} MiB/s)"
+        )
+
+
+Ignore = Callable[[str, list[str]], Iterable[str]]
+
+
+@attrs.frozen
+class Excludes:
+    """
+    Glob patterns for files that are left out of docsets.
+
+    Patterns without a ``/`` match file and directory names anywhere in the
+    tree. Patterns with a ``/`` match paths relative to the root of the
+    documentation. Everything below an excluded directory is excluded, too.
+    """
+
+    patterns: tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def __call__(self, path: str) -> bool:
+        """
+        Check whether the relative POSIX *path* is excluded.
+        """
+        parts = path.split("/")
+        for pat in self.patterns:
+            if "/" in pat:
+                pat = pat.strip("/")
+                if any(
+                    fnmatch.fnmatchcase("/".join(parts[:i]), pat)
+                    for i in range(1, len(parts) + 1)
+                ):
+                    return True
+            elif any(fnmatch.fnmatchcase(part, pat) for part in parts):
+                return True
+
+        return False
+
+    def make_ignore(self, root: Path) -> Ignore:
+        """
+        Return a `copy_tree`/`shutil.copytree` *ignore* callable for copying
+        from *root*.
+        """
+
+        def ignore(dir: str, names: list[str]) -> set[str]:
+            rel = Path(dir).relative_to(root).as_posix()
+            prefix = "" if rel == "." else f"{rel}/"
+
+            return {n for n in names if self(prefix + n)}
+
+        return ignore
+
+
+def copy_tree(
+    source: Path,
+    dest: Path,
+    *,
+    copy_function: CopyFunction = shutil.copy2,
+    workers: int = 1,
+    ignore: Ignore | None = None,
+) -> CopyStats:
+    """
+    Copy the tree at *source* to *dest* like `shutil.copytree` -- including
+    the metadata of files and directories -- but copy files using a pool of
+    *workers* threads.
+
+    *ignore* works like `shutil.copytree`'s *ignore* argument and *dest* may
+    already exist.
+    """
+    start = time.perf_counter()
+    dirs = []
+    num_files = num_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futs = []
+        todo = [(os.fspath(source), os.fspath(dest))]
+        while todo:
+            src_dir, dst_dir = todo.pop()
+            os.makedirs(dst_dir, exist_ok=True)
+            dirs.append((src_dir, dst_dir))
+
+            with os.scandir(src_dir) as it:
+                entries = list(it)
+
+            ignored = (
+                set(ignore(src_dir, [e.name for e in entries]))
+                if ignore
+                else ()
+            )
+            for e in entries:
+                if e.name in ignored:
+                    continue
+
+                dst = os.path.join(dst_dir, e.name)
+                if e.is_dir():
+                    todo.append((e.path, dst))
+                else:
+                    num_files += 1
+                    num_bytes += e.stat().st_size
+                    futs.append(pool.submit(copy_function, e.path, dst))
+
+        for fut in futs:
+            fut.result()
+
+    # Like copytree, copy directory metadata after their contents.
+    for src_dir, dst_dir in reversed(dirs):
+        shutil.copystat(src_dir, dst_dir)
+
+    return CopyStats(num_files, num_bytes, time.perf_counter() - start)
+
+
+def copy_files(
+    source: Path,
+    dest: Path,
+    paths: Iterable[str],
+    *,
+    copy_function: CopyFunction = shutil.copy2,
+    workers: int = 1,
+) -> CopyStats:
+    """
+    Copy the files at the relative POSIX *paths* from *source* to *dest* using
+    a pool of *workers* threads.
+
+    Existing files are replaced, not written to, so they may be hardlinks.
+    """
+    start = time.perf_counter()
+
+    def copy(path: str) -> int:
+        src = source / path
+        dst = dest / path
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.unlink(missing_ok=True)
+        copy_function(os.fspath(src), os.fspath(dst))
+
+        return src.stat().st_size
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sizes = list(pool.map(copy, paths))
+
+    return CopyStats(len(sizes), sum(sizes), time.perf_counter() - start)
+
+
+def ensure_own_copy(path: os.PathLike[str]) -> None:
+    """
+    Make sure that *path* doesn't share its data with another hardlink, such
+    that it can be modified in place.
+    """
+    if os.stat(path).st_nlink < 2:
+        return
+
+    tmp = f"{os.fspath(path)}.doc2dash-tmp"
+    shutil.copy2(path, tmp)
+    os.replace(tmp, path)
@@ -6,16 +6,28 @@ from __future__ import annotations
 
 from enum import Enum
 
+import logging
 import os
 import plistlib
 import shutil
 import sqlite3
+import tempfile
+import threading
 
+from contextlib import contextmanager
 from functools import cached_property
 from pathlib import Path
+from typing import Iterable, Iterator
 
 import attrs
 
+from . import stats
+from .copying import CopyMode, Excludes, copy_tree, make_copy_function
+from .manifest import walk_files
+
+
+log = logging.getLogger(__name__)
+
 
 @attrs.frozen
 class DocSet:
@@ -49,21 +61,34 @@ def prepare_docset(
     icon: Path | None,
     icon_2x: Path | None,
     full_text_search: FullTextSearch,
+    copy_docs: bool = True,
+    copy_mode: CopyMode = CopyMode.COPY,
+    copy_workers: int = 1,
+    excludes: Excludes | None = None,
+    update: bool = False,
 ) -> DocSet:
     """
     Create boilerplate files & directories and copy vanilla docs inside.
 
+    If *copy_docs* is False, the docs are not copied and it's up to the caller
+    to do so using `copy_docs()`. Otherwise, they're copied according to
+    *copy_mode* using *copy_workers* threads, leaving out everything that
+    matches *excludes*.
+
+    If *update* is True, *dest* may already be a docset whose search index is
+    kept.
+
     Return a tuple of path to resources and connection to sqlite db.
     """
     resources = dest / "Contents" / "Resources"
     docs = resources / "Documents"
-    os.makedirs(resources)
+    os.makedirs(resources, exist_ok=update)
 
     db_conn = sqlite3.connect(resources / "docSet.dsidx")
     db_conn.row_factory = sqlite3.Row
     db_conn.execute(
-        "CREATE TABLE searchIndex(id INTEGER PRIMARY KEY, name TEXT, "
-        "type TEXT, path TEXT)"
+        "CREATE TABLE IF NOT EXISTS searchIndex(id INTEGER PRIMARY KEY, "
+        "name TEXT, type TEXT, path TEXT)"
     )
     db_conn.commit()
 
@@ -90,7 +115,28 @@ def prepare_docset(
 
     write_plist(plist_cfg, plist_path)
 
-    shutil.copytree(source, docs)
+    if copy_docs:
+        if copy_mode is CopyMode.COPY and copy_workers == 1 and not excludes:
+            with stats.stage("copy", "files"):
+                shutil.copytree(source, docs)
+            if stats.active() is not None:
+                # Counted afterwards, such that the copy stays the same.
+                sizes = [p.stat().st_size for p in walk_files(docs)]
+                stats.add_items("copy", len(sizes), "files")
+                stats.count("bytes_copied", sum(sizes))
+        else:
+            with stats.stage("copy", "files"):
+                copied = copy_tree(
+                    source,
+                    docs,
+                    copy_function=stats.in_stage(
+                        "copy", make_copy_function(copy_mode), "files"
+                    ),
+                    workers=copy_workers,
+                    ignore=excludes.make_ignore(source) if excludes else None,
+                )
+            stats.record_copy(copied)
+            log.debug("Copied %s.", copied)
 
     if icon:
         shutil.copy2(icon, dest / "icon.png")
@@ -101,6 +147,166 @@ def prepare_docset(
     return DocSet(path=dest, plist=plist_path, db_conn=db_conn)
 
 
+@contextmanager
+def build_atomically(dest: Path) -> Iterator[Path]:
+    """
+    Yield a path next to *dest* to build a docset at and move it into place
+    when the block is left successfully. If it isn't, the build is removed.
+
+    An existing *dest* is moved aside and deleted in a background thread, so
+    readers see either the old or the new docset, but never a partial one.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f".{dest.name}.", dir=dest.parent))
+    try:
+        yield tmp / dest.name
+
+        old = None
+        if os.path.lexists(dest):
+            old = tmp / "old"
+            os.replace(dest, old)
+
+        try:
+            os.replace(tmp / dest.name, dest)
+        except BaseException:
+            # Don't take the existing docset down with the build.
+            if old is not None:
+                os.replace(old, dest)
+            raise
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    if old is None:
+        os.rmdir(tmp)
+    else:
+        remove_in_background(tmp)
+
+
+def remove_in_background(path: Path) -> threading.Thread:
+    """
+    Remove the tree at *path* in a background thread.
+
+    The interpreter waits for the thread before exiting.
+    """
+    t = threading.Thread(
+        target=shutil.rmtree,
+        args=(path,),
+        kwargs={"ignore_errors": True},
+        name=f"doc2dash-remove-{path.name}",
+    )
+    t.start()
+
+    return t
+
+
+def copy_docs(
+    source: Path,
+    docs: Path,
+    copy_mode: CopyMode = CopyMode.COPY,
+    copy_workers: int = 1,
+    excludes: Excludes | None = None,
+) -> None:
+    """
+    Copy the docs from *source* to *docs* according to *copy_mode* using
+    *copy_workers* threads, skipping all files that already exist in *docs*
+    -- for instance, because they've been written patched -- and everything
+    that matches *excludes*.
+    """
+    ignore_excluded = (excludes or Excludes()).make_ignore(source)
+
+    def ignore_existing(dir: str, names: list[str]) -> set[str]:
+        dest = docs / Path(dir).relative_to(source)
+
+        return {n for n in names if (dest / n).is_file()}.union(
+            ignore_excluded(dir, names)
+        )
+
+    with stats.stage("copy", "files"):
+        copied = copy_tree(
+            source,
+            docs,
+            copy_function=stats.in_stage(
+                "copy", make_copy_function(copy_mode), "files"
+            ),
+            workers=copy_workers,
+            ignore=ignore_existing,
+        )
+    stats.record_copy(copied)
+    log.debug("Copied %s.", copied)
+
+
+_CREATE_INDEX = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS anchor ON searchIndex "
+    "(name, type, path)"
+)
+
+
+def finalize_db(db_conn: sqlite3.Connection) -> int:
+    """
+    Create the lookup index on the filled search index and update the query
+    planner's statistics.
+
+    Duplicate entries would violate the index's uniqueness, so they're
+    removed.
+
+    Returns:
+        The number of removed duplicate entries.
+    """
+    removed = 0
+    try:
+        db_conn.execute(_CREATE_INDEX)
+    except sqlite3.IntegrityError:
+        removed = db_conn.execute(
+            "DELETE FROM searchIndex WHERE id NOT IN "
+            "(SELECT MIN(id) FROM searchIndex GROUP BY name, type, path)"
+        ).rowcount
+        db_conn.execute(_CREATE_INDEX)
+
+    db_conn.execute("ANALYZE")
+
+    return removed
+
+
+def sync_index(
+    db_conn: sqlite3.Connection, entries: Iterable[tuple[str, str, str]]
+) -> tuple[int, int]:
+    """
+    Make the search index contain exactly *entries*, leaving rows alone that
+    are already in it.
+
+    Returns:
+        The numbers of added and removed entries.
+    """
+    wanted = dict.fromkeys(entries)
+    present = set()
+    stale = []
+    for row in db_conn.execute("SELECT id, name, type, path FROM searchIndex"):
+        entry = tuple(row[1:])
+        if entry in wanted and entry not in present:
+            present.add(entry)
+        else:
+            stale.append((row[0],))
+
+    db_conn.executemany("DELETE FROM searchIndex WHERE id = ?", stale)
+    new = [e for e in wanted if e not in present]
+    db_conn.executemany("INSERT INTO searchIndex VALUES (NULL, ?, ?, ?)", new)
+
+    return len(new), len(stale)
+
+
+def vacuum_db(db_conn: sqlite3.Connection, page_size: int | None) -> None:
+    """
+    Rebuild the database file compactly -- using *page_size* if passed.
+
+    Must not be called within a transaction.
+    """
+    if page_size is not None:
+        db_conn.execute(f"PRAGMA page_size = {page_size:d}")
+
+    db_conn.execute("VACUUM")
+
+
 def read_plist(full_path: Path) -> dict[str, str | bool]:
     with full_path.open("rb") as fp:
         return plistlib.load(fp)  # type: ignore[no-any-return]
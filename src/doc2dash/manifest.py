@@ -0,0 +1,164 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Remember what went into a docset, such that it can be updated in place.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable
+
+import attrs
+
+from .copying import Excludes
+from .parsers.types import EntryType
+
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = "doc2dash-manifest.json"
+_VERSION = 2
+
+
+@attrs.frozen
+class Manifest:
+    """
+    The state of a docset's documentation files.
+
+    Attributes:
+        settings: Everything besides the source files that influences the
+            docset's files. If it changes, all files are rebuilt.
+
+        files: Relative POSIX paths of the source files, mapped to the hashes
+            of their contents.
+
+        anchors: Relative POSIX paths of patched files, mapped to digests of
+            the anchors that have been patched into them.
+    """
+
+    settings: dict[str, object]
+    files: dict[str, str]
+    anchors: dict[str, str]
+
+    @classmethod
+    def load(cls, resources: Path) -> Manifest | None:
+        """
+        Load the manifest from the docset *resources* directory.
+
+        Returns:
+            `None` if there's no manifest or it's from an incompatible
+            version.
+        """
+        try:
+            with (resources / MANIFEST_NAME).open() as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            log.warning("Ignoring corrupt manifest in '%s'.", resources)
+            return None
+
+        if raw.get("version") != _VERSION:
+            return None
+
+        return cls(raw["settings"], raw["files"], raw["anchors"])
+
+    def save(self, resources: Path) -> None:
+        """
+        Atomically write the manifest into the docset *resources* directory.
+        """
+        path = resources / MANIFEST_NAME
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("w") as f:
+            json.dump(
+                {"version": _VERSION, **attrs.asdict(self)},
+                f,
+                sort_keys=True,
+            )
+        os.replace(tmp, path)
+
+
+def hash_files(
+    source: Path, excludes: Excludes | None = None, workers: int = 1
+) -> dict[str, str]:
+    """
+    Hash all files below *source* that aren't excluded by *excludes*, using
+    *workers* threads.
+
+    Returns:
+        Relative POSIX paths mapped to the hex digests of the files' contents.
+    """
+    paths = [
+        p
+        for p in walk_files(source)
+        if not (excludes and excludes(p.relative_to(source).as_posix()))
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(
+            zip(
+                (p.relative_to(source).as_posix() for p in paths),
+                pool.map(_hash_file, paths),
+            )
+        )
+
+
+def walk_files(root: Path) -> Iterable[Path]:
+    """
+    Yield all files below *root*.
+    """
+    for dirpath, _, filenames in os.walk(root):
+        for fn in filenames:
+            yield Path(dirpath) / fn
+
+
+def _hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(2**20):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def digest_anchors(anchors: Iterable[tuple[str, EntryType, str]]) -> str:
+    """
+    Compute a digest of the anchors that are patched into a file -- in the
+    order they're patched.
+    """
+    digests = AnchorDigests()
+    for name, type, anchor in anchors:
+        digests.add("", name, type, anchor)
+
+    return digests.as_dict().get("", hashlib.sha256().hexdigest())
+
+
+class AnchorDigests:
+    """
+    Compute `digest_anchors` for many files at once while their anchors come
+    in, without holding on to them.
+    """
+
+    def __init__(self) -> None:
+        self._hashes: dict[str, hashlib._Hash] = {}
+
+    def add(self, fname: str, name: str, type: EntryType, anchor: str) -> None:
+        h = self._hashes.get(fname)
+        if h is None:
+            h = self._hashes[fname] = hashlib.sha256()
+
+        h.update(f"{name}\0{type.value}\0{anchor}\n".encode())
+
+    def as_dict(self) -> dict[str, str]:
+        """
+        Return the file names mapped to the hex digests of their anchors.
+        """
+        return {fname: h.hexdigest() for fname, h in self._hashes.items()}
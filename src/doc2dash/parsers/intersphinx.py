@@ -4,22 +4,44 @@
 
 from __future__ import annotations
 
+import html
 import logging
+import shutil
 
 from contextlib import contextmanager
 from pathlib import Path
-from typing import ClassVar, Generator, Iterator, Mapping
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Container,
+    Generator,
+    Generic,
+    Iterable,
+    Iterator,
+    Mapping,
+    Sequence,
+    TypeVar,
+)
 
 import attrs
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
+from bs4.builder import builder_registry
 
-from .intersphinx_inventory import InventoryEntry, load_inventory
-from .types import EntryType, ParserEntry, Patcher
+from .intersphinx_inventory import (
+    InventoryCache,
+    InventoryEntry,
+    iter_inventory,
+)
+from .splice import iter_start_tags, scan_start_tags, splice
+from .types import EntryType, ParserEntry, PatchEntry, Patcher, PatchResult
 
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 # https://www.sphinx-doc.org/en/master/usage/restructuredtext/domains.html
 # ->
@@ -54,6 +76,25 @@ INV_TO_TYPE = {
     "var": EntryType.VARIABLE,
 }
 
+PATCH_ENGINES = ("soup", "splice", "scan")
+"""
+How files are patched:
+
+- ``soup`` parses each file into a BeautifulSoup tree and writes it back.
+- ``splice`` finds the insertion points using a streaming tokenizer and
+  splices the anchors into the original file, leaving the rest of it
+  byte-for-byte untouched.
+- ``scan`` works like ``splice``, but looks for all ``id`` and ``href``
+  attributes that are wanted for a file in a single scan of the raw HTML.
+  Only entries that can't be resolved that way fall back to the tokenizer.
+"""
+
+HTML_PARSERS = ("auto", "lxml", "html5lib", "html.parser")
+"""
+The BeautifulSoup tree builders that can be used for patching. ``auto`` uses
+``lxml`` if it's installed and falls back to ``html.parser``.
+"""
+
 
 @attrs.define
 class InterSphinxParser:
@@ -63,7 +104,34 @@ class InterSphinxParser:
     """
 
     name: ClassVar[str] = "intersphinx"
+    exclude_profile: ClassVar[tuple[str, ...]] = (
+        "_sources",
+        ".buildinfo",
+        ".doctrees",
+        "searchindex.js",
+    )
     source: Path
+    html_parser: str = attrs.field(
+        default="html.parser",
+        kw_only=True,
+        validator=attrs.validators.in_(HTML_PARSERS),
+    )
+    patch_engine: str = attrs.field(
+        default="soup",
+        kw_only=True,
+        validator=attrs.validators.in_(PATCH_ENGINES),
+    )
+    prescan: bool = attrs.field(default=False, kw_only=True)
+    inventory_cache: InventoryCache | None = attrs.field(
+        default=None, kw_only=True
+    )
+    # Resolved on instantiation, such that the pool processes that get a
+    # pickled copy don't resolve -- and warn about -- it again.
+    _tree_builder: str = attrs.field(init=False, repr=False, eq=False)
+
+    @_tree_builder.default
+    def _resolve_tree_builder(self) -> str:
+        return _resolve_html_parser(self.html_parser)
 
     @staticmethod
     def detect(path: Path) -> str | None:
@@ -90,26 +158,102 @@ class InterSphinxParser:
         except FileNotFoundError:
             return None
 
+    @property
+    def grouped_by_file(self) -> bool:
+        """
+        Entries are grouped by file if they come from the inventory cache:
+        they're in memory anyway, so sorting them is cheap.
+        """
+        return self.inventory_cache is not None
+
     def parse(self) -> Generator[ParserEntry, None, None]:
         """
         Parse sphinx docs at self.source
 
-        yield `ParserEntry`s.
+        yield `ParserEntry`s in inventory order as it's decoded -- or grouped
+        by file, see `grouped_by_file`.
+        """
+        yield from self._records_to_entries(
+            iter_inventory(
+                self.source,
+                prescan=self.prescan,
+                cache=self.inventory_cache,
+                group_by_path=self.grouped_by_file,
+            )
+        )
+
+    @contextmanager
+    def make_patcher_for_file(
+        self, path: Path, *, dest: Path | None = None
+    ) -> Iterator[Patcher]:
+        """
+        Prepare patching *path*.
+
+        If *dest* is passed, the result is written to *dest* instead of back
+        to *path*. Files where nothing was patched are copied.
+        """
+        if self.patch_engine in ("splice", "scan"):
+            cm = _make_splicing_patcher(path, dest)
+        else:
+            cm = self._make_soup_patcher(path, dest)
+
+        with cm as patch:
+            yield patch
+
+    def patch_file(
+        self,
+        path: Path,
+        entries: Sequence[PatchEntry],
+        *,
+        dest: Path | None = None,
+    ) -> PatchResult:
+        """
+        Patch all *entries* into *path* at once.
+
+        *dest* works like for `make_patcher_for_file()`.
         """
-        yield from self._inv_to_entries(load_inventory(self.source))
+        if self.patch_engine != "soup":
+            return _splice_file(
+                path, entries, dest, scan=self.patch_engine == "scan"
+            )
+
+        with path.open(encoding="utf-8") as f:
+            soup = BeautifulSoup(f, self._tree_builder)
+
+        index = _AnchorIndex.from_soup(soup)
+        patched = [
+            _find_entry_and_add_ref(soup, name, type, anchor, ref, index=index)
+            for name, type, anchor, ref in entries
+        ]
+        _write_patched(
+            path, dest, soup.encode("utf-8") if any(patched) else None
+        )
+
+        return PatchResult(patched)
 
     @contextmanager
-    def make_patcher_for_file(self, path: Path) -> Iterator[Patcher]:
+    def _make_soup_patcher(
+        self, path: Path, dest: Path | None
+    ) -> Iterator[Patcher]:
         with path.open(encoding="utf-8") as f:
-            soup = BeautifulSoup(f, "html.parser")
+            soup = BeautifulSoup(f, self._tree_builder)
+
+        index = _AnchorIndex.from_soup(soup)
+        patched = False
 
         def patch(name: str, type: EntryType, anchor: str, ref: str) -> bool:
-            return _find_entry_and_add_ref(soup, name, type, anchor, ref)
+            nonlocal patched
+
+            found = _find_entry_and_add_ref(
+                soup, name, type, anchor, ref, index=index
+            )
+            patched |= found
+
+            return found
 
         yield patch
 
-        with path.open(mode="wb") as fb:
-            fb.write(soup.encode("utf-8"))
+        _write_patched(path, dest, soup.encode("utf-8") if patched else None)
 
     def _inv_to_entries(
         self, inv: Mapping[str, Mapping[str, InventoryEntry]]
@@ -118,15 +262,31 @@ class InterSphinxParser:
         Iterate over a dictionary as returned by our load_inventory object.inv
         parser and yield `ParserEntry`s.
         """
-        for type_key, inv_entries in inv.items():
-            dash_type = self.convert_type(type_key)
+        return self._records_to_entries(
+            (type_key, key, *data)
+            for type_key, inv_entries in inv.items()
+            for key, data in inv_entries.items()
+        )
+
+    def _records_to_entries(
+        self, records: Iterable[tuple[str, str, str, str]]
+    ) -> Generator[ParserEntry, None, None]:
+        """
+        Iterate over ``(role, name, uri, display name)`` tuples as yielded by
+        `iter_inventory` and yield `ParserEntry`s.
+        """
+        dash_types: dict[str, EntryType | None] = {}
+        for type_key, key, *data in records:
+            try:
+                dash_type = dash_types[type_key]
+            except KeyError:
+                dash_type = dash_types[type_key] = self.convert_type(type_key)
             if dash_type is None:
                 continue
 
-            for key, data in inv_entries.items():
-                entry = self.create_entry(dash_type, key, data)
-                if entry is not None:
-                    yield entry
+            entry = self.create_entry(dash_type, key, (data[0], data[1]))
+            if entry is not None:
+                yield entry
 
     def convert_type(self, inv_type: str) -> EntryType | None:
         """
@@ -157,34 +317,269 @@ class InterSphinxParser:
         return ParserEntry(name=name, type=dash_type, path=path_str)
 
 
-def _find_entry_and_add_ref(
-    soup: BeautifulSoup, name: str, type: EntryType, anchor: str, ref: str
-) -> bool:
+@attrs.define
+class _AnchorIndex(Generic[T]):
     """
-    Modify *soup* so Dash can generate TOCs on the fly.
+    Lookup tables for all places in a document that can carry an anchor.
+
+    Built in a single walk over the document such that finding an anchor is a
+    dict lookup instead of a full scan per entry.  Like ``soup.find()``, each
+    table keeps the *first* matching element in document order.
+
+    The elements are whatever the patching engine needs to insert a tag before
+    them: BeautifulSoup tags or offsets into the raw HTML.
     """
-    pos = None
-    if type == EntryType.WORD:
-        pos = soup.find("dt", id=anchor)
-    elif type == EntryType.SECTION:
-        pos = soup.find(id=anchor)
-    elif anchor.startswith("module-"):
-        pos = soup.h1
-
-    if not pos:
-        pos = (
-            soup.find("a", {"class": "headerlink"}, href="#" + anchor)
-            or soup.find(
-                "a", {"class": "reference internal"}, href="#" + anchor
-            )
-            or soup.find("span", id=anchor)
+
+    ids: dict[str, T] = attrs.Factory(dict)
+    dt_ids: dict[str, T] = attrs.Factory(dict)
+    span_ids: dict[str, T] = attrs.Factory(dict)
+    # (class, href) -> <a>
+    links: dict[tuple[str, str], T] = attrs.Factory(dict)
+    a_names: dict[str, T] = attrs.Factory(dict)
+    h1: T | None = None
+
+    @classmethod
+    def from_soup(cls, soup: BeautifulSoup) -> _AnchorIndex[Tag]:
+        index: _AnchorIndex[Tag] = _AnchorIndex()
+        for tag in soup.find_all(True):
+            index.add(tag, tag.name, tag.attrs)
+
+        return index
+
+    @classmethod
+    def from_html(cls, text: str) -> _AnchorIndex[int]:
+        index: _AnchorIndex[int] = _AnchorIndex()
+        for tag, tag_attrs, offset in iter_start_tags(text):
+            index.add(offset, tag, tag_attrs)
+
+        return index
+
+    @classmethod
+    def from_scan(
+        cls, text: str, anchors: Container[str]
+    ) -> _AnchorIndex[int]:
+        """
+        Index only the elements whose ``id`` or ``href`` point to one of
+        *anchors*.
+
+        Lookups that depend on other elements -- ``<h1>`` for modules and
+        ``<a name>`` for pydoctor -- can't be answered by such an index.
+        """
+        index: _AnchorIndex[int] = _AnchorIndex()
+        for tag, tag_attrs, offset in scan_start_tags(text, anchors):
+            index.add(offset, tag, tag_attrs)
+
+        return index
+
+    def add(self, element: T, tag: str, tag_attrs: Mapping[str, Any]) -> None:
+        id = tag_attrs.get("id")
+        if isinstance(id, str):
+            self.ids.setdefault(id, element)
+            if tag == "dt":
+                self.dt_ids.setdefault(id, element)
+            elif tag == "span":
+                self.span_ids.setdefault(id, element)
+
+        if tag == "a":
+            href = tag_attrs.get("href")
+            if isinstance(href, str):
+                classes = tag_attrs.get("class", [])
+                if isinstance(classes, str):
+                    classes = classes.split()
+                # Mirror BeautifulSoup's matching rules: a class filter
+                # matches either any single class or the whole attribute.
+                for cls in {*classes, " ".join(classes)}:
+                    self.links.setdefault((cls, href), element)
+
+            name = tag_attrs.get("name")
+            if isinstance(name, str):
+                self.a_names.setdefault(name, element)
+        elif tag == "h1" and self.h1 is None:
+            self.h1 = element
+
+    def find(self, name: str, type: EntryType, anchor: str) -> T | None:
+        """
+        Find the element that the TOC entry for *name* must be inserted
+        before.
+        """
+        pos = None
+        if type == EntryType.WORD:
+            pos = self.dt_ids.get(anchor)
+        elif type == EntryType.SECTION:
+            pos = self.ids.get(anchor)
+        elif anchor.startswith("module-"):
+            pos = self.h1
+
+        if pos is not None:
+            return pos
+
+        href = "#" + anchor
+        for pos in (
+            self.links.get(("headerlink", href)),
+            self.links.get(("reference internal", href)),
+            self.span_ids.get(anchor),
             # mkdocs / mkdocstrings
-            or soup.find("a", {"class": "md-nav__link"}, href="#" + anchor)
+            self.links.get(("md-nav__link", href)),
             # pydoctor
-            or soup.find("a", {"name": name})
+            self.a_names.get(name),
+        ):
+            if pos is not None:
+                return pos
+
+        return None
+
+
+def _resolve_html_parser(html_parser: str) -> str:
+    """
+    Return the tree builder name to use for *html_parser*.
+
+    Fall back to the always-available ``html.parser`` if the requested one
+    isn't installed.
+    """
+    if html_parser == "auto":
+        return "lxml" if builder_registry.lookup("lxml") else "html.parser"
+
+    if builder_registry.lookup(html_parser) is None:
+        log.warning(
+            "HTML parser '%s' is not installed. Falling back to "
+            "'html.parser'.",
+            html_parser,
         )
+        return "html.parser"
+
+    return html_parser
+
+
+@contextmanager
+def _make_splicing_patcher(path: Path, dest: Path | None) -> Iterator[Patcher]:
+    text = path.read_bytes().decode("utf-8")
+    index = _AnchorIndex.from_html(text)
+    insertions = []
+
+    def patch(name: str, type: EntryType, anchor: str, ref: str) -> bool:
+        pos = index.find(name, type, anchor)
+        if pos is None:
+            return False
+
+        insertions.append((pos, _dash_anchor(ref)))
+
+        return True
+
+    yield patch
+
+    _write_patched(
+        path,
+        dest,
+        splice(text, insertions).encode("utf-8") if insertions else None,
+    )
+
+
+def _splice_file(
+    path: Path,
+    entries: Sequence[PatchEntry],
+    dest: Path | None,
+    *,
+    scan: bool = False,
+) -> PatchResult:
+    """
+    Splice the anchors for all *entries* into *path* in one go.
+
+    If *scan* is True, the insertion points are looked up using
+    `_AnchorIndex.from_scan` first.
+    """
+    text = path.read_bytes().decode("utf-8")
+    find = (
+        _make_scanning_find(text, entries)
+        if scan
+        else _AnchorIndex.from_html(text).find
+    )
+    insertions = []
+    patched = []
+    for name, type, anchor, ref in entries:
+        pos = find(name, type, anchor)
+        patched.append(pos is not None)
+        if pos is not None:
+            insertions.append((pos, _dash_anchor(ref)))
+
+    _write_patched(
+        path,
+        dest,
+        splice(text, insertions).encode("utf-8") if insertions else None,
+    )
+
+    return PatchResult(patched)
+
+
+def _make_scanning_find(
+    text: str, entries: Sequence[PatchEntry]
+) -> Callable[[str, EntryType, str], int | None]:
+    """
+    Return a `_AnchorIndex.find` for *text* that uses an index of only the
+    elements that *entries* are looking for.
+
+    Entries that may need other elements -- modules and entries that can't
+    be found by their anchors -- are looked up in a full index that is only
+    built if there are any.
+    """
+    scanned = _AnchorIndex.from_scan(text, {e[2] for e in entries})
+    full: _AnchorIndex[int] | None = None
+
+    def find(name: str, type: EntryType, anchor: str) -> int | None:
+        nonlocal full
+
+        if not (
+            anchor.startswith("module-")
+            and type not in (EntryType.WORD, EntryType.SECTION)
+        ):
+            pos = scanned.find(name, type, anchor)
+            if pos is not None:
+                return pos
+
+        if full is None:
+            full = _AnchorIndex.from_html(text)
+
+        return full.find(name, type, anchor)
+
+    return find
+
+
+def _dash_anchor(ref: str) -> str:
+    return f'<a class="dashAnchor" name="{html.escape(ref)}"></a>'
+
+
+def _write_patched(path: Path, dest: Path | None, data: bytes | None) -> None:
+    """
+    Write the patched *data* of *path* to *dest* -- or back to *path* if
+    *dest* is None.
+
+    If *data* is None, nothing was patched: *path* is left alone and copied
+    to *dest* if passed.
+    """
+    if data is not None:
+        (dest or path).write_bytes(data)
+    elif dest is not None:
+        shutil.copy2(path, dest)
+
+
+def _find_entry_and_add_ref(
+    soup: BeautifulSoup,
+    name: str,
+    type: EntryType,
+    anchor: str,
+    ref: str,
+    *,
+    index: _AnchorIndex[Tag] | None = None,
+) -> bool:
+    """
+    Modify *soup* so Dash can generate TOCs on the fly.
+
+    Pass an *index* built from *soup* when patching more than one entry.
+    """
+    if index is None:
+        index = _AnchorIndex.from_soup(soup)
 
-    if not pos:
+    pos = index.find(name, type, anchor)
+    if pos is None:
         return False
 
     tag = soup.new_tag("a")
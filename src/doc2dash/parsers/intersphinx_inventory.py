@@ -30,13 +30,21 @@ e.g.:
 
 from __future__ import annotations
 
+import codecs
+import contextlib
+import hashlib
+import io
 import logging
+import marshal
+import operator
+import os
+import posixpath
 import re
 import zlib
 
 from collections import defaultdict
 from pathlib import Path
-from typing import Callable, Mapping, Tuple
+from typing import BinaryIO, Callable, Iterable, Iterator, Mapping, Tuple
 
 import attrs
 
@@ -47,31 +55,219 @@ log = logging.getLogger(__name__)
 InventoryEntry = Tuple[str, str]  # (uri, display name)
 
 
-def load_inventory(source: Path) -> Mapping[str, Mapping[str, InventoryEntry]]:
+# (name, role, path, URI, display name)
+InventoryRecord = Tuple[str, str, str, str, str]
+
+
+def load_inventory(
+    source: Path,
+    *,
+    prescan: bool = False,
+    cache: InventoryCache | None = None,
+) -> Mapping[str, Mapping[str, InventoryEntry]]:
     """
     Load a Sphinx v2 inventory from *fp* and return a mapping of:
 
     {"role": {"name": ("path#anchor", "display-name"}}
+
+    If *prescan* is True, *source* is scanned once up front instead of
+    checking the existence of each indexed path separately.
+
+    If *cache* is passed, the parsed inventory is looked up in and stored
+    into it.
     """
+    check_exists = CachedFileExists(
+        source, scan_tree(source) if prescan else None
+    )
+
+    if cache is not None:
+        return _records_to_tuples(
+            check_exists, _load_cached_records(source, cache)
+        )
+
     with (source / "objects.inv").open("rb") as fp:
-        assert b"# Sphinx inventory version 2\n" == fp.readline()
+        return _records_to_tuples(
+            check_exists, _parse_records(_read_lines(fp))
+        )
 
-        key, value = fp.readline().split(b": ", 1)
-        assert b"# Project" == key
 
-        key = fp.readline().split(b": ")[0]
-        assert b"# Version" == key
+def iter_inventory(
+    source: Path,
+    *,
+    prescan: bool = False,
+    cache: InventoryCache | None = None,
+    group_by_path: bool = False,
+) -> Iterator[tuple[str, str, str, str]]:
+    """
+    Like `load_inventory`, but yield ``(role, name, uri, display name)``
+    tuples while decoding the inventory instead of building a mapping first.
 
-        line = fp.readline()
-        assert re.fullmatch(
-            b"# The (remainder|rest) of this file is compressed (using|with) "
-            b"zlib.\n",
-            line,
-        )
+    As with `load_inventory`, the last entry for a role and a name wins --
+    here it's also yielded at its position. To know which one is the last,
+    the inventory is decoded twice. Only the hashes of all keys and the
+    positions of duplicate ones are kept in memory.
+
+    If *group_by_path* is True, the entries of each path are yielded in one
+    go instead. That's only possible with a *cache*, whose records are in
+    memory anyway.
+    """
+    if group_by_path and cache is None:
+        raise ValueError("Grouping by path needs an inventory cache.")
+
+    check_exists = CachedFileExists(
+        source, scan_tree(source) if prescan else None
+    )
+
+    if cache is not None:
+        cached = _load_cached_records(source, cache)
+
+        def records(quiet: bool) -> Iterator[InventoryRecord]:
+            return iter(cached)
+    else:
+
+        def records(quiet: bool) -> Iterator[InventoryRecord]:
+            with (source / "objects.inv").open("rb") as fp:
+                yield from _parse_records(_read_lines(fp), quiet=quiet)
+
+    def existing(quiet: bool) -> Iterator[InventoryRecord]:
+        return (r for r in records(quiet) if check_exists(r[2]))
+
+    last = _find_duplicates((role, name) for name, role, *_ in existing(True))
+    wanted: Iterator[InventoryRecord] = (
+        r
+        for i, r in enumerate(existing(False))
+        if last.get((r[1], r[0]), i) == i
+    )
+    if group_by_path:
+        # Stable, so the entries of each path stay in inventory order.
+        wanted = iter(sorted(wanted, key=operator.itemgetter(2)))
+
+    for name, role, _, uri, display_name in wanted:
+        yield role, name, uri, display_name
+
+
+def _find_duplicates(
+    keys: Iterable[tuple[str, str]],
+) -> dict[tuple[str, str], int]:
+    """
+    Return the position of the last occurrence of each key in *keys* that
+    occurs more than once.
 
-        entries = zlib.decompress(fp.read()).decode().splitlines()
+    Keys are remembered by their hashes -- a collision only costs an
+    unnecessary entry in the result.
+    """
+    seen = set()
+    last = {}
+    for i, key in enumerate(keys):
+        h = hash(key)
+        if h in seen:
+            last[key] = i
+        else:
+            seen.add(h)
+
+    return last
+
+
+def _load_cached_records(
+    source: Path, cache: InventoryCache
+) -> list[InventoryRecord]:
+    """
+    Return the parsed records of the inventory in *source* from *cache* --
+    parsing and storing them on a miss.
+    """
+    data = (source / "objects.inv").read_bytes()
+    key = hashlib.sha256(data).hexdigest()
+    records = cache.get(key)
+    if records is None:
+        records = list(_parse_records(_read_lines(io.BytesIO(data))))
+        cache.put(key, records)
+
+    return records
+
+
+def _read_lines(fp: BinaryIO) -> Iterator[str]:
+    """
+    Check the header of the inventory in *fp* and return an iterator over the
+    remaining lines.
+    """
+    assert b"# Sphinx inventory version 2\n" == fp.readline()
 
-    return _lines_to_tuples(CachedFileExists(source), entries)
+    key, value = fp.readline().split(b": ", 1)
+    assert b"# Project" == key
+
+    key = fp.readline().split(b": ")[0]
+    assert b"# Version" == key
+
+    line = fp.readline()
+    assert re.fullmatch(
+        b"# The (remainder|rest) of this file is compressed (using|with) "
+        b"zlib.\n",
+        line,
+    )
+
+    return _iter_lines(fp)
+
+
+def scan_tree(root: Path) -> frozenset[str]:
+    """
+    Return the relative POSIX paths of all files and directories below
+    *root*.
+    """
+    paths = set()
+    todo = [("", os.fspath(root))]
+    while todo:
+        prefix, d = todo.pop()
+        with os.scandir(d) as it:
+            for e in it:
+                rel = prefix + e.name
+                paths.add(rel)
+                if e.is_dir():
+                    todo.append((f"{rel}/", e.path))
+
+    return frozenset(paths)
+
+
+_CHUNK_SIZE = 2**16
+
+
+def _iter_lines(fp: BinaryIO, chunk_size: int = _CHUNK_SIZE) -> Iterator[str]:
+    """
+    Decompress the rest of *fp* incrementally and yield its lines like
+    `str.splitlines` -- holding only about one *chunk_size* in memory.
+
+    Raises:
+        zlib.error: If the compressed data is corrupt or truncated.
+    """
+    d = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def texts() -> Iterator[str]:
+        while chunk := fp.read(chunk_size):
+            yield decoder.decode(d.decompress(chunk, chunk_size))
+            while d.unconsumed_tail:
+                yield decoder.decode(
+                    d.decompress(d.unconsumed_tail, chunk_size)
+                )
+
+        tail = d.flush()
+        if not d.eof:
+            raise zlib.error(
+                "Error -5 while decompressing data: incomplete or truncated "
+                "stream"
+            )
+
+        yield decoder.decode(tail, final=True)
+
+    rest = ""
+    for text in texts():
+        # The last line may be incomplete -- even if it ends with a "\r" that
+        # could be followed by a "\n".
+        lines = (rest + text).splitlines(keepends=True)
+        rest = lines.pop() if lines else ""
+
+        yield from "".join(lines).splitlines()
+
+    yield from rest.splitlines()
 
 
 # This regular expression is straight from Sphinx:
@@ -82,8 +278,38 @@ _match_inv_line = re.compile(
 ).match
 
 
+def _parse_line(line: str) -> tuple[str, ...] | None:
+    """
+    Split an inventory *line* into name, role, URI, and display name -- like
+    `_match_inv_line` would.
+
+    The regular expression is slow, so it's only used if the line isn't
+    made of five fields that are separated by single spaces, with an integer
+    priority in the middle. That's what Sphinx writes for everything but
+    names with whitespace in them (e.g. glossary terms).
+    """
+    parts = line.split(None, 4)
+    if len(parts) == 5 and _is_priority(parts[2]) and " ".join(parts) == line:
+        name, role, _, uri, display_name = parts
+
+        return name, role, uri, display_name
+
+    m = _match_inv_line(line)
+    if not m:
+        return None
+
+    return m.groups()
+
+
+def _is_priority(s: str) -> bool:
+    """
+    Check whether *s* matches ``-?\\d+``.
+    """
+    return s.removeprefix("-").isdecimal()
+
+
 def _lines_to_tuples(
-    check_exists: Callable[[str], bool], entries: list[str]
+    check_exists: Callable[[str], bool], entries: Iterable[str]
 ) -> Mapping[str, dict[str, tuple[str, str]]]:
     """
     Transform inventory lines *entries* to the required dict of dicts of
@@ -92,17 +318,35 @@ def _lines_to_tuples(
     Use *check_exists* callable to verify whether the indexed path exits at
     all.
     """
-    rv: Mapping[str, dict[str, tuple[str, str]]] = defaultdict(dict)
+    return _records_to_tuples(check_exists, _parse_records(entries))
+
 
+def _parse_records(
+    entries: Iterable[str], *, quiet: bool = False
+) -> Iterator[InventoryRecord]:
+    """
+    Parse inventory lines *entries* into records, skipping -- and unless
+    *quiet*, warning about -- invalid ones.
+    """
     for line in entries:
-        m = _match_inv_line(line.rstrip())
-        if not m:
-            log.warning("intersphinx: invalid line: %r. Skipping.", line)
+        fields = _parse_line(line.rstrip())
+        if not fields:
+            if not quiet:
+                log.warning("intersphinx: invalid line: %r. Skipping.", line)
             continue
 
-        name, role, uri, display_name = m.groups()
+        name, role, uri, display_name = fields
         path, uri = _clean_up_path(uri.replace("$", name))
 
+        yield name, role, path, uri, display_name
+
+
+def _records_to_tuples(
+    check_exists: Callable[[str], bool], records: Iterable[InventoryRecord]
+) -> Mapping[str, dict[str, tuple[str, str]]]:
+    rv: Mapping[str, dict[str, tuple[str, str]]] = defaultdict(dict)
+
+    for name, role, path, uri, display_name in records:
         if not check_exists(path):
             continue
 
@@ -111,9 +355,100 @@ def _lines_to_tuples(
     return rv
 
 
+DEFAULT_CACHE_SIZE = 256 * 2**20
+_CACHE_VERSION = 1
+
+
+@attrs.frozen
+class InventoryCache:
+    """
+    An on-disk cache of parsed inventories in the directory *path*.
+
+    Entries are keyed by the hash of the inventory file. Once they take more
+    than *max_size* bytes, the least recently used ones are evicted.
+    """
+
+    path: Path
+    max_size: int = DEFAULT_CACHE_SIZE
+
+    def get(self, key: str) -> list[InventoryRecord] | None:
+        """
+        Return the records stored for *key*, or `None` on a miss.
+        """
+        entry = self._entry(key)
+        try:
+            data = entry.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        try:
+            records = marshal.loads(zlib.decompress(data))
+        except (ValueError, EOFError, TypeError, zlib.error):
+            log.warning("Removing corrupt inventory cache entry '%s'.", entry)
+            entry.unlink(missing_ok=True)
+
+            return None
+
+        # Mark it as recently used.
+        with contextlib.suppress(OSError):
+            os.utime(entry)
+
+        return records  # type: ignore[no-any-return]
+
+    def put(self, key: str, records: list[InventoryRecord]) -> None:
+        """
+        Store *records* for *key* and evict old entries if necessary.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        entry = self._entry(key)
+        tmp = entry.with_name(f".{entry.name}.{os.getpid()}")
+        tmp.write_bytes(zlib.compress(marshal.dumps(records), 1))
+        os.replace(tmp, entry)
+
+        self._evict(keep=entry)
+
+    def _entry(self, key: str) -> Path:
+        return self.path / f"{key}-{_CACHE_VERSION}.inv"
+
+    def _evict(self, keep: Path) -> None:
+        """
+        Remove the least recently used entries -- except *keep* -- until the
+        cache fits into *max_size*.
+        """
+        entries = []
+        for e in os.scandir(self.path):
+            if not e.name.endswith(".inv") or e.name.startswith("."):
+                continue
+            try:
+                st = e.stat()
+            except FileNotFoundError:  # Evicted concurrently.
+                continue
+
+            entries.append((st.st_mtime, st.st_size, e.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if path == os.fspath(keep):
+                continue
+
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+
 @attrs.define
 class CachedFileExists:
+    """
+    Check whether paths exist below *base*, caching the results.
+
+    If *scanned* is passed, it's used as the set of all paths below *base*
+    instead of asking the file system. Unlike the file system, it is always
+    case-sensitive.
+    """
+
     base: Path
+    scanned: frozenset[str] | None = None
     _exists: set[str] = attrs.Factory(set)
     _missing: set[str] = attrs.Factory(set)
 
@@ -124,7 +459,11 @@ class CachedFileExists:
         if path in self._missing:
             return False
 
-        if Path(self.base / path).exists():
+        if (
+            posixpath.normpath(path) in self.scanned
+            if self.scanned is not None
+            else Path(self.base / path).exists()
+        ):
             self._exists.add(path)
 
             return True
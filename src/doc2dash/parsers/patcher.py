@@ -4,74 +4,564 @@
 
 from __future__ import annotations
 
+import inspect
 import logging
+import multiprocessing
+import pickle
+import shutil
+import time
 import urllib
 
-from collections import defaultdict
+from array import array
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
 from pathlib import Path
-from typing import Generator
+from typing import ContextManager, Generator, Iterable, Iterator
 
 from rich.progress import Progress
 
+from .. import stats
+from ..copying import ensure_own_copy
 from ..output import console
-from .types import EntryType, Parser, ParserEntry
+from .types import EntryType, Parser, ParserEntry, Patcher
 
 
 log = logging.getLogger(__name__)
 
 
 def patch_anchors(
-    parser: Parser, docs: Path, show_progressbar: bool
+    parser: Parser,
+    docs: Path,
+    show_progressbar: bool,
+    jobs: int = 1,
+    source: Path | None = None,
 ) -> Generator[None, ParserEntry, None]:
     """
     Consume ``ParseEntry``s then patch docs for TOCs by calling
     *parser*'s ``find_entry_and_add_ref``.
+
+    If *jobs* is larger than 1, files are patched in parallel using a pool of
+    *jobs* processes -- if *parser* can be pickled. Otherwise, they're
+    patched serially.
+
+    If *source* is passed, files are read from *source* and written patched
+    to *docs* instead of being patched in place.
+
+    If *parser* declares that its entries are grouped by file, each file is
+    patched as soon as the entries of the next one start coming in.
     """
-    files = defaultdict(list)
-    num = 0
+    if getattr(parser, "grouped_by_file", False):
+        yield from _patch_grouped(parser, docs, show_progressbar, jobs, source)
+        return
+
+    files = PendingEntries()
     try:
         while True:
             pentry = yield
-            try:
-                fname, anchor = pentry.path.split("#")
-                files[urllib.parse.unquote(fname)].append(
-                    (pentry.name, pentry.type, anchor)
-                )
-                num += 1
-            except ValueError:
-                # pydoctor has no anchors for e.g. classes
-                pass
+            file_anchor = split_anchor(pentry)
+            if file_anchor is not None:
+                fname, anchor = file_anchor
+                files.append(fname, pentry.name, pentry.type, anchor)
     except GeneratorExit:
         pass
 
     with Progress(console=console, disable=not show_progressbar) as pbar:
-        _patch_files(parser, docs, files, num, pbar)
+        dispatcher = _Dispatcher(
+            parser,
+            docs,
+            pbar,
+            jobs if files.num_files() > 1 else 1,
+            source,
+            total=len(files),
+        )
+        with dispatcher:
+            for fname, entries in files.items():
+                dispatcher.submit(fname, entries)
+
+
+def _patch_grouped(
+    parser: Parser,
+    docs: Path,
+    show_progressbar: bool,
+    jobs: int,
+    source: Path | None,
+) -> Generator[None, ParserEntry, None]:
+    """
+    Like `patch_anchors`, but only hold the entries of one file at a time.
+
+    Entries for files that have been patched already -- the parser broke its
+    promise -- are patched into the patched files at the end.
+    """
+    current: str | None = None
+    entries = PendingEntries()
+    late = PendingEntries()
+    done: set[str] = set()
+    num = 0
+    with (
+        Progress(console=console, disable=not show_progressbar) as pbar,
+        _Dispatcher(parser, docs, pbar, jobs, source) as dispatcher,
+    ):
+        try:
+            while True:
+                pentry = yield
+                file_anchor = split_anchor(pentry)
+                if file_anchor is None:
+                    continue
+
+                fname, anchor = file_anchor
+                num += 1
+                if fname in done:
+                    late.append(fname, pentry.name, pentry.type, anchor)
+                    continue
+
+                if fname != current:
+                    for item in entries.items():
+                        dispatcher.submit(*item)
+                    if current is not None:
+                        done.add(current)
+                    entries = PendingEntries()
+                    current = fname
+
+                entries.append(fname, pentry.name, pentry.type, anchor)
+        except GeneratorExit:
+            pass
+
+        for item in entries.items():
+            dispatcher.submit(*item)
+        dispatcher.set_total(num)
+
+        if late.num_files():
+            log.debug("Entries of %d files weren't grouped.", late.num_files())
+            dispatcher.wait()
+            for item in late.items():
+                dispatcher.submit(*item, in_place=True)
+
+
+def split_anchor(pentry: ParserEntry) -> tuple[str, str] | None:
+    """
+    Split *pentry*'s path into the unquoted file name and the anchor.
+
+    Returns:
+        `None` if the path has no anchor -- pydoctor has none for e.g.
+        classes.
+    """
+    try:
+        fname, anchor = pentry.path.split("#")
+    except ValueError:
+        return None
+
+    return urllib.parse.unquote(fname), anchor
+
+
+PatchEntries = list[tuple[str, EntryType, str]]
+
+_ENTRY_TYPES = list(EntryType)
+_TYPE_CODES = {t: i for i, t in enumerate(_ENTRY_TYPES)}
+# Set on a type code if the anchor is the name -- typical for Sphinx.
+_ANCHOR_IS_NAME = 0x80
+
+
+class PendingEntries:
+    """
+    Entries that wait for being patched into their files.
+
+    Since every index entry of a docset ends up here before the first file is
+    patched, they're stored in columns instead of as tuples: file names are
+    interned, types are stored as small integers, and names and anchors as
+    UTF-8 in one shared buffer -- anchors only if they differ from the name.
+    The entries of each file are chained by their positions, such that they
+    can be read back per file in the order they were added.
+    """
+
+    def __init__(self) -> None:
+        self._file_ids: dict[str, int] = {}
+        self._heads = array("q")
+        self._tails = array("q")
+        self._counts = array("q")
+        self._next = array("q")
+        self._types = array("B")
+        # End offsets of each entry's name and anchor within _strings.
+        self._ends = array("Q")
+        self._strings = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._types)
+
+    def num_files(self) -> int:
+        return len(self._file_ids)
+
+    def append(
+        self, fname: str, name: str, type: EntryType, anchor: str
+    ) -> None:
+        i = len(self._types)
+        file_id = self._file_ids.setdefault(fname, len(self._file_ids))
+        if file_id == len(self._heads):
+            self._heads.append(i)
+            self._tails.append(i)
+            self._counts.append(1)
+        else:
+            self._next[self._tails[file_id]] = i
+            self._tails[file_id] = i
+            self._counts[file_id] += 1
+
+        self._next.append(-1)
+        self._strings += name.encode()
+        self._ends.append(len(self._strings))
+        if anchor == name:
+            self._types.append(_TYPE_CODES[type] | _ANCHOR_IS_NAME)
+        else:
+            self._types.append(_TYPE_CODES[type])
+            self._strings += anchor.encode()
+        self._ends.append(len(self._strings))
+
+    def items(self) -> Iterator[tuple[str, PatchEntries]]:
+        """
+        Yield the file names and their entries in the order the files were
+        added.
+
+        Only the entries of the file that is yielded are materialized.
+        """
+        for fname, file_id in self._file_ids.items():
+            entries = []
+            i = self._heads[file_id]
+            while i != -1:
+                start = self._ends[2 * i - 1] if i else 0
+                mid = self._ends[2 * i]
+                code = self._types[i]
+                name = self._strings[start:mid].decode()
+                anchor = (
+                    name
+                    if code & _ANCHOR_IS_NAME
+                    else self._strings[mid : self._ends[2 * i + 1]].decode()
+                )
+                entries.append(
+                    (name, _ENTRY_TYPES[code & ~_ANCHOR_IS_NAME], anchor)
+                )
+                i = self._next[i]
+
+            yield fname, entries
+
+
+class _Dispatcher:
+    """
+    Patch files as they're submitted -- using a pool of *jobs* processes if
+    *jobs* is larger than 1 -- and report the progress to *pbar*.
+
+    Leaving the context waits for all files and warns about the anchors that
+    couldn't be found.
+    """
+
+    def __init__(
+        self,
+        parser: Parser,
+        docs: Path,
+        pbar: Progress,
+        jobs: int,
+        source: Path | None,
+        total: int | None = None,
+    ):
+        if jobs > 1 and not _can_pickle(parser):
+            log.debug(
+                "Can't pickle parser %r; patching files serially.", parser
+            )
+            jobs = 1
+
+        self._parser = parser
+        self._docs = docs
+        self._pbar = pbar
+        self._task = pbar.add_task("Patching for TOCs...", total=total)
+        self._jobs = jobs
+        self._source = source
+        self._pool = (
+            ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=_mp_context(),
+                initializer=_init_worker,
+            )
+            if jobs > 1
+            else None
+        )
+        self._pending: dict[Future[_WorkerResult], tuple[str, int]] = {}
+        self._num_failed = 0
+
+    def __enter__(self) -> _Dispatcher:
+        return self
+
+    def __exit__(self, exc_type: object, *_: object) -> None:
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            if self._pool is not None:
+                with _stage():
+                    self._pool.shutdown(cancel_futures=True)
+
+        if exc_type is None and self._num_failed:
+            log.warning(
+                "Failed to add anchors for %s TOC entries.", self._num_failed
+            )
+
+    def set_total(self, total: int) -> None:
+        self._pbar.update(self._task, total=total)
+
+    def submit(
+        self, fname: str, entries: PatchEntries, *, in_place: bool = False
+    ) -> None:
+        """
+        Patch *entries* into *fname*.
+
+        If *in_place* is True, the file in *docs* is patched even if a
+        *source* has been passed.
+
+        Only a few files per process are in flight at a time, such that the
+        entries of all files are never materialized at once.
+        """
+        source = None if in_place else self._source
+        if stats.active() is not None:
+            stats.count(
+                "bytes_read", ((source or self._docs) / fname).stat().st_size
+            )
+
+        if self._pool is None:
+            with _stage():
+                failed = _patch_file(
+                    self._parser, self._docs, fname, entries, source
+                )
+            self._report(fname, len(entries), failed)
+            return
+
+        if len(self._pending) >= 2 * self._jobs:
+            with _stage():
+                self._collect(FIRST_COMPLETED)
+
+        fut = self._pool.submit(
+            _patch_file_in_worker,
+            self._parser,
+            self._docs,
+            fname,
+            entries,
+            source,
+        )
+        self._pending[fut] = (fname, len(entries))
+
+    def wait(self) -> None:
+        """
+        Wait until all submitted files are patched.
+        """
+        with _stage():
+            while self._pending:
+                self._collect(ALL_COMPLETED)
+
+    def _collect(self, return_when: str) -> None:
+        done, _ = wait(self._pending, return_when=return_when)
+        for fut in done:
+            fname, num_entries = self._pending.pop(fut)
+            failed, records, cpu, rss = fut.result()
+            for record in records:
+                logger = logging.getLogger(record.name)
+                if logger.isEnabledFor(record.levelno):
+                    logger.handle(record)
+            stats.add_process("patch", cpu, rss, "files")
+            self._report(fname, num_entries, failed)
+
+    def _report(
+        self,
+        fname: str,
+        num_entries: int,
+        failed: list[tuple[str, EntryType]],
+    ) -> None:
+        for anchor, type in failed:
+            log.debug(
+                "Can't find anchor '%s' (%s) in '%s'.",
+                anchor,
+                type,
+                fname,
+            )
+        self._num_failed += len(failed)
+
+        self._pbar.update(self._task, advance=num_entries)
+        stats.add_items("patch", 1, "files")
+
+
+def _can_pickle(obj: object) -> bool:
+    try:
+        pickle.dumps(obj)
+    except Exception:  # noqa: BLE001 -- anything can happen while pickling.
+        return False
+
+    return True
+
+
+class _RecordCollector(logging.Handler):
+    """
+    Collect log records in a pool process, such that they can be handled by
+    the parent -- processes that aren't forked don't inherit its logging
+    configuration.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Make it picklable.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+
+        self.records.append(record)
+
+
+_collector = _RecordCollector()
+
+
+def _init_worker() -> None:
+    root = logging.getLogger()
+    root.addHandler(_collector)
+    root.setLevel(logging.DEBUG)
+
+
+# The anchors that couldn't be found, the emitted log records, the CPU
+# seconds it took, and the process's peak RSS.
+_WorkerResult = tuple[
+    list[tuple[str, EntryType]], list[logging.LogRecord], float, int | None
+]
+
+
+def _patch_file_in_worker(
+    parser: Parser,
+    docs: Path,
+    fname: str,
+    entries: Iterable[tuple[str, EntryType, str]],
+    source: Path | None = None,
+) -> _WorkerResult:
+    """
+    Run `_patch_file` in a pool process and return the log records it
+    emitted and the resources it used, too.
+
+    Pool processes aren't our children, so that's the only way to know.
+    """
+    start = time.process_time()
+    try:
+        failed = _patch_file(parser, docs, fname, entries, source)
 
+        return (
+            failed,
+            list(_collector.records),
+            time.process_time() - start,
+            stats.peak_rss(),
+        )
+    finally:
+        _collector.records.clear()
 
-def _patch_files(
+
+def _mp_context() -> multiprocessing.context.BaseContext:
+    """
+    Return a multiprocessing context that doesn't fork this process.
+
+    By the time files are patched, the search index is written by another
+    thread and forking with live threads can deadlock the children.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+
+    return multiprocessing.get_context("spawn")
+
+
+def _stage() -> ContextManager[None]:
+    """
+    Time patching -- the pool's processes report their CPU time with each
+    file.
+    """
+    return stats.stage("patch", "files")
+
+
+def _patch_file(
     parser: Parser,
     docs: Path,
-    files: dict[str, list[tuple[str, EntryType, str]]],
-    num: int,
-    pbar: Progress,
-) -> None:
-    entry_task = pbar.add_task("Patching for TOCs...", total=num)
-    num_failed = 0
-    for fname, entries in files.items():
-        with parser.make_patcher_for_file(docs / fname) as patch:
-            for name, type, anchor in entries:
-                if not patch(
-                    name, type, anchor, f"//apple_ref/cpp/{type.value}/{name}"
-                ):
-                    log.debug(
-                        "Can't find anchor '%s' (%s) in '%s'.",
-                        anchor,
-                        type,
-                        fname,
-                    )
-                    num_failed += 1
-
-                pbar.update(entry_task, advance=1)
-
-    if num_failed:
-        log.warning("Failed to add anchors for %s TOC entries.", num_failed)
+    fname: str,
+    entries: Iterable[tuple[str, EntryType, str]],
+    source: Path | None = None,
+) -> list[tuple[str, EntryType]]:
+    """
+    Patch all *entries* into *fname* and return the anchors and types of those
+    that couldn't be found.
+
+    Use *parser*'s ``patch_file`` if it has one and
+    ``make_patcher_for_file`` otherwise.
+    """
+    args = [
+        (name, type, anchor, f"//apple_ref/cpp/{type.value}/{name}")
+        for name, type, anchor in entries
+    ]
+    patch_file = getattr(parser, "patch_file", None)
+    if patch_file is not None:
+        path, dest = _prepare_paths(docs, fname, source)
+        patched = patch_file(path, args, dest=dest).patched
+    else:
+        with _open_patcher(parser, docs, fname, source) as patch:
+            patched = [patch(*a) for a in args]
+
+    return [
+        (anchor, type)
+        for (_, type, anchor, _), ok in zip(args, patched)
+        if not ok
+    ]
+
+
+def _prepare_paths(
+    docs: Path, fname: str, source: Path | None
+) -> tuple[Path, Path | None]:
+    """
+    Prepare patching *fname* within *docs*.
+
+    If *source* is passed, *fname* is read from there instead and replaces
+    the file in *docs* if it exists.
+
+    Returns:
+        The path to read and the destination if it's a different one.
+    """
+    path = docs / fname
+    if source is None:
+        # Don't modify the source through a hardlink.
+        ensure_own_copy(path)
+
+        return path, None
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Replace, don't overwrite: *path* may be a hardlink to *source*.
+    path.unlink(missing_ok=True)
+
+    return source / fname, path
+
+
+def _open_patcher(
+    parser: Parser, docs: Path, fname: str, source: Path | None
+) -> ContextManager[Patcher]:
+    """
+    Open a patcher for *fname* within *docs* -- see `_prepare_paths`.
+
+    Parsers whose ``make_patcher_for_file`` don't take a *dest* argument get
+    the file copied first.
+    """
+    path, dest = _prepare_paths(docs, fname, source)
+    if dest is None:
+        return parser.make_patcher_for_file(path)
+
+    if "dest" in inspect.signature(parser.make_patcher_for_file).parameters:
+        return parser.make_patcher_for_file(  # type: ignore[call-arg]
+            path, dest=dest
+        )
+
+    shutil.copy2(path, dest)
+
+    return parser.make_patcher_for_file(dest)
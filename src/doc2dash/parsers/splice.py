@@ -0,0 +1,146 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Patch HTML without building and re-serializing a document tree.
+
+A streaming tokenizer finds the start tags and their offsets, and the new
+markup is spliced into the original text. Everything else is left untouched.
+"""
+
+from __future__ import annotations
+
+import html
+import re
+
+from html.parser import HTMLParser
+from typing import Container, Iterable, Iterator
+
+
+Attrs = dict[str, str]
+
+
+def iter_start_tags(text: str) -> Iterator[tuple[str, Attrs, int]]:
+    """
+    Yield the name, the attributes, and the character offset of every start
+    tag in *text*.
+
+    Attribute values are unescaped and for duplicate attributes the last one
+    wins -- just like BeautifulSoup's ``html.parser`` tree builder.
+    """
+    collector = _StartTagCollector(text)
+    collector.feed(text)
+    collector.close()
+
+    return iter(collector.tags)
+
+
+# The attributes of a start tag: like in HTMLParser, only a quote right
+# after an "=" starts a quoted value -- "title=it's" is a bare value. Each
+# character can only be matched in one way, such that tags without an end
+# don't make the matching backtrack exponentially.
+_ATTRS = r"""(?:[^>=]|=+(?!=)\s*(?:"[^"]*"|'[^']*'|(?![\s"'])))*"""
+# Comments, raw text elements, and start tags -- in this order, such that
+# the former two are skipped as a whole, except for the start tags of raw
+# text elements.
+_TOKEN = re.compile(
+    rf"""
+    <!--.*?-->
+    | <(?P<raw>script|style)\b(?P<raw_attrs>{_ATTRS})>
+      .*?</(?P=raw)\s*>
+    | <(?P<tag>[a-zA-Z][^\s/>]*)(?P<attrs>{_ATTRS})>
+    """,
+    re.DOTALL | re.IGNORECASE | re.VERBOSE,
+)
+# Like HTMLParser's tolerant attribute matching.
+_ATTR = re.compile(
+    r"""([^\s/>"'=][^\s/=>]*)(?:\s*=+\s*('[^']*'|"[^"]*"|(?!['"])[^>\s]*))?"""
+)
+_MAYBE_WANTED = re.compile(r"(?:id|href)\s*=", re.IGNORECASE)
+
+
+def scan_start_tags(
+    text: str, values: Container[str]
+) -> Iterator[tuple[str, Attrs, int]]:
+    """
+    Like `iter_start_tags`, but only yield the start tags whose ``id`` is in
+    *values* or whose ``href`` is ``#`` followed by one of *values*.
+
+    *text* is scanned in a single pass of one regular expression that skips
+    comments and the contents of ``<script>`` and ``<style>``. Attributes
+    are only parsed for tags that have an ``id`` or an ``href``, and their
+    values are looked up in *values* -- like in a multi-pattern search.
+    """
+    for m in _TOKEN.finditer(text):
+        tag, raw_attrs = m.group("tag", "attrs")
+        if tag is None:
+            tag, raw_attrs = m.group("raw", "raw_attrs")
+        if not raw_attrs or not _MAYBE_WANTED.search(raw_attrs):
+            continue
+
+        attrs = _parse_attrs(raw_attrs)
+        id = attrs.get("id")
+        href = attrs.get("href", "")
+        if id in values or (href.startswith("#") and href[1:] in values):
+            yield tag.lower(), attrs, m.start()
+
+
+def _parse_attrs(raw: str) -> Attrs:
+    """
+    Parse the attributes of a start tag like HTMLParser: names are
+    lowercased, values are unescaped, and for duplicates the last one wins.
+    """
+    attrs = {}
+    for name, value in _ATTR.findall(raw):
+        if value[:1] in ("'", '"'):
+            value = value[1:-1]
+        attrs[name.lower()] = html.unescape(value) if "&" in value else value
+
+    return attrs
+
+
+def splice(text: str, insertions: Iterable[tuple[int, str]]) -> str:
+    """
+    Insert the markup of each ``(offset, markup)`` pair of *insertions* into
+    *text*.
+
+    Markup for the same offset is inserted in the order it was passed.
+    """
+    chunks = []
+    last = 0
+    for offset, markup in sorted(insertions, key=lambda i: i[0]):
+        chunks.append(text[last:offset])
+        chunks.append(markup)
+        last = offset
+    chunks.append(text[last:])
+
+    return "".join(chunks)
+
+
+class _StartTagCollector(HTMLParser):
+    def __init__(self, text: str) -> None:
+        super().__init__(convert_charrefs=True)
+
+        # HTMLParser counts lines by "\n" only.
+        self._line_starts = [0]
+        pos = text.find("\n")
+        while pos != -1:
+            self._line_starts.append(pos + 1)
+            pos = text.find("\n", pos + 1)
+
+        self.tags: list[tuple[str, Attrs, int]] = []
+
+    def handle_starttag(
+        self, tag: str, attrs: list[tuple[str, str | None]]
+    ) -> None:
+        line, col = self.getpos()
+        self.tags.append(
+            (
+                tag,
+                {k: v or "" for k, v in attrs},
+                self._line_starts[line - 1] + col,
+            )
+        )
+
+    handle_startendtag = handle_starttag
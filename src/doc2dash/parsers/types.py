@@ -49,6 +49,23 @@ class Parser(Protocol):
     Attributes:
         name: The name of this parser. Used in user-facing output.
 
+        exclude_profile: *Optional*: Glob patterns of files that the
+            documentation contains, but Dash never uses. They're left out of
+            the docset if the user passes `--exclude-defaults`.
+
+        grouped_by_file: *Optional*: If True, `parse()` yields the entries of
+            each file in one go -- e.g., sorted by path. *doc2dash* then
+            patches each file as soon as the entries for the next one come in,
+            instead of holding on to all entries until parsing is done.
+
+    Parsers may also implement a `patch_file(path, entries, *, dest=None)`
+    method that patches all *entries* of a file at once and returns a
+    [`PatchResult`][doc2dash.parsers.types.PatchResult]. *entries* is a
+    sequence of the arguments that a `Patcher` would be called with and
+    *dest* works like for `make_patcher_for_file()`. If it's there,
+    *doc2dash* uses it instead of `make_patcher_for_file()`, such that a
+    parser can resolve all anchors of a file in one pass.
+
     """
 
     name: ClassVar[str] = NotImplemented
@@ -92,6 +109,12 @@ class Parser(Protocol):
         A context manager that prepares for patching *path* and returns a
         `Patcher` callable.
 
+        Parsers may additionally accept a keyword-only *dest* argument. If
+        it's passed, they must write the patched file -- or an unchanged
+        copy -- to *dest* and leave *path* alone. *doc2dash* uses it to
+        patch files while copying them into the docset. If a parser doesn't
+        accept it, *doc2dash* copies the file before patching it.
+
         Args:
             path: path to file to patch
 
@@ -121,6 +144,25 @@ class Patcher(Protocol):
         """
 
 
+PatchEntry = tuple[str, EntryType, str, str]
+"""
+The arguments for a `Patcher`: name, type, anchor, and reference.
+"""
+
+
+@attrs.frozen
+class PatchResult:
+    """
+    What a parser's `patch_file()` method did.
+    """
+
+    patched: list[bool]
+    """
+    Whether the anchor for each entry was found and patched -- in the order
+    of the entries.
+    """
+
+
 @attrs.frozen
 class ParserEntry:
     """
@@ -0,0 +1,350 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Measure where the time of a conversion goes.
+
+Code reports into the recording that is active -- if any -- through the
+module-level functions, such that nothing has to be passed around and
+nothing is measured unless somebody asked for it.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import sys
+import threading
+import time
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Iterator,
+    ParamSpec,
+    TypeVar,
+)
+
+import attrs
+
+from rich.table import Table
+
+
+try:
+    import resource
+except ImportError:  # pragma: no cover -- Windows
+    resource = None  # type: ignore[assignment]
+
+if TYPE_CHECKING:
+    from .copying import CopyStats
+
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+@attrs.define
+class Stage:
+    """
+    The accumulated times and work of one stage.
+
+    Attributes:
+        wall: Seconds spent in the stage -- not counting nested stages.
+
+        cpu: CPU seconds of the threads and processes that ran the stage.
+
+        items: How many things the stage processed.
+
+        unit: What *items* are.
+    """
+
+    unit: str
+    wall: float = 0.0
+    cpu: float = 0.0
+    items: int = 0
+
+    @property
+    def rate(self) -> float | None:
+        """
+        Items per second, if there were any.
+        """
+        if not self.items or not self.wall:
+            return None
+
+        return self.items / self.wall
+
+
+class Stats:
+    """
+    Stage timings and counters of one conversion.
+
+    Stages may run in several threads at the same time, so their wall times
+    can add up to more than the total.
+
+    Only the calling thread's CPU time is measured by `stage`. The work of
+    pool threads and processes must be added using `add_cpu` and
+    `add_process`.
+    """
+
+    def __init__(self) -> None:
+        self.stages: dict[str, Stage] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = _process_cpu()
+        self._other_cpu = 0.0
+        self._other_rss: int | None = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str, unit: str = "items") -> Iterator[None]:
+        """
+        Time the code within as stage *name*.
+
+        While a nested stage runs in the same thread, the outer one is
+        paused.
+        """
+        stack = self._stack()
+        if stack:
+            self._stop(stack[-1])
+
+        frame = [name, unit, *_now()]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            self._stop(frame)
+            if stack:
+                stack[-1][2:] = _now()
+
+    def add_items(self, name: str, n: int, unit: str = "items") -> None:
+        with self._lock:
+            self.stages.setdefault(name, Stage(unit)).items += n
+
+    def add_cpu(self, name: str, cpu: float, unit: str = "items") -> None:
+        """
+        Add *cpu* seconds that another thread of this process spent on stage
+        *name*.
+        """
+        with self._lock:
+            self.stages.setdefault(name, Stage(unit)).cpu += cpu
+
+    def add_process(
+        self, name: str, cpu: float, rss: int | None, unit: str = "items"
+    ) -> None:
+        """
+        Add *cpu* seconds that another process spent on stage *name* to both
+        the stage and the total, and take its peak RSS of *rss* bytes into
+        account.
+
+        For processes that aren't waited for by this one -- like those of a
+        pool that is started by a fork server -- and therefore don't show up
+        in its children's resource usage.
+        """
+        with self._lock:
+            self.stages.setdefault(name, Stage(unit)).cpu += cpu
+            self._other_cpu += cpu
+            if rss is not None:
+                self._other_rss = max(rss, self._other_rss or 0)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> dict[str, Any]:
+        """
+        Return the statistics as a JSON-serializable dictionary.
+        """
+        rss = peak_rss()
+        if self._other_rss is not None:
+            rss = max(rss or 0, self._other_rss)
+
+        return {
+            "wall": time.perf_counter() - self._start_wall,
+            "cpu": _process_cpu() - self._start_cpu + self._other_cpu,
+            "peak_rss": rss,
+            "stages": {
+                name: {**attrs.asdict(stage), "rate": stage.rate}
+                for name, stage in self.stages.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def to_table(self) -> Table:
+        """
+        Return the statistics as a Rich table.
+        """
+        d = self.as_dict()
+        table = Table(title="Statistics", title_justify="left")
+        table.add_column("Stage")
+        table.add_column("Wall", justify="right")
+        table.add_column("CPU", justify="right")
+        table.add_column("Throughput", justify="right")
+        for name, stage in self.stages.items():
+            table.add_row(
+                name,
+                f"{stage.wall:.2f}s",
+                f"{stage.cpu:.2f}s",
+                ""
+                if stage.rate is None
+                else f"{stage.items:,} {stage.unit} ({stage.rate:,.0f}/s)",
+            )
+        table.add_section()
+        table.add_row("total", f"{d['wall']:.2f}s", f"{d['cpu']:.2f}s", "")
+        for name, n in self.counters.items():
+            table.add_row(name.replace("_", " "), "", "", _format_bytes(n))
+        rss = d["peak_rss"]
+        table.add_row(
+            "peak RSS", "", "", _format_bytes(rss) if rss is not None else "?"
+        )
+
+        return table
+
+    def _stack(self) -> list[list[Any]]:
+        try:
+            return self._local.stack  # type: ignore[no-any-return]
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack  # type: ignore[no-any-return]
+
+    def _stop(self, frame: list[Any]) -> None:
+        name, unit, wall, cpu = frame
+        now_wall, now_cpu = _now()
+        with self._lock:
+            stage = self.stages.setdefault(name, Stage(unit))
+            stage.wall += now_wall - wall
+            stage.cpu += now_cpu - cpu
+
+
+def _now() -> tuple[float, float]:
+    return time.perf_counter(), time.thread_time()
+
+
+def _process_cpu() -> float:
+    t = os.times()
+
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def peak_rss() -> int | None:
+    """
+    Return the peak resident set size in bytes of this process or any of its
+    finished children -- if the platform can tell.
+    """
+    if resource is None:  # pragma: no cover
+        return None
+
+    rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+    # macOS reports bytes, everybody else KiB.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:,.0f} {unit}" if unit == "B" else f"{n:,.1f} {unit}"
+        n /= 1024
+
+    return f"{n:,.1f} GiB"
+
+
+_active: Stats | None = None
+
+
+@contextlib.contextmanager
+def recording() -> Iterator[Stats]:
+    """
+    Record the statistics of everything within into a new `Stats`.
+    """
+    global _active
+
+    _active = Stats()
+    try:
+        yield _active
+    finally:
+        _active = None
+
+
+def active() -> Stats | None:
+    """
+    Return the active recording, if any.
+    """
+    return _active
+
+
+def stage(name: str, unit: str = "items") -> ContextManager[None]:
+    """
+    Time the code within as stage *name* if a recording is active -- see
+    `Stats.stage`.
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+
+    return _active.stage(name, unit)
+
+
+def add_items(name: str, n: int, unit: str = "items") -> None:
+    """
+    Count *n* items for stage *name* if a recording is active.
+    """
+    if _active is not None:
+        _active.add_items(name, n, unit)
+
+
+def add_process(
+    name: str, cpu: float, rss: int | None, unit: str = "items"
+) -> None:
+    """
+    Add the CPU time and peak RSS of another process to stage *name* if a
+    recording is active -- see `Stats.add_process`.
+    """
+    if _active is not None:
+        _active.add_process(name, cpu, rss, unit)
+
+
+def in_stage(
+    name: str, fn: Callable[P, T], unit: str = "items"
+) -> Callable[P, T]:
+    """
+    Wrap *fn* such that the CPU time of the thread that calls it is added to
+    stage *name* -- for functions that are run by a thread pool on behalf
+    of a stage.
+
+    Returns *fn* itself if no recording is active.
+    """
+    s = _active
+    if s is None:
+        return fn
+
+    def wrapper(*args: P.args, **kw: P.kwargs) -> T:
+        start = time.thread_time()
+        try:
+            return fn(*args, **kw)
+        finally:
+            s.add_cpu(name, time.thread_time() - start, unit)
+
+    return wrapper
+
+
+def record_copy(copied: CopyStats) -> None:
+    """
+    Account *copied* to the copy stage if a recording is active.
+    """
+    add_items("copy", copied.files, "files")
+    count("bytes_copied", copied.bytes)
+
+
+def count(name: str, n: int = 1) -> None:
+    """
+    Add *n* to the counter *name* if a recording is active.
+    """
+    if _active is not None:
+        _active.count(name, n)
@@ -2,17 +2,28 @@
 #
 # SPDX-License-Identifier: MIT
 
+import pickle
+import shutil
+import zlib
+
 from pathlib import Path
 
 import pytest
 
 from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
 
+from doc2dash.parsers import intersphinx
 from doc2dash.parsers.intersphinx import (
+    PATCH_ENGINES,
     InterSphinxParser,
+    _AnchorIndex,
     _find_entry_and_add_ref,
+    _resolve_html_parser,
 )
-from doc2dash.parsers.types import EntryType, ParserEntry
+from doc2dash.parsers.intersphinx_inventory import InventoryCache
+from doc2dash.parsers.splice import iter_start_tags
+from doc2dash.parsers.types import EntryType, ParserEntry, PatchResult
 
 
 HERE = Path(__file__).parent
@@ -28,6 +39,72 @@ class TestInterSphinxParser:
 
         assert [] != list(p.parse())
 
+    def test_parse_streams(self, tmp_path, caplog):
+        """
+        Entries are yielded in inventory order while it's decoded -- they're
+        not grouped by file.
+        """
+        (tmp_path / "a.html").touch()
+        (tmp_path / "b.html").touch()
+        (tmp_path / "objects.inv").write_bytes(
+            b"# Sphinx inventory version 2\n"
+            b"# Project: test\n"
+            b"# Version: 1\n"
+            b"# The remainder of this file is compressed using zlib.\n"
+            + zlib.compress(
+                b"x py:class 1 b.html#$ -\n"
+                b"y py:class 1 a.html#$ -\n"
+                b"z py:class 1 b.html#$ -\n"
+                b"yolo"
+            )
+        )
+        p = InterSphinxParser(source=tmp_path)
+        entries = p.parse()
+
+        assert "x" == next(entries).name
+        assert [] == caplog.messages
+        assert ["y", "z"] == [e.name for e in entries]
+        assert not p.grouped_by_file
+
+    def test_parse_grouped_if_cached(self, tmp_path, sphinx_built):
+        """
+        With an inventory cache, the same entries are yielded grouped by file
+        -- in inventory order within each file.
+        """
+        p = InterSphinxParser(source=sphinx_built)
+        cached = InterSphinxParser(
+            source=sphinx_built, inventory_cache=InventoryCache(tmp_path)
+        )
+        entries = list(p.parse())
+        files = [e.path.split("#")[0] for e in cached.parse()]
+
+        assert cached.grouped_by_file
+        assert sorted(files) == files
+        assert sorted(entries, key=lambda e: e.path.split("#")[0]) == list(
+            cached.parse()
+        )
+
+    def test_parse_last_one_wins(self, tmp_path):
+        """
+        If a name occurs more than once for a role, only the last entry is
+        yielded -- like with load_inventory().
+        """
+        (tmp_path / "index.html").touch()
+        (tmp_path / "objects.inv").write_bytes(
+            b"# Sphinx inventory version 2\n"
+            b"# Project: test\n"
+            b"# Version: 1\n"
+            b"# The remainder of this file is compressed using zlib.\n"
+            + zlib.compress(
+                b"foo py:function 1 index.html#a -\n"
+                b"foo py:function 1 index.html#b -\n"
+            )
+        )
+
+        assert ["index.html#b"] == [
+            e.path for e in InterSphinxParser(source=tmp_path).parse()
+        ]
+
     def test_inv_to_entries(self, sphinx_built):
         """
         Inventory items are correctly converted.
@@ -294,6 +371,463 @@ class TestFindAndPatchEntry:
         )
 
 
+class TestAnchorIndex:
+    def test_first_match_wins(self):
+        """
+        Like soup.find(), the index returns the first element in document
+        order.
+        """
+        soup = BeautifulSoup(
+            '<span id="a">1</span><dt id="a">2</dt><h1>3</h1><h1>4</h1>'
+            '<a class="headerlink" href="#a">5</a>'
+            '<a class="headerlink" href="#a">6</a>',
+            "html.parser",
+        )
+
+        index = _AnchorIndex.from_soup(soup)
+
+        assert "1" == index.ids["a"].text
+        assert "1" == index.span_ids["a"].text
+        assert "2" == index.dt_ids["a"].text
+        assert "3" == index.h1.text
+        assert "5" == index.links["headerlink", "#a"].text
+
+    def test_class_matching(self):
+        """
+        Class filters match single classes and the whole attribute, just like
+        BeautifulSoup.
+        """
+        soup = BeautifulSoup(
+            '<a class="reference internal" href="#a">a</a>', "html.parser"
+        )
+
+        index = _AnchorIndex.from_soup(soup)
+
+        assert {
+            ("reference", "#a"),
+            ("internal", "#a"),
+            ("reference internal", "#a"),
+        } == set(index.links)
+
+    @pytest.mark.parametrize(
+        "entries",
+        [
+            None,
+            [
+                ("term", EntryType.WORD, "term-x"),
+                ("Section", EntryType.SECTION, "section"),
+                ("mod", EntryType.PACKAGE, "module-mod"),
+                ("f", EntryType.FUNCTION, "f"),
+                ("g", EntryType.FUNCTION, "g"),
+                ("h", EntryType.FUNCTION, "h"),
+                ("i", EntryType.FUNCTION, "i"),
+                ("pydoctor", EntryType.FUNCTION, "nope"),
+                ("missing", EntryType.FUNCTION, "missing"),
+            ],
+        ],
+    )
+    def test_same_result_as_soup_find(self, sphinx_built, entries):
+        """
+        The index finds the same elements as the soup.find() lookups that it
+        replaces -- even while the document is patched.
+        """
+        if entries is None:
+            html = (sphinx_built / "index.html").read_text(encoding="utf-8")
+            entries = [
+                (e.name, e.type, e.path.split("#")[1])
+                for e in InterSphinxParser(source=sphinx_built).parse()
+                if e.path.startswith("index.html#")
+            ]
+        else:
+            html = (
+                '<span id="term-x"></span><a class="reference internal" '
+                'href="#f">f</a><h1>Module</h1><dl><dt id="term-x">x</dt></dl>'
+                '<section id="section"><p id="f">'
+                '<a class="headerlink" href="#f">f</a></p></section>'
+                '<a class="reference internal" href="#g">g</a>'
+                '<span id="h"></span>'
+                '<a class="md-nav__link" href="#i">i</a>'
+                '<a name="pydoctor"></a>'
+            )
+        soup = BeautifulSoup(html, "html.parser")
+        index = _AnchorIndex.from_soup(soup)
+
+        for name, type, anchor in entries:
+            expected = _soup_find(soup, name, type, anchor)
+
+            assert expected is index.find(name, type, anchor)
+            assert (expected is not None) is _find_entry_and_add_ref(
+                soup,
+                name,
+                type,
+                anchor,
+                f"//apple_ref/cpp/{type.value}/{name}",
+                index=index,
+            )
+
+
+def _soup_find(soup, name, type, anchor):
+    """
+    The lookups that _AnchorIndex replaces.
+    """
+    pos = None
+    if type == EntryType.WORD:
+        pos = soup.find("dt", id=anchor)
+    elif type == EntryType.SECTION:
+        pos = soup.find(id=anchor)
+    elif anchor.startswith("module-"):
+        pos = soup.h1
+
+    if not pos:
+        pos = (
+            soup.find("a", {"class": "headerlink"}, href="#" + anchor)
+            or soup.find(
+                "a", {"class": "reference internal"}, href="#" + anchor
+            )
+            or soup.find("span", id=anchor)
+            or soup.find("a", {"class": "md-nav__link"}, href="#" + anchor)
+            or soup.find("a", {"name": name})
+        )
+
+    return pos
+
+
+class TestHTMLParser:
+    def test_auto(self):
+        """
+        'auto' picks lxml if it's installed and html.parser otherwise.
+        """
+        expected = "lxml" if builder_registry.lookup("lxml") else "html.parser"
+
+        assert expected == _resolve_html_parser("auto")
+
+    def test_falls_back_if_missing(self, monkeypatch, caplog):
+        """
+        If the requested parser is not installed, html.parser is used and a
+        warning is logged.
+        """
+        monkeypatch.setattr(
+            intersphinx.builder_registry, "lookup", lambda name: None
+        )
+
+        assert "html.parser" == _resolve_html_parser("lxml")
+        assert [
+            "HTML parser 'lxml' is not installed. Falling back to "
+            "'html.parser'."
+        ] == caplog.messages
+
+    def test_resolved_once(self, sphinx_built, monkeypatch, caplog):
+        """
+        The parser is resolved when the InterSphinxParser is created -- not
+        again in pool processes that get a pickled copy of it.
+        """
+        monkeypatch.setattr(
+            intersphinx.builder_registry, "lookup", lambda name: None
+        )
+        p = InterSphinxParser(source=sphinx_built, html_parser="lxml")
+
+        for _ in range(3):
+            assert "html.parser" == pickle.loads(pickle.dumps(p))._tree_builder
+
+        assert 1 == len(caplog.messages)
+
+    def test_rejects_unknown(self, sphinx_built):
+        """
+        Unknown parsers are rejected on instantiation.
+        """
+        with pytest.raises(ValueError):
+            InterSphinxParser(source=sphinx_built, html_parser="nope")
+
+    @pytest.mark.parametrize("html_parser", ["lxml", "html5lib"])
+    def test_finds_same_anchors(self, tmp_path, sphinx_built, html_parser):
+        """
+        Switching the HTML parser doesn't change which anchors are found in
+        our example docs.
+        """
+        if builder_registry.lookup(html_parser) is None:
+            pytest.skip(f"{html_parser} is not installed")
+
+        def patch_all(html_parser):
+            docs = tmp_path / html_parser
+            shutil.copytree(sphinx_built, docs)
+            p = InterSphinxParser(source=docs, html_parser=html_parser)
+            rv = []
+            for e in p.parse():
+                fname, _, anchor = e.path.partition("#")
+                with p.make_patcher_for_file(docs / fname) as patch:
+                    rv.append(
+                        (e, patch(e.name, e.type, anchor, f"ref/{e.name}"))
+                    )
+
+            return rv
+
+        assert patch_all("html.parser") == patch_all(html_parser)
+
+
+class TestSplicingPatcher:
+    def test_same_as_soup(self, tmp_path, sphinx_built):
+        """
+        The splice engine finds the same anchors as the soup engine and
+        inserts the TOC anchors at the same places.
+        """
+
+        def patch_all(engine):
+            docs = tmp_path / engine
+            shutil.copytree(sphinx_built, docs)
+            p = InterSphinxParser(source=docs, patch_engine=engine)
+            found = []
+            for e in p.parse():
+                fname, _, anchor = e.path.partition("#")
+                with p.make_patcher_for_file(docs / fname) as patch:
+                    found.append(
+                        patch(
+                            e.name,
+                            e.type,
+                            anchor,
+                            f"//apple_ref/cpp/{e.type.value}/{e.name}",
+                        )
+                    )
+
+            return docs, found
+
+        soup_docs, soup_found = patch_all("soup")
+        splice_docs, splice_found = patch_all("splice")
+
+        assert soup_found == splice_found
+        for f in sphinx_built.glob("*.html"):
+            assert str(
+                BeautifulSoup((soup_docs / f.name).read_text(), "html.parser")
+            ) == str(
+                BeautifulSoup(
+                    (splice_docs / f.name).read_text(), "html.parser"
+                )
+            )
+
+    def test_rest_untouched(self, tmp_path):
+        """
+        Apart from the inserted anchors, the file stays byte-for-byte the
+        same.
+        """
+        orig = (HERE / "function_example.html").read_bytes()
+        path = tmp_path / "f.html"
+        path.write_bytes(orig)
+        ref = "//apple_ref/cpp/Method/pyramid.config.Configurator.add_route"
+        p = InterSphinxParser(source=tmp_path, patch_engine="splice")
+
+        with p.make_patcher_for_file(path) as patch:
+            assert patch(
+                "pyramid.config.Configurator.add_route",
+                EntryType.METHOD,
+                "pyramid.config.Configurator.add_route",
+                ref,
+            )
+
+        patched = path.read_bytes()
+        tag = f'<a class="dashAnchor" name="{ref}"></a>'.encode()
+
+        assert 1 == patched.count(tag)
+        assert orig == patched.replace(tag, b"")
+
+    def test_escapes_ref(self, tmp_path):
+        """
+        Refs are escaped for use in an attribute.
+        """
+        path = tmp_path / "f.html"
+        path.write_text('<span id="x"></span>')
+        p = InterSphinxParser(source=tmp_path, patch_engine="splice")
+
+        with p.make_patcher_for_file(path) as patch:
+            assert patch("x", EntryType.FUNCTION, "x", '//a<b>&"c"')
+
+        assert (
+            '<a class="dashAnchor" name="//a&lt;b&gt;&amp;&quot;c&quot;"></a>'
+            '<span id="x"></span>'
+        ) == path.read_text()
+
+
+class TestMakePatcherForFile:
+    @pytest.mark.parametrize("engine", ["soup", "splice"])
+    def test_untouched_files_are_not_written(self, tmp_path, engine):
+        """
+        If no anchor is found, the file is not rewritten.
+        """
+        path = tmp_path / "f.html"
+        # BeautifulSoup would close the <p>.
+        path.write_text("<p>unclosed")
+        mtime = path.stat().st_mtime_ns
+        p = InterSphinxParser(source=tmp_path, patch_engine=engine)
+
+        with p.make_patcher_for_file(path) as patch:
+            assert not patch("x", EntryType.FUNCTION, "x", "//ref")
+
+        assert "<p>unclosed" == path.read_text()
+        assert mtime == path.stat().st_mtime_ns
+
+    @pytest.mark.parametrize("engine", ["soup", "splice"])
+    def test_reports_each_entry(self, tmp_path, engine):
+        """
+        After a successful patch, failing entries are still reported as such.
+        """
+        path = tmp_path / "f.html"
+        path.write_text('<span id="x"></span>')
+        p = InterSphinxParser(source=tmp_path, patch_engine=engine)
+
+        with p.make_patcher_for_file(path) as patch:
+            assert patch("x", EntryType.FUNCTION, "x", "//ref")
+            assert not patch("y", EntryType.FUNCTION, "y", "//ref")
+
+        assert (
+            '<a class="dashAnchor" name="//ref"></a><span id="x"></span>'
+            == path.read_text()
+        )
+
+
+class TestPatchFile:
+    @pytest.mark.parametrize("engine", ["soup", "splice"])
+    def test_same_as_patcher(self, tmp_path, sphinx_built, engine):
+        """
+        Patching all entries at once gives the same file and results as
+        patching them one by one.
+        """
+        p = InterSphinxParser(source=sphinx_built, patch_engine=engine)
+        entries = [
+            (e.name, e.type, e.path.split("#")[1], f"//ref/{e.name}")
+            for e in p.parse()
+            if e.path.startswith("index.html#")
+        ]
+        entries.append(("nope", EntryType.METHOD, "nope", "//ref/nope"))
+        one_by_one = tmp_path / "one_by_one.html"
+        at_once = tmp_path / "at_once.html"
+
+        with p.make_patcher_for_file(
+            sphinx_built / "index.html", dest=one_by_one
+        ) as patch:
+            expected = [patch(*e) for e in entries]
+
+        assert PatchResult(expected) == p.patch_file(
+            sphinx_built / "index.html", entries, dest=at_once
+        )
+        assert [True] * (len(entries) - 1) + [False] == expected
+        assert one_by_one.read_bytes() == at_once.read_bytes()
+
+    @pytest.mark.parametrize("engine", ["soup", "splice"])
+    def test_untouched_files_are_copied(self, tmp_path, engine):
+        """
+        If no anchor is found, the file is copied to dest unchanged.
+        """
+        path = tmp_path / "f.html"
+        path.write_text("<p>unclosed")
+        dest = tmp_path / "dest.html"
+        p = InterSphinxParser(source=tmp_path, patch_engine=engine)
+
+        assert PatchResult([False]) == p.patch_file(
+            path, [("x", EntryType.FUNCTION, "x", "//ref")], dest=dest
+        )
+        assert "<p>unclosed" == dest.read_text()
+
+
+def _all_entries(text):
+    """
+    Return entries for every anchor candidate in *text* with all the types
+    that are looked up differently, plus some that can't be found.
+    """
+    entries = []
+    for tag, attrs, _ in iter_start_tags(text):
+        if "id" in attrs:
+            for type in (EntryType.WORD, EntryType.SECTION, EntryType.METHOD):
+                entries.append((attrs["id"], type, attrs["id"]))
+        if attrs.get("href", "").startswith("#"):
+            entries.append(
+                (attrs["href"][1:], EntryType.METHOD, attrs["href"][1:])
+            )
+        if tag == "a" and "name" in attrs:
+            entries.append((attrs["name"], EntryType.CLASS, "nope"))
+    entries.append(("m", EntryType.PACKAGE, "module-m"))
+    entries.append(("x", EntryType.METHOD, "does-not-exist"))
+
+    return [(*e, f"//ref/{i}") for i, e in enumerate(entries)]
+
+
+class TestScanEngine:
+    @pytest.mark.parametrize(
+        "path",
+        [
+            HERE / "function_example.html",
+            HERE / "pydoctor_example.html",
+            HERE / "quirks_example.html",
+            *sorted(
+                (HERE / "example-sphinx-docs/built_docs/html").glob("*.html")
+            ),
+        ],
+        ids=lambda p: p.name,
+    )
+    def test_same_as_soup(self, tmp_path, path):
+        """
+        The scan engine finds the same anchors as the soup engine -- and
+        thus _find_entry_and_add_ref -- and inserts the TOC anchors at the
+        same places.
+        """
+        entries = _all_entries(path.read_text(encoding="utf-8"))
+        results = {}
+        for engine in ("soup", "scan"):
+            p = InterSphinxParser(source=path.parent, patch_engine=engine)
+            dest = tmp_path / engine
+            results[engine] = (
+                p.patch_file(path, entries, dest=dest),
+                str(BeautifulSoup(dest.read_text(), "html.parser")),
+            )
+
+        assert any(results["scan"][0].patched)
+        assert results["soup"] == results["scan"]
+
+    def test_falls_back(self, tmp_path, monkeypatch):
+        """
+        Only entries that can't be resolved by the scan need the full index.
+        """
+        path = tmp_path / "f.html"
+        path.write_text('<h1>M</h1><a name="n"></a><span id="x"></span>')
+        p = InterSphinxParser(source=tmp_path, patch_engine="scan")
+        from_html = intersphinx._AnchorIndex.from_html
+        calls = []
+
+        def fake_from_html(text):
+            calls.append(text)
+            return from_html(text)
+
+        monkeypatch.setattr(
+            intersphinx._AnchorIndex, "from_html", fake_from_html
+        )
+
+        assert PatchResult([True]) == p.patch_file(
+            path, [("x", EntryType.METHOD, "x", "//x")]
+        )
+        assert [] == calls
+
+        assert PatchResult([True, True, True]) == p.patch_file(
+            path,
+            [
+                ("x", EntryType.METHOD, "x", "//x"),
+                ("m", EntryType.PACKAGE, "module-m", "//m"),
+                ("n", EntryType.CLASS, "nope", "//n"),
+            ],
+        )
+        assert 1 == len(calls)
+
+    @pytest.mark.parametrize("engine", PATCH_ENGINES)
+    def test_make_patcher_for_file(self, tmp_path, engine):
+        """
+        All engines can be used through make_patcher_for_file, too.
+        """
+        path = tmp_path / "f.html"
+        path.write_text('<span id="x"></span>')
+        p = InterSphinxParser(source=tmp_path, patch_engine=engine)
+
+        with p.make_patcher_for_file(path) as patch:
+            assert patch("x", EntryType.FUNCTION, "x", "//ref")
+
+        assert "dashAnchor" in path.read_text()
+
+
 class TestIntersphinxDetect:
     def test_does_not_exist(self, tmp_path):
         """
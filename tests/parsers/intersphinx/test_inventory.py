@@ -2,6 +2,11 @@
 #
 # SPDX-License-Identifier: MIT
 
+import io
+import os
+import random
+import zlib
+
 from unittest.mock import Mock
 
 import pytest
@@ -9,9 +14,15 @@ import pytest
 from doc2dash.parsers import intersphinx_inventory
 from doc2dash.parsers.intersphinx_inventory import (
     CachedFileExists,
+    InventoryCache,
     _clean_up_path,
+    _iter_lines,
     _lines_to_tuples,
+    _match_inv_line,
+    _parse_line,
+    iter_inventory,
     load_inventory,
+    scan_tree,
 )
 
 
@@ -79,6 +90,103 @@ def test_parse_example(sphinx_built):
     } == entries
 
 
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 2**16])
+def test_iter_lines(chunk_size):
+    """
+    Lines are split like str.splitlines, regardless of where the chunks end.
+    """
+    text = "a b 1 x.html -\r\nä ö 1 ü.html -\rlast\n\nreally last ☃"
+
+    assert text.splitlines() == list(
+        _iter_lines(io.BytesIO(zlib.compress(text.encode())), chunk_size)
+    )
+
+
+def test_iter_lines_empty():
+    """
+    Empty inventories have no lines.
+    """
+    assert [] == list(_iter_lines(io.BytesIO(zlib.compress(b""))))
+
+
+@pytest.mark.parametrize("load", [load_inventory, iter_inventory])
+def test_truncated(tmp_path, load):
+    """
+    Truncated inventories raise an error instead of silently losing the
+    entries at their end.
+    """
+    _write_inventory(tmp_path, ["a std:label -1 a.html -"] * 1000)
+    inv = tmp_path / "objects.inv"
+    inv.write_bytes(inv.read_bytes()[:-10])
+
+    with pytest.raises(zlib.error, match="incomplete or truncated stream"):
+        list(load(tmp_path))
+
+
+def _random_lines(rnd, num):
+    """
+    Generate *num* inventory-ish lines: mostly well-formed ones with random
+    names, priorities, and separators, and some random soup.
+    """
+    words = ["a", "Foo.bar", "x$", "é", "a.html#$", "-", "1", "٣"]
+    prios = ["1", "1", "1", "-1", "0", "٣", "1a", "--1", "-"]
+    seps = [" "] * 6 + ["  ", "\t", " \t"]
+
+    def field(num_words):
+        return " ".join(rnd.choice(words) for _ in range(num_words))
+
+    for i in range(num):
+        if i % 4:
+            parts = [
+                field(rnd.choice([1, 1, 2])),
+                rnd.choice(["py:method", "std:term", "c:func"]),
+                rnd.choice(prios),
+                field(rnd.choice([0, 1, 1, 1])),
+                field(rnd.choice([1, 1, 2])),
+            ]
+            line = parts[0]
+            for part in parts[1:]:
+                line += rnd.choice(seps) + part
+        else:
+            line = "".join(
+                rnd.choice([*words, *seps, "#"])
+                for _ in range(rnd.randint(0, 12))
+            )
+
+        yield line.rstrip()
+
+
+def test_parse_line_matches_regex():
+    """
+    The fast path returns exactly what the regular expression returns.
+    """
+    for line in _random_lines(random.Random(42), 20_000):
+        m = _match_inv_line(line)
+
+        assert (m.groups() if m else None) == _parse_line(line), line
+
+
+@pytest.mark.parametrize(
+    ("line", "expected"),
+    [
+        (
+            "a.b py:method 1 api.html#$ -",
+            ("a.b", "py:method", "api.html#$", "-"),
+        ),
+        (
+            "multi word std:term -1 g.html#term-multi multi  word",
+            ("multi word", "std:term", "g.html#term-multi", "multi  word"),
+        ),
+        ("n r 1  u d", ("n", "r", "", "u d")),
+    ],
+)
+def test_parse_line(line, expected):
+    """
+    Names with spaces and odd separators are handled like Sphinx does.
+    """
+    assert expected == _parse_line(line)
+
+
 def test_missing_file(caplog):
     """
     If a file is missing, don't add it to the index.
@@ -156,3 +264,225 @@ class TestCachedFileExists:
             "intersphinx: path 'missing' is in objects.inv, but does not "
             "exist. Skipping."
         ] == caplog.messages
+
+    def test_scanned(self, tmp_path, monkeypatch):
+        """
+        If a scan is passed, the file system isn't asked at all.
+        """
+        monkeypatch.setattr(intersphinx_inventory, "Path", Mock())
+        cfe = CachedFileExists(tmp_path, frozenset({"a.html", "sub/b.html"}))
+
+        assert cfe("a.html")
+        assert cfe("sub/../sub/./b.html")
+        assert not cfe("b.html")
+        assert not cfe("A.html")
+        intersphinx_inventory.Path.assert_not_called()
+
+
+def test_scan_tree(tmp_path):
+    """
+    All files and directories are found, relative to the root.
+    """
+    (tmp_path / "sub" / "subsub").mkdir(parents=True)
+    (tmp_path / "a.html").write_text("a")
+    (tmp_path / "sub" / "subsub" / "b.html").write_text("b")
+
+    assert {
+        "a.html",
+        "sub",
+        "sub/subsub",
+        "sub/subsub/b.html",
+    } == scan_tree(tmp_path)
+
+
+def test_load_inventory_prescan(sphinx_built, monkeypatch):
+    """
+    Prescanning yields the same result without checking each path.
+    """
+    expected = load_inventory(sphinx_built)
+    monkeypatch.setattr(intersphinx_inventory, "Path", Mock())
+
+    assert expected == load_inventory(sphinx_built, prescan=True)
+
+
+class TestInventoryCache:
+    def test_roundtrip(self, tmp_path):
+        """
+        Stored records are returned, unknown keys miss.
+        """
+        cache = InventoryCache(tmp_path / "cache")
+        records = [("n", "py:class", "a.html", "a.html#n", "-")]
+
+        assert None is cache.get("k")
+
+        cache.put("k", records)
+
+        assert records == cache.get("k")
+        assert None is cache.get("other")
+
+    def test_corrupt(self, tmp_path, caplog):
+        """
+        Corrupt entries are removed and treated as misses.
+        """
+        cache = InventoryCache(tmp_path)
+        cache.put("k", [])
+        (entry,) = tmp_path.iterdir()
+        entry.write_bytes(b"nope")
+
+        assert None is cache.get("k")
+        assert not entry.exists()
+        assert [
+            f"Removing corrupt inventory cache entry '{entry}'."
+        ] == caplog.messages
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """
+        If the cache grows too big, the entries that were used least recently
+        are evicted.
+        """
+        records = [(str(i), "r", "p", "u", "d") for i in range(100)]
+        cache = InventoryCache(tmp_path, max_size=1)
+        cache.put("a", records)
+        size = next(tmp_path.iterdir()).stat().st_size
+        cache = InventoryCache(tmp_path, max_size=2 * size)
+        cache.put("b", records)
+        for i, e in enumerate(sorted(tmp_path.iterdir())):
+            os.utime(e, (i, i))
+
+        assert cache.get("a")  # a is now used most recently
+
+        cache.put("c", records)
+
+        assert cache.get("a")
+        assert None is cache.get("b")
+        assert cache.get("c")
+
+
+def test_load_inventory_cached(sphinx_built, tmp_path, monkeypatch):
+    """
+    On a cache hit, the inventory isn't parsed again, but the existence of
+    the indexed files is still checked.
+    """
+    cache = InventoryCache(tmp_path)
+    expected = load_inventory(sphinx_built)
+
+    assert expected == load_inventory(sphinx_built, cache=cache)
+
+    monkeypatch.setattr(intersphinx_inventory, "_parse_records", None)
+
+    assert expected == load_inventory(sphinx_built, cache=cache)
+
+    monkeypatch.setattr(
+        intersphinx_inventory.CachedFileExists, "__call__", lambda *_: False
+    )
+
+    assert {} == load_inventory(sphinx_built, cache=cache)
+
+
+def _write_inventory(path, lines):
+    """
+    Write an inventory consisting of *lines* into the directory *path*.
+    """
+    (path / "objects.inv").write_bytes(
+        b"# Sphinx inventory version 2\n"
+        b"# Project: test\n"
+        b"# Version: 1\n"
+        b"# The remainder of this file is compressed using zlib.\n"
+        + zlib.compress("\n".join(lines).encode())
+    )
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_iter_inventory(sphinx_built, tmp_path, cached):
+    """
+    iter_inventory yields the same entries as load_inventory.
+    """
+    cache = InventoryCache(tmp_path) if cached else None
+
+    assert {
+        (role, name, uri, display)
+        for role, entries in load_inventory(sphinx_built).items()
+        for name, (uri, display) in entries.items()
+    } == set(iter_inventory(sphinx_built, cache=cache))
+
+
+def test_iter_inventory_duplicates(tmp_path, caplog):
+    """
+    Like in load_inventory, the last existing entry for a role and a name
+    wins. Invalid lines are only warned about once.
+    """
+    (tmp_path / "a.html").touch()
+    _write_inventory(
+        tmp_path,
+        [
+            "x py:class 1 a.html#first -",
+            "y py:class 1 a.html -",
+            "yolo",
+            "x py:function 1 a.html -",
+            "x py:class 1 a.html#second -",
+            "y py:class 1 missing.html -",
+        ],
+    )
+
+    assert [
+        ("py:class", "y", "a.html", "-"),
+        ("py:function", "x", "a.html", "-"),
+        ("py:class", "x", "a.html#second", "-"),
+    ] == list(iter_inventory(tmp_path))
+    assert [
+        "intersphinx: path 'missing.html' is in objects.inv, but does not "
+        "exist. Skipping.",
+        "intersphinx: invalid line: 'yolo'. Skipping.",
+    ] == caplog.messages
+
+
+def test_iter_inventory_group_by_path(tmp_path):
+    """
+    With a cache, entries can be grouped by path -- the last entry for a
+    role and a name still wins.
+    """
+    (tmp_path / "a.html").touch()
+    (tmp_path / "b.html").touch()
+    _write_inventory(
+        tmp_path,
+        [
+            "x py:class 1 b.html#first -",
+            "y py:class 1 a.html -",
+            "z py:class 1 b.html -",
+            "x py:class 1 a.html#second -",
+        ],
+    )
+
+    assert [
+        ("py:class", "y", "a.html", "-"),
+        ("py:class", "x", "a.html#second", "-"),
+        ("py:class", "z", "b.html", "-"),
+    ] == list(
+        iter_inventory(
+            tmp_path,
+            cache=InventoryCache(tmp_path / "cache"),
+            group_by_path=True,
+        )
+    )
+
+
+def test_iter_inventory_group_by_path_needs_cache(tmp_path):
+    """
+    Without a cache, entries can't be grouped by path.
+    """
+    with pytest.raises(ValueError, match="needs an inventory cache"):
+        next(iter_inventory(tmp_path, group_by_path=True))
+
+
+def test_iter_inventory_is_lazy(tmp_path):
+    """
+    Entries are yielded one by one in the order of the inventory.
+    """
+    (tmp_path / "a.html").touch()
+    _write_inventory(
+        tmp_path, [f"n{i} py:class 1 a.html#n{i} -" for i in range(10)]
+    )
+    it = iter_inventory(tmp_path)
+
+    assert ("py:class", "n0", "a.html#n0", "-") == next(it)
+    assert 9 == len(list(it))
@@ -5,6 +5,8 @@
 from __future__ import annotations
 
 import logging
+import shutil
+import time
 
 from contextlib import contextmanager
 from pathlib import Path
@@ -13,8 +15,14 @@ from typing import ClassVar
 import attrs
 import pytest
 
-from doc2dash.parsers.patcher import patch_anchors
-from doc2dash.parsers.types import EntryType, ParserEntry
+from doc2dash import stats
+from doc2dash.parsers.intersphinx import InterSphinxParser
+from doc2dash.parsers.patcher import (
+    PendingEntries,
+    _mp_context,
+    patch_anchors,
+)
+from doc2dash.parsers.types import EntryType, ParserEntry, PatchResult
 
 
 @pytest.fixture(name="doc_entries")
@@ -74,6 +82,24 @@ class FakeParser:
         self._patcher_closed = True
 
 
+@attrs.define
+class LoggingFakeParser(FakeParser):
+    def patch_file(self, path, entries, *, dest=None):
+        logging.getLogger("doc2dash.test").warning("Patching %s.", path.name)
+
+        return PatchResult([True] * len(entries))
+
+
+@attrs.define
+class BusyFakeParser(FakeParser):
+    def patch_file(self, path, entries, *, dest=None):
+        start = time.process_time()
+        while time.process_time() - start < 0.05:
+            pass
+
+        return PatchResult([True] * len(entries))
+
+
 class TestPatchTOCAnchors:
     @pytest.mark.parametrize("progressbar", [True, False])
     def test_with_empty_db(self, progressbar):
@@ -146,3 +172,334 @@ class TestPatchTOCAnchors:
         ] == caplog.messages
 
         log.setLevel(old_level)
+
+
+@attrs.define
+class GroupedFakeParser(FakeParser):
+    grouped_by_file: ClassVar[bool] = True
+
+
+class TestPatchGrouped:
+    def test_patches_early(self, doc_entries):
+        """
+        If the parser's entries are grouped by file, a file is patched as
+        soon as the entries of the next one come in.
+        """
+        path, entries = doc_entries
+        parser = GroupedFakeParser(source=path)
+        toc = patch_anchors(parser, path, show_progressbar=False)
+        next(toc)
+
+        toc.send(entries[0])
+
+        assert [] == parser._patched_entries
+
+        toc.send(entries[2])
+
+        assert [("foo", EntryType.METHOD, "anchor-1")] == (
+            parser._patched_entries
+        )
+
+        toc.close()
+
+        assert 2 == len(parser._patched_entries)
+
+    def test_ungrouped(self, doc_entries, tmp_path, caplog):
+        """
+        Entries for a file that has been patched already are patched into
+        the patched file at the end.
+        """
+        caplog.set_level(logging.DEBUG, logger="doc2dash.parsers.patcher")
+        source, entries = doc_entries
+        docs = tmp_path / "docs"
+        parser = GroupedFakeParser(source=source)
+        toc = patch_anchors(
+            parser, docs, show_progressbar=False, source=source
+        )
+        next(toc)
+
+        toc.send(entries[0])
+        toc.send(entries[2])
+        toc.send(
+            ParserEntry(name="late", type=EntryType.CLASS, path="bar.html#l")
+        )
+        toc.close()
+
+        assert [
+            ("foo", EntryType.METHOD, "anchor-1"),
+            ("foo-url", EntryType.METHOD, "anchor-2"),
+            ("late", EntryType.CLASS, "l"),
+        ] == parser._patched_entries
+        assert "Entries of 1 files weren't grouped." in caplog.messages
+
+
+@attrs.define
+class BatchFakeParser(FakeParser):
+    calls: list = attrs.Factory(list)
+
+    def make_patcher_for_file(self, path):
+        raise NotImplementedError
+
+    def patch_file(self, path, entries, *, dest=None):
+        self.calls.append((path, list(entries), dest))
+
+        return PatchResult(
+            [anchor != "anchor-2" for _, _, anchor, _ in entries]
+        )
+
+
+class TestPatchFileHook:
+    def test_used_if_present(self, doc_entries, tmp_path, caplog):
+        """
+        If the parser has a patch_file method, it gets all entries of a file
+        at once -- together with their references -- and failures are
+        reported.
+        """
+        source, entries = doc_entries
+        docs = tmp_path / "docs"
+        parser = BatchFakeParser(source=source)
+        toc = patch_anchors(
+            parser, docs, show_progressbar=False, source=source
+        )
+        next(toc)
+        for e in entries:
+            toc.send(e)
+        toc.close()
+
+        assert [
+            (
+                source / "bar.html",
+                [
+                    (
+                        "foo",
+                        EntryType.METHOD,
+                        "anchor-1",
+                        "//apple_ref/cpp/Method/foo",
+                    )
+                ],
+                docs / "bar.html",
+            ),
+            (
+                source / "foo bar.html",
+                [
+                    (
+                        "foo-url",
+                        EntryType.METHOD,
+                        "anchor-2",
+                        "//apple_ref/cpp/Method/foo-url",
+                    )
+                ],
+                docs / "foo bar.html",
+            ),
+        ] == parser.calls
+        assert ["Failed to add anchors for 1 TOC entries."] == caplog.messages
+
+    def test_in_place(self, doc_entries):
+        """
+        Without a source, files are patched in place.
+        """
+        path, entries = doc_entries
+        parser = BatchFakeParser(source=path)
+        toc = patch_anchors(parser, path, show_progressbar=False)
+        next(toc)
+        toc.send(entries[0])
+        toc.close()
+
+        assert [(path / "bar.html", None)] == [
+            (p, dest) for p, _, dest in parser.calls
+        ]
+
+
+class TestParallelPatching:
+    def test_same_result_as_serial(self, tmp_path, sphinx_built, caplog):
+        """
+        Patching using a process pool yields the same files and the same
+        failure summary as patching serially.
+        """
+        serial = tmp_path / "serial"
+        parallel = tmp_path / "parallel"
+        shutil.copytree(sphinx_built, serial)
+        shutil.copytree(sphinx_built, parallel)
+        entries = [
+            *InterSphinxParser(source=sphinx_built).parse(),
+            ParserEntry("nope", EntryType.METHOD, "index.html#nope"),
+        ]
+
+        for path, jobs in ((serial, 1), (parallel, 2)):
+            toc = patch_anchors(
+                InterSphinxParser(source=path),
+                path,
+                show_progressbar=False,
+                jobs=jobs,
+            )
+            next(toc)
+            for e in entries:
+                toc.send(e)
+            toc.close()
+
+        for f in sphinx_built.glob("*.html"):
+            assert (serial / f.name).read_bytes() == (
+                parallel / f.name
+            ).read_bytes()
+        assert [
+            "Failed to add anchors for 1 TOC entries.",
+            "Failed to add anchors for 1 TOC entries.",
+        ] == caplog.messages
+
+    def test_unpicklable_parser(self, doc_entries, caplog):
+        """
+        If the parser can't be pickled, files are patched serially.
+        """
+        caplog.set_level(logging.DEBUG, logger="doc2dash.parsers.patcher")
+        path, entries = doc_entries
+        parser = FakeParser(source=path)
+        parser._patched_entries = [lambda: None]
+
+        toc = patch_anchors(parser, path, show_progressbar=False, jobs=2)
+        next(toc)
+        for e in entries:
+            toc.send(e)
+        toc.close()
+
+        assert 3 == len(parser._patched_entries)
+        assert any(
+            m.startswith("Can't pickle parser") for m in caplog.messages
+        )
+
+    def test_worker_logs(self, doc_entries, caplog):
+        """
+        What the pool's processes log is handled by this one.
+        """
+        path, entries = doc_entries
+
+        toc = patch_anchors(
+            LoggingFakeParser(source=path),
+            path,
+            show_progressbar=False,
+            jobs=2,
+        )
+        next(toc)
+        for e in entries:
+            toc.send(e)
+        toc.close()
+
+        assert {"Patching bar.html.", "Patching foo bar.html."} == set(
+            caplog.messages
+        )
+
+    def test_worker_stats(self, doc_entries):
+        """
+        The CPU time of the pool's processes is recorded -- they're not our
+        children, so it doesn't show up in our resource usage.
+        """
+        path, entries = doc_entries
+
+        with stats.recording() as s:
+            toc = patch_anchors(
+                BusyFakeParser(source=path),
+                path,
+                show_progressbar=False,
+                jobs=2,
+            )
+            next(toc)
+            for e in entries:
+                toc.send(e)
+            toc.close()
+
+        assert 2 == s.stages["patch"].items
+        assert s.stages["patch"].cpu >= 0.1
+        assert s.as_dict()["cpu"] >= 0.1
+
+    def test_pool_does_not_fork(self):
+        """
+        The pool's processes aren't forked from this one -- by then, the
+        search index is being written by another thread.
+        """
+        assert "fork" != _mp_context().get_start_method()
+
+
+class TestPatchFromSource:
+    def test_copies_if_parser_has_no_dest(self, doc_entries, tmp_path):
+        """
+        If the parser's make_patcher_for_file doesn't take a dest argument,
+        the file is copied from source before it's patched.
+        """
+        source, entries = doc_entries
+        docs = tmp_path / "docs"
+        parser = FakeParser(source=source)
+
+        toc = patch_anchors(
+            parser, docs, show_progressbar=False, source=source
+        )
+        next(toc)
+        for e in entries:
+            toc.send(e)
+        toc.close()
+
+        assert "docs!" == (docs / "bar.html").read_text()
+        assert "docs too!" == (docs / "foo bar.html").read_text()
+        assert 2 == len(parser._patched_entries)
+
+    def test_passes_dest(self, tmp_path, sphinx_built):
+        """
+        Parsers that support it get the source file and the destination
+        passed and the source stays untouched.
+        """
+        docs = tmp_path / "docs"
+        parser = InterSphinxParser(source=sphinx_built)
+        orig = (sphinx_built / "index.html").read_bytes()
+
+        toc = patch_anchors(
+            parser, docs, show_progressbar=False, source=sphinx_built
+        )
+        next(toc)
+        for e in parser.parse():
+            toc.send(e)
+        toc.close()
+
+        assert orig == (sphinx_built / "index.html").read_bytes()
+        assert b"dashAnchor" in (docs / "index.html").read_bytes()
+
+
+class TestPendingEntries:
+    def test_empty(self):
+        """
+        Nothing in, nothing out.
+        """
+        pending = PendingEntries()
+
+        assert 0 == len(pending)
+        assert 0 == pending.num_files()
+        assert [] == list(pending.items())
+
+    def test_groups_by_file(self):
+        """
+        Entries are returned grouped by their files, in the order they were
+        added -- including empty and non-ASCII strings.
+        """
+        pending = PendingEntries()
+        pending.append("a.html", "foo", EntryType.METHOD, "anchor-1")
+        pending.append("b.html", "bär", EntryType.CLASS, "")
+        pending.append("a.html", "", EntryType.GUIDE, "☃")
+        pending.append("a.html", "qux", EntryType.METHOD, "anchor-3")
+        pending.append("b.html", "same", EntryType.CLASS, "same")
+
+        assert 5 == len(pending)
+        assert 2 == pending.num_files()
+        assert [
+            (
+                "a.html",
+                [
+                    ("foo", EntryType.METHOD, "anchor-1"),
+                    ("", EntryType.GUIDE, "☃"),
+                    ("qux", EntryType.METHOD, "anchor-3"),
+                ],
+            ),
+            (
+                "b.html",
+                [
+                    ("bär", EntryType.CLASS, ""),
+                    ("same", EntryType.CLASS, "same"),
+                ],
+            ),
+        ] == list(pending.items())
@@ -0,0 +1,140 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+
+import pytest
+
+from doc2dash.parsers.splice import iter_start_tags, scan_start_tags, splice
+
+
+HTML_FILES = sorted(Path(__file__).parent.glob("**/*.html"))
+
+
+class TestIterStartTags:
+    def test_offsets(self):
+        """
+        Offsets point to the "<" of each start tag, across lines.
+        """
+        text = '<p>\n  <a  href="#x">x</a>\n<br/><span id=y>'
+
+        assert [
+            ("p", {}, 0),
+            ("a", {"href": "#x"}, 6),
+            ("br", {}, 26),
+            ("span", {"id": "y"}, 31),
+        ] == list(iter_start_tags(text))
+
+        for _, _, offset in iter_start_tags(text):
+            assert "<" == text[offset]
+
+    def test_attributes(self):
+        """
+        Attribute values are unescaped, valueless attributes are empty, and
+        the last duplicate wins.
+        """
+        assert [
+            ("a", {"href": "#a&b", "hidden": "", "id": "2"}, 0),
+        ] == list(iter_start_tags('<a href="#a&amp;b" hidden id=1 id=2>'))
+
+    def test_ignores_script(self):
+        """
+        Markup within <script> is not reported.
+        """
+        assert ["script", "p"] == [
+            t for t, _, _ in iter_start_tags('<script>"<a>"</script><p>')
+        ]
+
+
+class TestScanStartTags:
+    def test_only_wanted(self):
+        """
+        Only tags with a wanted id or a wanted local href are yielded --
+        regardless of case, quoting, and escaping.
+        """
+        text = (
+            '<P ID="x"><a href="#x">'
+            "<a href=#y><span id='a&amp;b'><a href=\"x\"><i id=z></i>"
+        )
+
+        assert [
+            ("p", {"id": "x"}, 0),
+            ("a", {"href": "#x"}, 10),
+            ("a", {"href": "#y"}, 23),
+            ("span", {"id": "a&b"}, 34),
+        ] == list(scan_start_tags(text, {"x", "y", "a&b"}))
+
+    def test_skips_comments_and_raw_text(self):
+        """
+        Tags in comments, <script>, and <style> are skipped, as are ">"s
+        within attribute values.
+        """
+        text = (
+            '<!-- <p id="x"> --><script>"<p id=\'x\'>"</script>'
+            '<style>/* <p id="x"> */</style><a title="<p id=x>" href="#x">'
+        )
+
+        assert [
+            ("a", {"title": "<p id=x>", "href": "#x"}, text.index("<a ")),
+        ] == list(scan_start_tags(text, {"x"}))
+
+    def test_bare_values_with_quotes(self):
+        """
+        Like in HTMLParser, a quote only starts a value right after an "=",
+        so quotes within bare values don't swallow the following tags.
+        """
+        text = "<a href=#o title=it's>o</a><dt id='x'>"
+
+        assert [
+            ("a", {"href": "#o", "title": "it's"}, 0),
+            ("dt", {"id": "x"}, text.index("<dt")),
+        ] == list(scan_start_tags(text, {"o", "x"}))
+
+    def test_unterminated_tag(self):
+        """
+        A start tag that never ends doesn't make the scan backtrack
+        exponentially.
+        """
+        assert [] == list(scan_start_tags("<a " + "x= " * 5000, {"x"}))
+
+    @pytest.mark.parametrize("path", HTML_FILES, ids=lambda p: p.name)
+    def test_same_as_iter_start_tags(self, path):
+        """
+        For real documents, the same tags are found as by the tokenizer.
+        """
+        text = path.read_text(encoding="utf-8")
+        tags = list(iter_start_tags(text))
+        values = {
+            v.removeprefix("#")
+            for _, attrs, _ in tags
+            for k, v in attrs.items()
+            if k in ("id", "href")
+        }
+
+        assert [
+            (tag, attrs, offset)
+            for tag, attrs, offset in tags
+            if attrs.get("id") in values
+            or (
+                attrs.get("href", "").startswith("#")
+                and attrs["href"][1:] in values
+            )
+        ] == list(scan_start_tags(text, values))
+
+
+class TestSplice:
+    def test_splice(self):
+        """
+        Markup is inserted at the offsets, in the order it was passed for the
+        same offset, and the rest is untouched.
+        """
+        assert "<x><y>ab<z>c" == splice(
+            "abc", [(2, "<z>"), (0, "<x>"), (0, "<y>")]
+        )
+
+    def test_nothing(self):
+        """
+        Without insertions, the text is returned unchanged.
+        """
+        assert "abc" == splice("abc", [])
@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+import gzip
+import io
+import random
+import sqlite3
+import tarfile
+import zlib
+
+import pytest
+
+from doc2dash.archive import (
+    TARIX_ARCHIVE,
+    TARIX_INDEX,
+    ParallelGzipWriter,
+    write_tarix,
+    write_tgz,
+)
+
+
+@pytest.fixture(name="docset")
+def _docset(tmp_path):
+    docset = tmp_path / "foo.docset"
+    docs = docset / "Contents" / "Resources" / "Documents"
+    (docs / "sub").mkdir(parents=True)
+    (docs / "index.html").write_text("index" * 1000)
+    (docs / "sub" / "a.html").write_text("a")
+    (docset / "Contents" / "Resources" / "docSet.dsidx").write_text("db")
+
+    return docset
+
+
+class TestParallelGzipWriter:
+    @pytest.mark.parametrize("independent", [False, True])
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_roundtrip(self, workers, independent):
+        """
+        The result is a valid gzip stream, regardless of the number of blocks
+        and how the data is written.
+        """
+        data = random.Random(42).randbytes(300_000) + b"x" * 300_000
+        f = io.BytesIO()
+        gz = ParallelGzipWriter(
+            f, workers=workers, block_size=50_000, independent=independent
+        )
+
+        gz.write(data[:1])
+        gz.start_block()
+        gz.write(data[1:123_456])
+        gz.write(data[123_456:])
+        gz.close()
+
+        assert data == gzip.decompress(f.getvalue())
+        assert len(data) == gz.tell()
+
+    def test_start_block(self):
+        """
+        Decompression can start at the offset of each block.
+        """
+        f = io.BytesIO()
+        gz = ParallelGzipWriter(f, workers=2, independent=True)
+
+        gz.write(b"a" * 1000)
+        block = gz.start_block()
+        gz.write(b"b" * 1000)
+        gz.close()
+
+        assert b"b" * 1000 == zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+            f.getvalue()[gz.block_offset(block) :]
+        )
+
+    def test_primed_blocks(self):
+        """
+        Blocks that are primed with the data before them compress about as
+        well as one serial stream -- unlike independent ones.
+        """
+        rnd = random.Random(42)
+        chunk = rnd.randbytes(1000)
+        data = b"".join(chunk + rnd.randbytes(10) for _ in range(300))
+        sizes = {}
+        for independent in (False, True):
+            f = io.BytesIO()
+            with ParallelGzipWriter(
+                f, workers=2, block_size=100_000, independent=independent
+            ) as gz:
+                gz.write(data)
+
+            assert data == gzip.decompress(f.getvalue())
+            sizes[independent] = len(f.getvalue())
+
+        assert sizes[False] < 1.1 * len(gzip.compress(data)) < sizes[True]
+
+    def test_error_shuts_down_pool(self):
+        """
+        If an error occurs within the context, the pool is shut down without
+        finishing the stream.
+        """
+        f = io.BytesIO()
+
+        with pytest.raises(ValueError), ParallelGzipWriter(f, workers=2) as gz:
+            gz.write(b"x")
+            raise ValueError
+
+        with pytest.raises(RuntimeError):
+            gz._pool.submit(print)
+
+
+def test_write_tgz(tmp_path, docset):
+    """
+    The tree is packed below its name and the archive is the only new file.
+    """
+    write_tgz(docset, tmp_path / "foo.tgz", workers=2)
+
+    with tarfile.open(tmp_path / "foo.tgz") as tar:
+        assert [
+            "foo.docset",
+            "foo.docset/Contents",
+            "foo.docset/Contents/Resources",
+            "foo.docset/Contents/Resources/Documents",
+            "foo.docset/Contents/Resources/docSet.dsidx",
+            "foo.docset/Contents/Resources/Documents/sub",
+            "foo.docset/Contents/Resources/Documents/index.html",
+            "foo.docset/Contents/Resources/Documents/sub/a.html",
+        ] == tar.getnames()
+        assert (
+            b"a"
+            == tar.extractfile(
+                "foo.docset/Contents/Resources/Documents/sub/a.html"
+            ).read()
+        )
+    assert {"foo.docset", "foo.tgz"} == {p.name for p in tmp_path.iterdir()}
+
+
+def test_write_tarix(docset):
+    """
+    The documentation is replaced by an archive and an index that points to
+    each member.
+    """
+    resources = docset / "Contents" / "Resources"
+
+    write_tarix(docset, workers=2)
+
+    assert {"docSet.dsidx", TARIX_ARCHIVE, TARIX_INDEX} == {
+        p.name for p in resources.iterdir()
+    }
+
+    raw = (resources / TARIX_ARCHIVE).read_bytes()
+    with sqlite3.connect(resources / TARIX_INDEX) as db_conn:
+        index = dict(db_conn.execute("SELECT path, hash FROM tarindex"))
+
+    block, offset, num_blocks = map(
+        int,
+        index["foo.docset/Contents/Resources/Documents/index.html"].split(),
+    )
+    member = zlib.decompressobj(-zlib.MAX_WBITS).decompress(raw[offset:])[
+        : num_blocks * tarfile.BLOCKSIZE
+    ]
+    info = tarfile.TarInfo.frombuf(
+        member[: tarfile.BLOCKSIZE], "utf-8", "surrogateescape"
+    )
+
+    assert "foo.docset/Contents/Resources/Documents/index.html" == info.name
+    assert b"index" * 1000 == member[tarfile.BLOCKSIZE :][: info.size]
+
+    with tarfile.open(resources / TARIX_ARCHIVE) as tar:
+        assert list(index) == tar.getnames()
+        assert block * tarfile.BLOCKSIZE == (
+            tar.getmember(
+                "foo.docset/Contents/Resources/Documents/index.html"
+            ).offset
+        )
@@ -0,0 +1,239 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+
+from typing import ClassVar
+
+import attrs
+import pytest
+
+from doc2dash import convert, docsets
+from doc2dash.convert import convert_docs
+from doc2dash.copying import Excludes
+from doc2dash.parsers.types import EntryType, ParserEntry
+
+
+@attrs.define
+class FakeParser:
+    source: str
+    entries: list[ParserEntry]
+
+    name: ClassVar[str] = "FakeParser"
+
+    @staticmethod
+    def detect(path):
+        return True
+
+    def parse(self):
+        yield from self.entries
+
+    def make_patcher_for_file(self, path):
+        raise NotImplementedError
+
+
+@pytest.fixture(name="docset")
+def _docset(tmp_path):
+    db_conn = sqlite3.connect(tmp_path / "docSet.dsidx")
+    db_conn.execute(
+        "CREATE TABLE searchIndex(id INTEGER PRIMARY KEY, name TEXT, "
+        "type TEXT, path TEXT)"
+    )
+
+    return docsets.DocSet(path=tmp_path, plist=None, db_conn=db_conn)
+
+
+class TestConvertDocs:
+    @pytest.mark.parametrize("batch_size", [1, 2, 3, 100])
+    def test_batches(self, docset, batch_size, caplog):
+        """
+        All entries are inserted, regardless of the batch size, and counted.
+        """
+        caplog.set_level(logging.INFO)
+        entries = [
+            ParserEntry(name=f"e{i}", type=EntryType.CLASS, path=f"{i}.html")
+            for i in range(5)
+        ]
+
+        convert_docs(
+            parser=FakeParser("src", entries),
+            docset=docset,
+            quiet=True,
+            batch_size=batch_size,
+        )
+
+        assert [e.as_tuple() for e in entries] == docset.db_conn.execute(
+            "SELECT name, type, path FROM searchIndex ORDER BY id"
+        ).fetchall()
+        assert "Added [green]5[/green] index entries." in caplog.messages
+
+    @pytest.mark.parametrize("path", [":memory:", ""])
+    def test_in_memory(self, tmp_path, path, caplog):
+        """
+        Databases that can't be opened by another connection are written to
+        using the docset's connection.
+        """
+        caplog.set_level(logging.INFO)
+        db_conn = sqlite3.connect(path)
+        db_conn.execute(
+            "CREATE TABLE searchIndex(id INTEGER PRIMARY KEY, name TEXT, "
+            "type TEXT, path TEXT)"
+        )
+        entries = [
+            ParserEntry(name=f"e{i}", type=EntryType.CLASS, path=f"{i}.html")
+            for i in range(20)
+        ]
+
+        convert_docs(
+            parser=FakeParser("src", entries),
+            docset=docsets.DocSet(path=tmp_path, plist=None, db_conn=db_conn),
+            quiet=True,
+            batch_size=1,
+        )
+
+        assert [e.as_tuple() for e in entries] == db_conn.execute(
+            "SELECT name, type, path FROM searchIndex ORDER BY id"
+        ).fetchall()
+        assert "Added [green]20[/green] index entries." in caplog.messages
+
+    def test_restores_pragmas(self, docset):
+        """
+        After loading, the connection's original settings are restored.
+        """
+
+        def pragmas():
+            return [
+                docset.db_conn.execute(f"PRAGMA {p}").fetchone()[0]
+                for p in ("journal_mode", "synchronous", "cache_size")
+            ]
+
+        before = pragmas()
+
+        convert_docs(parser=FakeParser("src", []), docset=docset, quiet=True)
+
+        assert before == pragmas()
+
+    def test_duplicates_and_vacuum(self, docset, caplog):
+        """
+        Duplicates are removed and not counted, and the database can be
+        vacuumed afterwards.
+        """
+        caplog.set_level(logging.INFO)
+        entry = ParserEntry(name="e", type=EntryType.CLASS, path="e.html")
+
+        convert_docs(
+            parser=FakeParser("src", [entry, entry]),
+            docset=docset,
+            quiet=True,
+            vacuum=True,
+            page_size=1024,
+        )
+
+        assert [entry.as_tuple()] == docset.db_conn.execute(
+            "SELECT name, type, path FROM searchIndex"
+        ).fetchall()
+        assert "Added [green]1[/green] index entries." in caplog.messages
+        assert 1024 == docset.db_conn.execute("PRAGMA page_size").fetchone()[0]
+
+    def test_excludes(self, docset):
+        """
+        Entries pointing into excluded files are dropped.
+        """
+        entries = [
+            ParserEntry(name="a", type=EntryType.CLASS, path="a.html"),
+            ParserEntry(
+                name="b", type=EntryType.CLASS, path="old%20api/b.html"
+            ),
+            ParserEntry(name="c", type=EntryType.CLASS, path="_sources/c.txt"),
+        ]
+
+        convert_docs(
+            parser=FakeParser("src", entries),
+            docset=docset,
+            quiet=True,
+            excludes=Excludes(("_sources", "old api")),
+        )
+
+        assert [("a",)] == docset.db_conn.execute(
+            "SELECT name FROM searchIndex"
+        ).fetchall()
+
+    def test_inserts_in_thread(self, docset, monkeypatch):
+        """
+        Entries are inserted by a separate thread.
+        """
+        threads = set()
+        insert = convert._insert
+
+        def fake_insert(db_conn, batch):
+            threads.add(threading.current_thread().name)
+            return insert(db_conn, batch)
+
+        monkeypatch.setattr(convert, "_insert", fake_insert)
+        entries = [
+            ParserEntry(name=f"e{i}", type=EntryType.CLASS, path=f"{i}.html")
+            for i in range(3)
+        ]
+
+        convert_docs(
+            parser=FakeParser("src", entries),
+            docset=docset,
+            quiet=True,
+            batch_size=1,
+        )
+
+        assert threading.current_thread().name not in threads
+        assert all(t.startswith("doc2dash-index") for t in threads)
+
+    def test_insert_fails(self, docset, monkeypatch):
+        """
+        If inserting fails, the error is raised once parsing is done --
+        even if parsing produces more batches than the queue holds.
+        """
+
+        def fake_insert(db_conn, batch):
+            raise sqlite3.OperationalError("nope")
+
+        monkeypatch.setattr(convert, "_insert", fake_insert)
+        entries = [
+            ParserEntry(name=f"e{i}", type=EntryType.CLASS, path=f"{i}.html")
+            for i in range(100)
+        ]
+
+        with pytest.raises(sqlite3.OperationalError, match="nope"):
+            convert_docs(
+                parser=FakeParser("src", entries),
+                docset=docset,
+                quiet=True,
+                batch_size=1,
+            )
+
+    def test_parse_fails(self, docset):
+        """
+        If parsing fails, the error is raised and nothing is committed.
+        """
+
+        class FailingParser(FakeParser):
+            def parse(self):
+                yield from self.entries
+                raise ValueError("nope")
+
+        entry = ParserEntry(name="e", type=EntryType.CLASS, path="e.html")
+
+        with pytest.raises(ValueError, match="nope"):
+            convert_docs(
+                parser=FailingParser("src", [entry]),
+                docset=docset,
+                quiet=True,
+                batch_size=1,
+            )
+
+        assert (
+            []
+            == docset.db_conn.execute("SELECT * FROM searchIndex").fetchall()
+        )
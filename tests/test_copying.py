@@ -0,0 +1,321 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+import errno
+import os
+
+import pytest
+
+from doc2dash import copying
+from doc2dash.copying import (
+    CopyMode,
+    CopyStats,
+    Excludes,
+    copy_files,
+    copy_tree,
+    ensure_own_copy,
+    make_copy_function,
+)
+
+
+@pytest.fixture(name="src")
+def _src(tmp_path):
+    src = tmp_path / "src.html"
+    src.write_text("docs!")
+
+    return src
+
+
+def _not_supported(src, dst):
+    raise OSError(errno.EOPNOTSUPP, "nope")
+
+
+class TestMakeCopyFunction:
+    def test_copy(self, src, tmp_path):
+        """
+        Copies are independent files.
+        """
+        dst = tmp_path / "dst.html"
+
+        make_copy_function(CopyMode.COPY)(str(src), str(dst))
+
+        assert "docs!" == dst.read_text()
+        assert not os.path.samefile(src, dst)
+
+    def test_hardlink(self, src, tmp_path):
+        """
+        Hardlinks share their data with the source.
+        """
+        dst = tmp_path / "dst.html"
+
+        make_copy_function(CopyMode.HARDLINK)(str(src), str(dst))
+
+        assert os.path.samefile(src, dst)
+
+    def test_hardlink_across_file_systems(
+        self, src, tmp_path, monkeypatch, caplog
+    ):
+        """
+        If the docset is on another file system, files are copied with a
+        single warning.
+        """
+
+        def link(src, dst):
+            raise OSError(errno.EXDEV, "cross-device link")
+
+        monkeypatch.setattr(os, "link", link)
+        copy = make_copy_function(CopyMode.HARDLINK)
+
+        copy(str(src), str(tmp_path / "a.html"))
+        copy(str(src), str(tmp_path / "b.html"))
+
+        assert "docs!" == (tmp_path / "a.html").read_text()
+        assert "docs!" == (tmp_path / "b.html").read_text()
+        assert [
+            "Can't hardlink across file systems; falling back to copying."
+        ] == [r.message for r in caplog.records if r.levelname == "WARNING"]
+
+    def test_hardlink_other_errors(self, src, tmp_path):
+        """
+        Other errors while hardlinking are raised.
+        """
+        with pytest.raises(FileNotFoundError):
+            make_copy_function(CopyMode.HARDLINK)(
+                str(tmp_path / "missing"), str(tmp_path / "d")
+            )
+
+    @pytest.mark.parametrize(
+        ("mode", "messages"),
+        [
+            (
+                CopyMode.REFLINK,
+                [
+                    (
+                        "Can't clone files (Operation not supported); falling "
+                        "back to copying."
+                    )
+                ],
+            ),
+            (CopyMode.AUTO, []),
+        ],
+    )
+    def test_reflink_fallback(
+        self, src, tmp_path, monkeypatch, caplog, mode, messages
+    ):
+        """
+        If the file system doesn't support cloning, files are copied. Only an
+        explicit request for reflinks warns -- and only once.
+        """
+        monkeypatch.setattr(copying, "reflink", _not_supported)
+        copy = make_copy_function(mode)
+
+        copy(str(src), str(tmp_path / "a.html"))
+        copy(str(src), str(tmp_path / "b.html"))
+
+        assert "docs!" == (tmp_path / "a.html").read_text()
+        assert "docs!" == (tmp_path / "b.html").read_text()
+        assert messages == [
+            r.message for r in caplog.records if r.levelname == "WARNING"
+        ]
+
+    def test_reflink_other_errors(self, src, tmp_path, monkeypatch):
+        """
+        Errors that don't indicate missing support are raised.
+        """
+
+        def reflink(src, dst):
+            raise OSError(errno.ENOSPC, "full")
+
+        monkeypatch.setattr(copying, "reflink", reflink)
+
+        with pytest.raises(OSError, match="full"):
+            make_copy_function(CopyMode.AUTO)(str(src), str(tmp_path / "d"))
+
+    def test_reflink(self, src, tmp_path):
+        """
+        If the file system supports it, files are cloned.
+        """
+        dst = tmp_path / "dst.html"
+        try:
+            copying.reflink(str(src), str(dst))
+        except OSError as e:
+            if e.errno not in copying._NOT_SUPPORTED:
+                raise
+            assert not dst.exists()
+            pytest.skip("file system doesn't support reflinks")
+
+        assert "docs!" == dst.read_text()
+        assert not os.path.samefile(src, dst)
+        assert src.stat().st_mtime == dst.stat().st_mtime
+
+
+class TestEnsureOwnCopy:
+    def test_breaks_hardlink(self, src, tmp_path):
+        """
+        A hardlinked file is replaced by an independent copy.
+        """
+        dst = tmp_path / "dst.html"
+        os.link(src, dst)
+
+        ensure_own_copy(dst)
+        dst.write_text("patched!")
+
+        assert "docs!" == src.read_text()
+        assert 1 == src.stat().st_nlink
+
+    def test_leaves_own_files_alone(self, src):
+        """
+        Files without other links are left alone.
+        """
+        ino = src.stat().st_ino
+
+        ensure_own_copy(src)
+
+        assert ino == src.stat().st_ino
+
+
+class TestCopyTree:
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_copies_like_copytree(self, tmp_path, workers):
+        """
+        Files and directories are copied including their metadata.
+        """
+        source = tmp_path / "source"
+        (source / "a" / "b").mkdir(parents=True)
+        (source / "x.html").write_text("x")
+        (source / "a" / "y.html").write_text("yy")
+        (source / "a" / "b" / "z.css").write_text("zzz")
+        (source / "empty").mkdir()
+        for p in (source / "a" / "b" / "z.css", source / "a" / "b"):
+            os.utime(p, (1_000_000, 1_000_000))
+        dest = tmp_path / "dest"
+
+        stats = copy_tree(source, dest, workers=workers)
+
+        assert 3 == stats.files
+        assert 6 == stats.bytes
+        assert "x" == (dest / "x.html").read_text()
+        assert "yy" == (dest / "a" / "y.html").read_text()
+        assert "zzz" == (dest / "a" / "b" / "z.css").read_text()
+        assert (dest / "empty").is_dir()
+        assert 1_000_000 == (dest / "a" / "b" / "z.css").stat().st_mtime
+        assert 1_000_000 == (dest / "a" / "b").stat().st_mtime
+
+    def test_ignore(self, tmp_path):
+        """
+        Names returned by ignore are neither copied nor descended into.
+        """
+        source = tmp_path / "source"
+        (source / "skip").mkdir(parents=True)
+        (source / "skip" / "a.html").write_text("a")
+        (source / "b.html").write_text("b")
+        (source / "c.html").write_text("c")
+        dest = tmp_path / "dest"
+
+        copy_tree(source, dest, ignore=lambda d, names: {"skip", "c.html"})
+
+        assert ["b.html"] == [p.name for p in dest.iterdir()]
+
+    def test_copy_function(self, tmp_path):
+        """
+        The passed copy function is used.
+        """
+        source = tmp_path / "source"
+        source.mkdir()
+        (source / "a.html").write_text("a")
+        dest = tmp_path / "dest"
+
+        copy_tree(source, dest, copy_function=os.link)
+
+        assert os.path.samefile(source / "a.html", dest / "a.html")
+
+    def test_stats_str(self):
+        """
+        Stats are human-readable.
+        """
+        assert "2 files (3.0 MiB) in 2.00s (1.5 MiB/s)" == str(
+            CopyStats(files=2, bytes=3 * 2**20, seconds=2.0)
+        )
+
+
+def test_copy_files_replaces(tmp_path):
+    """
+    copy_files copies only the passed files, creating directories as needed,
+    and replaces existing files instead of writing through hardlinks.
+    """
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    (source / "sub" / "a.html").write_text("new")
+    (source / "b.html").write_text("b")
+    dest = tmp_path / "dest"
+    (dest / "sub").mkdir(parents=True)
+    (dest / "sub" / "a.html").write_text("old")
+    linked = tmp_path / "linked"
+    os.link(dest / "sub" / "a.html", linked)
+
+    stats = copy_files(source, dest, ["sub/a.html"], copy_function=os.link)
+
+    assert 1 == stats.files
+    assert os.path.samefile(source / "sub" / "a.html", dest / "sub" / "a.html")
+    assert "old" == linked.read_text()
+    assert not (dest / "b.html").exists()
+
+
+class TestExcludes:
+    @pytest.mark.parametrize(
+        "path",
+        [
+            "_sources",
+            "_sources/index.rst.txt",
+            "sub/.buildinfo",
+            "api/_sources/x.txt",
+            "static/old/a.js",
+        ],
+    )
+    def test_excluded(self, path):
+        """
+        Patterns without a slash match any component, patterns with a slash
+        match relative paths and everything below them.
+        """
+        assert Excludes(("_sources", ".build*", "static/old"))(path)
+
+    @pytest.mark.parametrize(
+        "path", ["index.html", "sources/a.txt", "x/static/old/a.js"]
+    )
+    def test_not_excluded(self, path):
+        """
+        Paths that match no pattern are not excluded.
+        """
+        assert not Excludes(("_sources", ".build*", "static/old"))(path)
+
+    def test_bool(self):
+        """
+        Excludes without patterns are falsy.
+        """
+        assert not Excludes()
+        assert Excludes(("x",))
+
+    def test_make_ignore(self, tmp_path):
+        """
+        The ignore callable works relative to the root and can be used with
+        copy_tree.
+        """
+        source = tmp_path / "source"
+        (source / "_sources").mkdir(parents=True)
+        (source / "_sources" / "a.txt").write_text("a")
+        (source / "static" / "old").mkdir(parents=True)
+        (source / "static" / "old" / "b.js").write_text("b")
+        (source / "static" / "c.js").write_text("c")
+        (source / "index.html").write_text("i")
+        dest = tmp_path / "dest"
+
+        copy_tree(
+            source,
+            dest,
+            ignore=Excludes(("_sources", "static/old")).make_ignore(source),
+        )
+
+        assert {"index.html", "static", "static/c.js"} == {
+            p.relative_to(dest).as_posix() for p in dest.rglob("*")
+        }
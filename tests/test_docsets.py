@@ -2,13 +2,17 @@
 #
 # SPDX-License-Identifier: MIT
 
+import os
 import shutil
 import sqlite3
 
 from pathlib import Path
 from unittest.mock import Mock
 
-from doc2dash import docsets
+import pytest
+
+from doc2dash import docsets, stats
+from doc2dash.copying import Excludes
 
 
 class TestPrepareDocset:
@@ -293,3 +297,293 @@ class TestPrepareDocset:
         )
 
         assert (Path(dest) / "icon@2x.png").exists()
+
+    def test_stats_keep_copy_path(self, monkeypatch, tmp_path, sphinx_built):
+        """
+        Recording statistics doesn't change how the docs are copied, but the
+        copy is still measured.
+        """
+        copytree = Mock(wraps=shutil.copytree)
+        monkeypatch.setattr(shutil, "copytree", copytree)
+
+        with stats.recording() as recorded:
+            docsets.prepare_docset(
+                sphinx_built,
+                tmp_path / "bar",
+                name="foo",
+                index_page=None,
+                enable_js=False,
+                online_redirect_url=None,
+                playground_url=None,
+                icon=None,
+                icon_2x=None,
+                full_text_search=docsets.FullTextSearch.OFF,
+            )
+
+        copytree.assert_called_once()
+        assert recorded.stages["copy"].items > 0
+        assert recorded.counters["bytes_copied"] > 0
+
+
+class TestCopyDocs:
+    def test_skips_existing(self, tmp_path):
+        """
+        Files that already exist in the destination are not overwritten, all
+        others are copied.
+        """
+        source = tmp_path / "source"
+        (source / "sub").mkdir(parents=True)
+        (source / "a.html").write_text("a")
+        (source / "sub" / "b.html").write_text("b")
+        (source / "sub" / "c.css").write_text("c")
+        docs = tmp_path / "docs"
+        (docs / "sub").mkdir(parents=True)
+        (docs / "sub" / "b.html").write_text("patched b")
+
+        docsets.copy_docs(source, docs)
+
+        assert "a" == (docs / "a.html").read_text()
+        assert "patched b" == (docs / "sub" / "b.html").read_text()
+        assert "c" == (docs / "sub" / "c.css").read_text()
+
+    def test_prepare_without_copy(self, tmp_path, sphinx_built):
+        """
+        If copy_docs is False, prepare_docset doesn't copy the docs.
+        """
+        docset = docsets.prepare_docset(
+            sphinx_built,
+            tmp_path / "bar",
+            name="foo",
+            index_page=None,
+            enable_js=False,
+            online_redirect_url=None,
+            playground_url=None,
+            icon=None,
+            icon_2x=None,
+            full_text_search=docsets.FullTextSearch.OFF,
+            copy_docs=False,
+        )
+
+        assert not docset.docs.exists()
+
+    def test_excludes(self, tmp_path, sphinx_built):
+        """
+        Excluded files are neither copied by prepare_docset nor by copy_docs.
+        """
+        source = tmp_path / "source"
+        shutil.copytree(sphinx_built, source)
+        (source / "_sources").mkdir()
+        (source / "_sources" / "index.rst.txt").write_text("src")
+        (source / ".buildinfo").write_text("info")
+
+        docset = docsets.prepare_docset(
+            source,
+            tmp_path / "bar",
+            name="foo",
+            index_page=None,
+            enable_js=False,
+            online_redirect_url=None,
+            playground_url=None,
+            icon=None,
+            icon_2x=None,
+            full_text_search=docsets.FullTextSearch.OFF,
+            excludes=Excludes(("_sources", ".buildinfo")),
+        )
+
+        assert (docset.docs / "index.html").exists()
+        assert not (docset.docs / "_sources").exists()
+        assert not (docset.docs / ".buildinfo").exists()
+
+        docs = tmp_path / "docs"
+        docsets.copy_docs(source, docs, excludes=Excludes((".buildinfo",)))
+
+        assert (docs / "_sources" / "index.rst.txt").exists()
+        assert not (docs / ".buildinfo").exists()
+
+
+def _make_db(path, rows):
+    db_conn = sqlite3.connect(path)
+    db_conn.execute(
+        "CREATE TABLE searchIndex(id INTEGER PRIMARY KEY, name TEXT, "
+        "type TEXT, path TEXT)"
+    )
+    db_conn.executemany("INSERT INTO searchIndex VALUES (NULL, ?, ?, ?)", rows)
+    db_conn.commit()
+
+    return db_conn
+
+
+class TestFinalizeDB:
+    def test_creates_index(self, tmp_path):
+        """
+        The unique anchor index is created and statistics are collected.
+        """
+        db_conn = _make_db(
+            tmp_path / "db",
+            [("a", "Class", "a.html"), ("b", "Class", "a.html")],
+        )
+
+        assert 0 == docsets.finalize_db(db_conn)
+        assert (
+            "CREATE UNIQUE INDEX anchor ON searchIndex (name, type, path)"
+            == db_conn.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'anchor'"
+            ).fetchone()[0]
+        )
+        assert db_conn.execute("SELECT * FROM sqlite_stat1").fetchall()
+
+    def test_removes_duplicates(self, tmp_path):
+        """
+        Duplicate entries are removed, keeping the first one.
+        """
+        db_conn = _make_db(
+            tmp_path / "db",
+            [
+                ("a", "Class", "a.html"),
+                ("b", "Class", "a.html"),
+                ("a", "Class", "a.html"),
+                ("a", "Method", "a.html"),
+                ("a", "Class", "a.html"),
+            ],
+        )
+
+        assert 2 == docsets.finalize_db(db_conn)
+        assert [
+            (1, "a", "Class"),
+            (2, "b", "Class"),
+            (4, "a", "Method"),
+        ] == db_conn.execute(
+            "SELECT id, name, type FROM searchIndex ORDER BY id"
+        ).fetchall()
+
+
+class TestBuildAtomically:
+    def test_new(self, tmp_path):
+        """
+        If the destination doesn't exist, the build is moved into place and
+        nothing else is left behind.
+        """
+        dest = tmp_path / "sub" / "foo.docset"
+
+        with docsets.build_atomically(dest) as build:
+            assert dest.name == build.name
+            assert dest.parent == build.parent.parent
+            build.mkdir()
+            (build / "new").write_text("new")
+
+        assert ["new"] == [p.name for p in dest.iterdir()]
+        assert ["foo.docset"] == [p.name for p in dest.parent.iterdir()]
+
+    def test_replace(self, tmp_path, monkeypatch):
+        """
+        An existing destination is only replaced once the build is done and
+        then removed in the background.
+        """
+        dest = tmp_path / "foo.docset"
+        dest.mkdir()
+        (dest / "old").write_text("old")
+        threads = []
+        remove_in_background = docsets.remove_in_background
+        monkeypatch.setattr(
+            docsets,
+            "remove_in_background",
+            lambda p: threads.append(remove_in_background(p)),
+        )
+
+        with docsets.build_atomically(dest) as build:
+            build.mkdir()
+            (build / "new").write_text("new")
+
+            assert (dest / "old").exists()
+
+        assert 1 == len(threads)
+        threads[0].join()
+
+        assert ["new"] == [p.name for p in dest.iterdir()]
+        assert ["foo.docset"] == [p.name for p in tmp_path.iterdir()]
+
+    def test_failure(self, tmp_path):
+        """
+        If the build fails, the destination is left alone and the build is
+        removed.
+        """
+        dest = tmp_path / "foo.docset"
+        dest.mkdir()
+
+        with pytest.raises(ValueError), docsets.build_atomically(dest) as b:
+            b.mkdir()
+            raise ValueError
+
+        assert ["foo.docset"] == [p.name for p in tmp_path.iterdir()]
+
+    def test_swap_fails(self, tmp_path, monkeypatch):
+        """
+        If the build can't be moved into place, the existing destination is
+        restored and the build is removed.
+        """
+        dest = tmp_path / "foo.docset"
+        dest.mkdir()
+        (dest / "old").write_text("old")
+        replace = os.replace
+
+        def fake_replace(src, dst):
+            if Path(src) == build:
+                raise OSError("nope")
+
+            replace(src, dst)
+
+        monkeypatch.setattr(docsets.os, "replace", fake_replace)
+
+        with (
+            pytest.raises(OSError, match="nope"),
+            docsets.build_atomically(dest) as build,
+        ):
+            build.mkdir()
+            (build / "new").write_text("new")
+
+        assert ["old"] == [p.name for p in dest.iterdir()]
+        assert ["foo.docset"] == [p.name for p in tmp_path.iterdir()]
+
+
+class TestSyncIndex:
+    def test_sync(self, tmp_path):
+        """
+        Rows that stay are left alone, stale and duplicate rows are removed,
+        and new ones are added.
+        """
+        db_conn = _make_db(
+            tmp_path / "db",
+            [
+                ("a", "Class", "a.html"),
+                ("b", "Class", "a.html"),
+                ("a", "Class", "a.html"),
+            ],
+        )
+
+        assert (1, 2) == docsets.sync_index(
+            db_conn, [("a", "Class", "a.html"), ("c", "Class", "c.html")]
+        )
+        assert [
+            (1, "a", "Class", "a.html"),
+            (2, "c", "Class", "c.html"),
+        ] == db_conn.execute(
+            "SELECT * FROM searchIndex ORDER BY name"
+        ).fetchall()
+
+
+class TestVacuumDB:
+    def test_page_size(self, tmp_path):
+        """
+        The database is rebuilt using the passed page size.
+        """
+        db_conn = _make_db(tmp_path / "db", [("a", "Class", "a.html")])
+
+        docsets.vacuum_db(db_conn, 8192)
+
+        assert 8192 == db_conn.execute("PRAGMA page_size").fetchone()[0]
+        assert (
+            1
+            == db_conn.execute("SELECT COUNT(1) FROM searchIndex").fetchone()[
+                0
+            ]
+        )
@@ -5,11 +5,15 @@
 from __future__ import annotations
 
 import errno
+import json
 import logging
 import os
+import shutil
 import sqlite3
 import subprocess
 import sys
+import tarfile
+import threading
 
 from pathlib import Path
 from typing import ClassVar
@@ -24,6 +28,7 @@ import doc2dash
 
 from doc2dash import __main__ as main
 from doc2dash import docsets
+from doc2dash.parsers.intersphinx import InterSphinxParser
 from doc2dash.parsers.types import EntryType, ParserEntry
 
 
@@ -51,6 +56,7 @@ def test_intersphinx(runner: CliRunner, tmp_path: Path, sphinx_built: Path):
     )
 
     assert "Can't find anchor" not in result.output
+    assert "Copied " in result.output
 
     docset = tmp_path / "sphinx-example.docset"
     contents = docset / "Contents"
@@ -115,6 +121,341 @@ def test_intersphinx(runner: CliRunner, tmp_path: Path, sphinx_built: Path):
     } == rows
 
 
+@pytest.mark.parametrize("engine", ["soup", "splice"])
+def test_fused_copy(runner, tmp_path, sphinx_built, engine):
+    """
+    Patching while copying results in the same docset as copying and
+    patching afterwards.
+    """
+    for d, args in (("copied", []), ("fused", ["--fused-copy"])):
+        result = runner.invoke(
+            main.main,
+            [
+                str(sphinx_built),
+                "-d",
+                str(tmp_path / d),
+                "--patch-engine",
+                engine,
+                *args,
+            ],
+            catch_exceptions=False,
+        )
+
+        assert 0 == result.exit_code, result.output
+
+    copied = tmp_path / "copied" / "sphinx-example.docset"
+    fused = tmp_path / "fused" / "sphinx-example.docset"
+    files = sorted(
+        p.relative_to(copied) for p in copied.rglob("*") if p.is_file()
+    )
+
+    assert files == sorted(
+        p.relative_to(fused) for p in fused.rglob("*") if p.is_file()
+    )
+    for f in files:
+        if f.suffix == ".html":
+            assert (copied / f).read_bytes() == (fused / f).read_bytes()
+
+
+def test_hardlinks_leave_source_alone(runner, tmp_path, sphinx_built):
+    """
+    If files are hardlinked, patching them doesn't modify the source.
+    """
+    source = tmp_path / "source"
+    shutil.copytree(sphinx_built, source)
+    orig = (source / "index.html").read_bytes()
+
+    result = runner.invoke(
+        main.main,
+        [str(source), "-d", str(tmp_path), "--copy-mode", "hardlink"],
+        catch_exceptions=False,
+    )
+
+    docs = tmp_path / "sphinx-example.docset/Contents/Resources/Documents"
+
+    assert 0 == result.exit_code, result.output
+    assert orig == (source / "index.html").read_bytes()
+    assert b"dashAnchor" in (docs / "index.html").read_bytes()
+    assert os.path.samefile(source / "objects.inv", docs / "objects.inv")
+
+
+def test_excludes(runner, tmp_path, sphinx_built):
+    """
+    --exclude-defaults leaves out the parser's useless files and --exclude
+    adds more.
+    """
+    source = tmp_path / "source"
+    shutil.copytree(sphinx_built, source)
+    (source / "_sources").mkdir()
+    (source / "_sources" / "index.rst.txt").write_text("src")
+    (source / ".buildinfo").write_text("info")
+
+    result = runner.invoke(
+        main.main,
+        [
+            str(source),
+            "-d",
+            str(tmp_path),
+            "--exclude-defaults",
+            "--exclude",
+            "glossary.html",
+        ],
+        catch_exceptions=False,
+    )
+
+    docs = tmp_path / "sphinx-example.docset/Contents/Resources/Documents"
+
+    assert 0 == result.exit_code, result.output
+    assert (docs / "index.html").exists()
+    assert not (docs / "_sources").exists()
+    assert not (docs / ".buildinfo").exists()
+    assert not (docs / "glossary.html").exists()
+
+    with sqlite3.connect(docs.parent / "docSet.dsidx") as db_conn:
+        assert not db_conn.execute(
+            "SELECT 1 FROM searchIndex WHERE path LIKE 'glossary.html%'"
+        ).fetchall()
+
+
+def test_update(runner, tmp_path, sphinx_built):
+    """
+    --update creates a docset that's identical to a fresh one and afterwards
+    only touches files that changed.
+    """
+    source = tmp_path / "source"
+    shutil.copytree(sphinx_built, source)
+
+    def build(dest, *args):
+        result = runner.invoke(
+            main.main,
+            [str(source), "-d", str(tmp_path / dest), *args],
+            catch_exceptions=False,
+        )
+        assert 0 == result.exit_code, result.output
+
+        return tmp_path / dest / "sphinx-example.docset/Contents/Resources"
+
+    def snapshot(resources):
+        docs = resources / "Documents"
+        return {
+            p.relative_to(docs).as_posix(): (p.read_bytes(), p.stat().st_ino)
+            for p in docs.rglob("*")
+            if p.is_file()
+        }
+
+    def index(resources):
+        with sqlite3.connect(resources / "docSet.dsidx") as db_conn:
+            return db_conn.execute(
+                "SELECT id, name, type, path FROM searchIndex"
+            ).fetchall()
+
+    fresh = build("fresh")
+    updated = build("updated", "--update")
+
+    assert {k: v[0] for k, v in snapshot(fresh).items()} == {
+        k: v[0] for k, v in snapshot(updated).items()
+    }
+    assert sorted(r[1:] for r in index(fresh)) == sorted(
+        r[1:] for r in index(updated)
+    )
+
+    before = snapshot(updated)
+    rows = index(updated)
+    (source / "glossary.html").write_text("<html><body>new</body></html>")
+    (source / "search.html").unlink()
+    (source / "new.html").write_text("new")
+
+    build("updated", "--update")
+    after = snapshot(updated)
+
+    assert b"new" in after.pop("glossary.html")[0]
+    assert b"new" == after.pop("new.html")[0]
+    before.pop("glossary.html")
+    before.pop("search.html")
+    assert before == after
+    assert [r for r in rows if r[3] != "search.html"] == index(updated)
+
+    # A normal build writes a manifest, so updating it touches nothing.
+    normal = build("normal")
+    before = snapshot(normal)
+    build("normal", "--update")
+
+    assert before == snapshot(normal)
+
+    # Changing the patch engine rebuilds all patched files.
+    build("normal", "--update", "--patch-engine", "splice")
+
+    assert before.keys() == snapshot(normal).keys()
+    assert before["index.html"] != snapshot(normal)["index.html"]
+
+
+def test_force_replaces(runner, tmp_path, sphinx_built):
+    """
+    --force replaces an existing docset and leaves no temporary files behind.
+    """
+    docset = tmp_path / "sphinx-example.docset"
+    docset.mkdir()
+    (docset / "old").write_text("old")
+
+    result = runner.invoke(
+        main.main,
+        [str(sphinx_built), "-d", str(tmp_path), "--force"],
+        catch_exceptions=False,
+    )
+    for t in threading.enumerate():
+        if t.name.startswith("doc2dash-remove-"):
+            t.join()
+
+    assert 0 == result.exit_code, result.output
+    assert not (docset / "old").exists()
+    assert (docset / "Contents" / "Resources" / "docSet.dsidx").exists()
+    assert ["sphinx-example.docset"] == [p.name for p in tmp_path.iterdir()]
+
+
+def test_archive_and_tarix(runner, tmp_path, sphinx_built):
+    """
+    --tarix compresses the documentation inside the docset and --archive packs
+    the whole docset.
+    """
+    result = runner.invoke(
+        main.main,
+        [str(sphinx_built), "-d", str(tmp_path), "--archive", "--tarix"],
+        catch_exceptions=False,
+    )
+
+    resources = tmp_path / "sphinx-example.docset/Contents/Resources"
+
+    assert 0 == result.exit_code, result.output
+    assert not (resources / "Documents").exists()
+    with tarfile.open(resources / "tarix.tgz") as tar:
+        assert b"dashAnchor" in (
+            tar.extractfile(
+                "sphinx-example.docset/Contents/Resources/Documents/index.html"
+            ).read()
+        )
+    with tarfile.open(tmp_path / "sphinx-example.tgz") as tar:
+        assert (
+            "sphinx-example.docset/Contents/Resources/tarixIndex.db"
+            in tar.getnames()
+        )
+
+
+def test_stats(runner, tmp_path, sphinx_built):
+    """
+    --stats prints a table of the stages and --stats-json writes them as
+    JSON.
+    """
+    stats_json = tmp_path / "stats.json"
+    result = runner.invoke(
+        main.main,
+        [
+            str(sphinx_built),
+            "-d",
+            str(tmp_path),
+            "--archive",
+            "--stats",
+            "--stats-json",
+            str(stats_json),
+        ],
+        catch_exceptions=False,
+    )
+
+    assert 0 == result.exit_code, result.output
+    assert "Statistics" in result.output
+    assert "peak RSS" in result.output
+
+    stats = json.loads(stats_json.read_text())
+
+    assert {"copy", "parse", "index", "patch", "archive"} <= set(
+        stats["stages"]
+    )
+    assert 18 == stats["stages"]["parse"]["items"]
+    assert 18 == stats["stages"]["index"]["items"]
+    assert 2 == stats["stages"]["patch"]["items"]
+    assert stats["counters"]["bytes_copied"] > 0
+    assert stats["counters"]["bytes_read"] > 0
+
+
+def test_no_stats(runner, tmp_path, sphinx_built):
+    """
+    Without --stats, nothing is recorded or printed.
+    """
+    result = runner.invoke(
+        main.main,
+        [str(sphinx_built), "-d", str(tmp_path)],
+        catch_exceptions=False,
+    )
+
+    assert 0 == result.exit_code, result.output
+    assert "Statistics" not in result.output
+
+
+def test_inventory_cache(runner, tmp_path, sphinx_built):
+    """
+    --inventory-cache stores parsed inventories in the passed directory and
+    --prescan works with it. The files that are patched from the grouped
+    entries are the same as without a cache.
+    """
+    cache = tmp_path / "cache"
+    result = runner.invoke(
+        main.main,
+        [str(sphinx_built), "-d", str(tmp_path / "plain")],
+        catch_exceptions=False,
+    )
+    assert 0 == result.exit_code, result.output
+    for i in range(2):
+        result = runner.invoke(
+            main.main,
+            [
+                str(sphinx_built),
+                "-d",
+                str(tmp_path / str(i)),
+                "--prescan",
+                "--inventory-cache",
+                str(cache),
+            ],
+            catch_exceptions=False,
+        )
+
+        assert 0 == result.exit_code, result.output
+        assert "Added 18 index entries." in result.output
+
+    assert 1 == len(list(cache.glob("*.inv")))
+    plain = tmp_path / "plain" / "sphinx-example.docset"
+    cached = tmp_path / "0" / "sphinx-example.docset"
+    for f in plain.rglob("*.html"):
+        assert f.read_bytes() == (cached / f.relative_to(plain)).read_bytes()
+
+
+def test_force_and_update_conflict(runner, tmp_path):
+    """
+    --force and --update are mutually exclusive.
+    """
+    result = runner.invoke(main.main, [str(tmp_path), "-f", "--update"])
+
+    assert 1 == result.exit_code
+    assert "makes no sense" in result.output
+
+
+@pytest.mark.parametrize(
+    ("args", "message"),
+    [
+        (["--vacuum", "--page-size", "1000"], "1000 is not a power of two."),
+        (["--vacuum", "--page-size", "256"], "512<=x<=65536"),
+        (["--page-size", "4096"], "only works together with --vacuum."),
+    ],
+)
+def test_invalid_page_size(runner, tmp_path, args, message):
+    """
+    --page-size must be a power of two in SQLite's range and is only allowed
+    with --vacuum.
+    """
+    result = runner.invoke(main.main, [str(tmp_path), *args])
+
+    assert 2 == result.exit_code
+    assert message in result.output
+
+
 class TestArguments:
     def test_fails_with_unknown_icon(self, runner, tmp_path):
         """
@@ -202,8 +543,16 @@ def test_normal_flow(monkeypatch, tmp_path, runner):
         icon,
         icon_2x,
         full_text_search,
+        copy_docs,
+        copy_mode,
+        copy_workers,
+        excludes,
+        update,
     ):
         os.mkdir(dest)
+        (tmp_path / "Contents" / "Resources").mkdir(
+            parents=True, exist_ok=True
+        )
         db_conn = sqlite3.connect(":memory:")
         db_conn.row_factory = sqlite3.Row
         db_conn.execute(
@@ -244,7 +593,6 @@ def test_normal_flow(monkeypatch, tmp_path, runner):
     expected = f"""\
 Converting testtype docs from '{src}' to '{{name}}.docset'.
 Parsing documentation...
-Added 1 index entries.
 """
 
     # alternative 1: use --parser
@@ -267,10 +615,10 @@ Added 1 index entries.
         catch_exceptions=False,
     )
 
-    assert (
-        expected.format(name="bah")
-        == result.output.split("Patching for TOCs...")[0]
-    ), result.output.split("Patching for TOCs...")[0]
+    before, after = result.output.split("Patching for TOCs...")
+    assert expected.format(name="bah") == before
+    # The index is finished while the files are patched.
+    assert "Added 1 index entries." in after
     assert 0 == result.exit_code
     assert (("open", "-a", "dash", Path("bah.docset")),) == run_mock.call_args[
         0
@@ -288,10 +636,9 @@ Added 1 index entries.
         catch_exceptions=False,
     )
 
-    assert (
-        expected.format(name="bar")
-        == result.output.split("Patching for TOCs...")[0]
-    )
+    before, after = result.output.split("Patching for TOCs...")
+    assert expected.format(name="bar") == before
+    assert "Added 1 index entries." in after
     assert 0 == result.exit_code
     assert (("open", "-a", "dash", Path("bar.docset")),) == run_mock.call_args[
         0
@@ -343,6 +690,43 @@ Added 1 index entries.
     assert 2 == result.exit_code
 
 
+class TestMakeParser:
+    def test_no_options(self, tmp_path):
+        """
+        Without options, the parser is instantiated with the source only.
+        """
+        parser = main.make_parser(InterSphinxParser, tmp_path, {})
+
+        assert InterSphinxParser(tmp_path) == parser
+
+    def test_options(self, tmp_path):
+        """
+        Options are passed to the parser.
+        """
+        parser = main.make_parser(
+            InterSphinxParser, tmp_path, {"html_parser": "auto"}
+        )
+
+        assert "auto" == parser.html_parser
+
+    def test_unsupported_options(self, tmp_path, caplog):
+        """
+        If the parser doesn't support an option, exit with EINVAL.
+        """
+
+        @attrs.define
+        class FakeParser:
+            source: Path
+
+        with pytest.raises(SystemExit) as e:
+            main.make_parser(FakeParser, tmp_path, {"html_parser": "lxml"})
+
+        assert errno.EINVAL == e.value.code
+        assert caplog.messages[0].endswith(
+            "doesn't support the option(s): --html-parser."
+        )
+
+
 class TestSetupPaths:
     def test_works(self, tmp_path):
         """
@@ -396,10 +780,20 @@ class TestSetupPaths:
             )
         assert e.value.code == errno.EEXIST
 
-        main.setup_destination(
+        assert Path("foo.docset") == main.setup_destination(
+            destination=Path("."),
+            name="foo",
+            force=False,
+            add_to_global=False,
+            update=True,
+        )
+        assert os.path.lexists("foo.docset")
+
+        assert Path("foo.docset") == main.setup_destination(
             destination=Path("."),
             name="foo",
             force=True,
             add_to_global=False,
         )
-        assert not os.path.lexists("foo.docset")
+        # It's replaced after the new docset has been built.
+        assert os.path.lexists("foo.docset")
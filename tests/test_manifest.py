@@ -0,0 +1,98 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+import hashlib
+
+from doc2dash.copying import Excludes
+from doc2dash.manifest import (
+    MANIFEST_NAME,
+    AnchorDigests,
+    Manifest,
+    digest_anchors,
+    hash_files,
+)
+from doc2dash.parsers.types import EntryType
+
+
+class TestManifest:
+    def test_roundtrip(self, tmp_path):
+        """
+        Saved manifests can be loaded.
+        """
+        m = Manifest({"parser": "p"}, {"a.html": "h"}, {"a.html": "d"})
+
+        m.save(tmp_path)
+
+        assert m == Manifest.load(tmp_path)
+        assert [MANIFEST_NAME] == [p.name for p in tmp_path.iterdir()]
+
+    def test_missing(self, tmp_path):
+        """
+        Without a manifest, None is returned.
+        """
+        assert None is Manifest.load(tmp_path)
+
+    def test_incompatible(self, tmp_path, caplog):
+        """
+        Corrupt manifests and such from other versions are ignored.
+        """
+        (tmp_path / MANIFEST_NAME).write_text('{"version": 0}')
+
+        assert None is Manifest.load(tmp_path)
+
+        (tmp_path / MANIFEST_NAME).write_text("{")
+
+        assert None is Manifest.load(tmp_path)
+        assert [
+            f"Ignoring corrupt manifest in '{tmp_path}'."
+        ] == caplog.messages
+
+
+def test_hash_files(tmp_path):
+    """
+    All files that aren't excluded are hashed, keyed by relative POSIX paths.
+    """
+    (tmp_path / "sub" / "_sources").mkdir(parents=True)
+    (tmp_path / "a.html").write_bytes(b"a")
+    (tmp_path / "sub" / "b.html").write_bytes(b"b")
+    (tmp_path / "sub" / "_sources" / "c.txt").write_bytes(b"c")
+
+    assert {
+        "a.html": hashlib.sha256(b"a").hexdigest(),
+        "sub/b.html": hashlib.sha256(b"b").hexdigest(),
+    } == hash_files(tmp_path, Excludes(("_sources",)), workers=2)
+
+
+def test_digest_anchors():
+    """
+    The contents and the order of the anchors matter.
+    """
+    a = ("a", EntryType.CLASS, "anchor-a")
+    b = ("b", EntryType.METHOD, "anchor-b")
+
+    assert digest_anchors([a, b]) == digest_anchors([a, b])
+    assert digest_anchors([a, b]) != digest_anchors([b, a])
+    assert digest_anchors([a, b]) != digest_anchors([a])
+    assert digest_anchors([a]) != digest_anchors(
+        [("a", EntryType.FUNCTION, "anchor-a")]
+    )
+
+
+def test_anchor_digests():
+    """
+    AnchorDigests computes the same digests as digest_anchors, per file and
+    regardless of how the anchors of different files are interleaved.
+    """
+    a = ("a", EntryType.CLASS, "anchor-a")
+    b = ("b", EntryType.METHOD, "anchor-b")
+    digests = AnchorDigests()
+
+    digests.add("x.html", *b)
+    digests.add("y.html", *a)
+    digests.add("x.html", *a)
+
+    assert {
+        "x.html": digest_anchors([b, a]),
+        "y.html": digest_anchors([a]),
+    } == digests.as_dict()
@@ -0,0 +1,190 @@
+# SPDX-FileCopyrightText: 2012 Hynek Schlawack <hs@ox.cx>
+#
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+
+from rich.console import Console
+
+from doc2dash import stats
+from doc2dash.copying import CopyStats
+
+
+class TestStats:
+    def test_stage(self):
+        """
+        Stages accumulate their wall time and the items they report.
+        """
+        s = stats.Stats()
+
+        with s.stage("parse", "entries"):
+            time.sleep(0.01)
+        with s.stage("parse", "entries"):
+            time.sleep(0.01)
+        s.add_items("parse", 42, "entries")
+
+        parse = s.stages["parse"]
+
+        assert parse.wall >= 0.02
+        assert 0 <= parse.cpu < parse.wall
+        assert 42 == parse.items
+        assert "entries" == parse.unit
+        assert 42 / parse.wall == parse.rate
+
+    def test_nested_stages_are_exclusive(self):
+        """
+        A nested stage pauses the outer one.
+        """
+        s = stats.Stats()
+
+        with s.stage("outer"), s.stage("inner"):
+            time.sleep(0.05)
+
+        assert s.stages["inner"].wall >= 0.05
+        assert s.stages["outer"].wall < 0.05
+
+    def test_threads(self):
+        """
+        Stages in different threads don't pause each other.
+        """
+        s = stats.Stats()
+
+        def other():
+            with s.stage("index"):
+                time.sleep(0.05)
+
+        with s.stage("parse"):
+            t = threading.Thread(target=other)
+            t.start()
+            t.join()
+
+        assert s.stages["parse"].wall >= 0.05
+        assert s.stages["index"].wall >= 0.05
+
+    def test_add_process(self):
+        """
+        The CPU time of other processes is added to the stage and the total,
+        and their peak RSS counts if it's larger than ours.
+        """
+        s = stats.Stats()
+
+        s.add_process("patch", 10.0, 2**50, "files")
+        s.add_process("patch", 5.0, 2**20, "files")
+        s.add_process("patch", 1.0, None, "files")
+        d = s.as_dict()
+
+        assert 16.0 == s.stages["patch"].cpu
+        assert "files" == s.stages["patch"].unit
+        assert d["cpu"] >= 16.0
+        assert 2**50 == d["peak_rss"]
+
+    def test_no_rate_without_items(self):
+        """
+        Stages without items have no rate.
+        """
+        s = stats.Stats()
+
+        with s.stage("vacuum"):
+            pass
+
+        assert None is s.stages["vacuum"].rate
+
+    def test_as_dict(self):
+        """
+        The dict is JSON-serializable and contains stages and counters.
+        """
+        s = stats.Stats()
+        with s.stage("copy", "files"):
+            pass
+        s.add_items("copy", 3, "files")
+        s.count("bytes_copied", 2**20)
+
+        d = json.loads(json.dumps(s.as_dict()))
+
+        assert {"wall", "cpu", "peak_rss", "stages", "counters"} == d.keys()
+        assert 3 == d["stages"]["copy"]["items"]
+        assert "files" == d["stages"]["copy"]["unit"]
+        assert {"bytes_copied": 2**20} == d["counters"]
+        assert d["peak_rss"] > 0
+
+    def test_to_table(self):
+        """
+        The table lists stages, totals, counters, and the peak RSS.
+        """
+        s = stats.Stats()
+        with s.stage("copy", "files"):
+            pass
+        s.add_items("copy", 3, "files")
+        s.count("bytes_copied", 3 * 2**20)
+        console = Console(width=200, record=True)
+
+        console.print(s.to_table())
+        out = console.export_text()
+
+        assert "copy" in out
+        assert "3 files" in out
+        assert "bytes copied" in out
+        assert "3.0 MiB" in out
+        assert "peak RSS" in out
+
+
+class TestRecording:
+    def test_inactive(self):
+        """
+        Without a recording, the module-level functions do nothing.
+        """
+        assert None is stats.active()
+
+        with stats.stage("parse"):
+            pass
+        stats.add_items("parse", 1)
+        stats.count("bytes_read", 1)
+
+        assert None is stats.active()
+
+    def test_in_stage(self):
+        """
+        Functions that are wrapped by in_stage add the CPU time of the thread
+        that runs them to the stage -- if a recording is active.
+        """
+
+        def busy(n):
+            start = time.thread_time()
+            while time.thread_time() - start < 0.05:
+                pass
+
+            return n
+
+        assert busy is stats.in_stage("copy", busy)
+
+        with stats.recording() as s:
+            t = threading.Thread(
+                target=stats.in_stage("copy", busy, "files"), args=(1,)
+            )
+            t.start()
+            t.join()
+
+        assert s.stages["copy"].cpu >= 0.05
+        assert 0 == s.stages["copy"].wall
+        assert "files" == s.stages["copy"].unit
+
+    def test_recording(self):
+        """
+        Within a recording, the module-level functions report into it.
+        """
+        with stats.recording() as s:
+            assert s is stats.active()
+
+            with stats.stage("parse", "entries"):
+                pass
+            stats.add_items("parse", 2, "entries")
+            stats.record_copy(CopyStats(files=3, bytes=42, seconds=1.0))
+
+        assert None is stats.active()
+        assert 2 == s.stages["parse"].items
+        assert 3 == s.stages["copy"].items
+        assert {"bytes_copied": 42} == s.counters